@@ -0,0 +1,330 @@
+"""Benchmark the core flows of the app.
+
+Seeds a throwaway database with recipes and users, then drives the recipe
+index, add_recipe, register, login and confirm_email through the Flask
+test client (or a real threaded WSGI server with --server) and reports
+p50/p95/p99 latency and requests/sec for each, counting as errors the
+responses other than the one a working flow gives, along with the time taken
+to import the package and to create the app in a fresh interpreter.
+Results are written as JSON so runs on different commits can be diffed, e.g.:
+
+    python benchmark.py --recipes 100000 --users 1000 --output before.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.error import HTTPError
+from urllib.parse import urlencode, urlparse
+from urllib.request import HTTPRedirectHandler, build_opener
+
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from werkzeug.serving import make_server
+
+from project import create_app, db, passwords
+from project.bulk import batched, insert_rows, recipe_rows, user_rows
+from project.models import Category, Recipe, User
+
+
+SCENARIOS = ('index', 'add_recipe', 'register', 'login', 'confirm_email')
+PASSWORD = 'benchmark-password'
+CATEGORIES = ('Breakfast', 'Lunch', 'Dinner', 'Dessert')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--recipes', type=int, default=1000,
+                        help='recipes to seed (default: %(default)s)')
+    parser.add_argument('--users', type=int, default=1000,
+                        help='users to seed (default: %(default)s)')
+    parser.add_argument('--requests', type=int, default=200,
+                        help='requests per scenario (default: %(default)s)')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--database',
+                        help='database URI to seed; it is dropped and recreated '
+                             '(default: a temporary SQLite file)')
+    parser.add_argument('--bcrypt-rounds', type=int, default=4,
+                        help='bcrypt cost used while benchmarking (default: %(default)s)')
+    parser.add_argument('--server', action='store_true',
+                        help='send requests over HTTP to a threaded WSGI server '
+                             'instead of using the test client')
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='concurrent clients with --server (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+    if not args.users and set(args.scenarios) & {'login', 'confirm_email'}:
+        parser.error('the login and confirm_email scenarios need --users above 0')
+    if 'confirm_email' in args.scenarios and args.requests > args.users:
+        parser.error('the confirm_email scenario confirms each user once, so it '
+                     'needs --users of at least --requests')
+    return args
+
+
+STARTUP_SCRIPT = '''
+import time
+started = time.perf_counter()
+import project
+imported = time.perf_counter()
+project.create_app()
+print(imported - started, time.perf_counter() - imported)
+'''
+
+
+def create_benchmark_app(args):
+    return create_app({
+        'TESTING': True,
+        'WTF_CSRF_ENABLED': False,
+        'DEBUG': False,
+        'MAIL_SUPPRESS_SEND': True,
+        'BCRYPT_LOG_ROUNDS': args.bcrypt_rounds,
+        # every request comes from one address, so only bcrypt is measured
+        'RATELIMIT_ENABLED': False,
+        'SQLALCHEMY_DATABASE_URI': args.database or 'sqlite:///' + os.path.join(
+            tempfile.mkdtemp(), 'benchmark.db'),
+    })
+
+
+def measure_startup(runs=5):
+    """Return the best of ``runs`` timings, in a fresh interpreter each
+    time, of importing the package and of creating the app."""
+    timings = []
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, '-c', STARTUP_SCRIPT],
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        timings.append([float(value) for value in output.split()])
+    return {'import_seconds': round(min(timing[0] for timing in timings), 4),
+            'create_app_seconds': round(min(timing[1] for timing in timings), 4)}
+
+
+def seed(app, args):
+    """Recreate the schema and bulk insert the users and recipes."""
+    started = time.time()
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        # built like `flask users import` builds them, normalized emails
+        # included, from a hash made once
+        password_hash = passwords.hash(PASSWORD).decode('utf-8')
+        users = ({'email': 'user{}@example.com'.format(number),
+                  'password_hash': password_hash}
+                 for number in range(args.users))
+        for number, batch in enumerate(batched(users, 10000)):
+            insert_rows(User.__table__, user_rows(batch, number * 10000 + 1))
+            db.session.commit()
+
+        # spread the recipes over the categories and (if any) the users
+        db.session.add_all([Category(name) for name in CATEGORIES])
+        db.session.commit()
+        # built like imported recipes, with their summary and signature
+        recipes = ({'recipe_title': 'Recipe {}'.format(number),
+                    'recipe_description': 'Description of recipe {}'.format(number),
+                    'category_id': number % len(CATEGORIES) + 1}
+                   for number in range(args.recipes))
+        category_ids = set(range(1, len(CATEGORIES) + 1))
+        for index, batch in enumerate(batched(recipes, 10000)):
+            first = index * 10000
+            rows = recipe_rows(batch, first + 1, category_ids)
+            for number, row in enumerate(rows, first):
+                row['user_id'] = number % args.users + 1 if args.users else None
+            insert_rows(Recipe.__table__, rows)
+            db.session.commit()
+        db.session.remove()
+    return time.time() - started
+
+
+def requests_for(app, scenario, args, rng):
+    """Yield (method, path, form data) for each request of ``scenario``."""
+    serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'])
+    for number in range(args.requests):
+        if scenario == 'index':
+            cursor = rng.randrange(args.recipes) if args.recipes else 0
+            yield 'GET', '/?after={}'.format(cursor) if number % 2 else '/', None
+        elif scenario == 'add_recipe':
+            yield 'POST', '/add', {'recipe_title': 'Benchmark recipe {}'.format(number),
+                                   'recipe_description': 'Added while benchmarking.'}
+        elif scenario == 'register':
+            yield 'POST', '/register', {'email': 'new{}@example.com'.format(number),
+                                        'password': PASSWORD, 'confirm': PASSWORD}
+        elif scenario == 'login':
+            yield 'POST', '/login', {
+                'email': 'user{}@example.com'.format(rng.randrange(args.users)),
+                'password': PASSWORD}
+        elif scenario == 'confirm_email':
+            email = 'user{}@example.com'.format(number % args.users)
+            token = serializer.dumps(email, salt='email-confirmation-salt')
+            yield 'GET', '/confirm/{}'.format(token), None
+
+
+def test_client_sender(app):
+    def send(method, path, data):
+        # a new client per request, so no session carries over
+        response = app.test_client().open(path, method=method, data=data)
+        return (response.status_code, response.headers.get('Location'),
+                response.headers.getlist('Set-Cookie'))
+    return send
+
+
+class NoRedirectHandler(HTTPRedirectHandler):
+    def redirect_request(self, *args):
+        return None
+
+
+def http_sender(base_url):
+    # redirects are checked, not followed
+    opener = build_opener(NoRedirectHandler)
+
+    def send(method, path, data):
+        body = urlencode(data).encode('utf-8') if data is not None else None
+        try:
+            with opener.open(base_url + path, data=body) as response:
+                response.read()
+                return response.status, None, response.headers.get_all('Set-Cookie') or []
+        except HTTPError as error:
+            error.read()
+            return (error.code, error.headers.get('Location'),
+                    error.headers.get_all('Set-Cookie') or [])
+    return send
+
+
+def flashes(app, cookies):
+    """Return the ``(category, message)`` pairs flashed in the session
+    set by ``cookies`` (Set-Cookie header values)."""
+    serializer = app.session_interface.get_signing_serializer(app)
+    for cookie in cookies:
+        name, _, value = cookie.split(';', 1)[0].partition('=')
+        if name == app.session_cookie_name:
+            try:
+                return serializer.loads(value).get('_flashes', [])
+            except BadSignature:
+                return []
+    return []
+
+
+def succeeded(app, scenario, response):
+    """Return whether ``response`` (status, Location, cookies) is the one
+    ``scenario`` gets when its flow works: the page for the index, and
+    otherwise a redirect to the index, with the confirmation flashed for
+    confirm_email.  Failed forms render with a 200 instead."""
+    status, location, cookies = response
+    if scenario == 'index':
+        return status == 200
+    if status != 302 or urlparse(location or '').path != '/':
+        return False
+    if scenario == 'confirm_email':
+        return any(message.startswith('Thank you for confirming')
+                   for _, message in flashes(app, cookies))
+    return True
+
+
+def run_scenario(app, scenario, args, send, rng):
+    requests = list(requests_for(app, scenario, args, rng))
+    latencies = []
+    errors = [0]
+
+    def timed(request):
+        started = time.perf_counter()
+        response = send(*request)
+        latencies.append(time.perf_counter() - started)
+        if not succeeded(app, scenario, response):
+            errors[0] += 1
+
+    started = time.perf_counter()
+    if args.server and args.concurrency > 1:
+        with ThreadPoolExecutor(args.concurrency) as executor:
+            list(executor.map(timed, requests))
+    else:
+        for request in requests:
+            timed(request)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'requests_per_sec': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'mean_ms': round(1000 * sum(latencies) / len(latencies), 3) if latencies else None,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+    }
+
+
+def percentile(values, percent):
+    """Nearest-rank percentile of sorted ``values``, in milliseconds."""
+    if not values:
+        return None
+    rank = max(int(round(percent / 100.0 * len(values))) - 1, 0)
+    return round(1000 * values[rank], 3)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    args = parse_args()
+    if args.database and input('This drops every table in {}. Continue? [y/N] '.format(
+            args.database)).lower() != 'y':
+        sys.exit(1)
+    startup = measure_startup()
+    print('import {import_seconds} s  create_app {create_app_seconds} s'.format(**startup))
+
+    app = create_benchmark_app(args)
+    rng = random.Random(args.seed)
+
+    print('Seeding {} recipes and {} users...'.format(args.recipes, args.users))
+    seed_seconds = seed(app, args)
+
+    server = None
+    if args.server:
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        send = http_sender('http://127.0.0.1:{}'.format(server.server_port))
+    else:
+        send = test_client_sender(app)
+
+    results = {}
+    try:
+        for scenario in args.scenarios:
+            results[scenario] = run_scenario(app, scenario, args, send, rng)
+            print('{:<14} {requests_per_sec:>9} req/s  p50 {p50_ms:>8} ms  '
+                  'p95 {p95_ms:>8} ms  p99 {p99_ms:>8} ms  errors {errors}'.format(
+                      scenario, **results[scenario]))
+    finally:
+        if server is not None:
+            server.shutdown()
+
+    report = {
+        'revision': git_revision(),
+        'date': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'settings': {key: value for key, value in vars(args).items()
+                     if key not in ('output', 'database')},
+        'database': app.config['SQLALCHEMY_DATABASE_URI'].split(':')[0],
+        'startup': startup,
+        'seed_seconds': round(seed_seconds, 3),
+        'scenarios': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+        print('Results written to {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
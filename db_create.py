@@ -1,5 +1,8 @@
-from project import db
-from project.models import Recipe, User
+from project import create_app, db
+from project.models import Category, Recipe, User
+
+app = create_app()
+app.app_context().push()
 
 # drop all of the existing database tables
 db.drop_all()
@@ -7,10 +10,18 @@ db.drop_all()
 # create the database and the database table
 db.create_all()
 
+# insert category data
+breakfast = Category('Breakfast')
+lunch = Category('Lunch')
+dinner = Category('Dinner')
+dessert = Category('Dessert')
+db.session.add_all([breakfast, lunch, dinner, dessert])
+db.session.flush()
+
 # insert recipe data
-recipe1 = Recipe('Slow-Cooker Tacos', 'Delicious ground beef that has been simmering in taco seasoning and sauce.  Perfect with hard-shelled tortillas!')
-recipe2 = Recipe('Hamburgers', 'Classic dish elivated with pretzel buns.')
-recipe3 = Recipe('Mediterranean Chicken', 'Grilled chicken served with pitas, hummus, and sauted vegetables.')
+recipe1 = Recipe('Slow-Cooker Tacos', 'Delicious ground beef that has been simmering in taco seasoning and sauce.  Perfect with hard-shelled tortillas!', dinner.id)
+recipe2 = Recipe('Hamburgers', 'Classic dish elivated with pretzel buns.', lunch.id)
+recipe3 = Recipe('Mediterranean Chicken', 'Grilled chicken served with pitas, hummus, and sauted vegetables.', dinner.id)
 db.session.add(recipe1)
 db.session.add(recipe2)
 db.session.add(recipe3)
@@ -1,33 +1,170 @@
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, current_app
 from flask_login import LoginManager
-from flask_bcrypt import Bcrypt
 from flask_mail import Mail
+from project.assets import Assets
+from project.cache import LRUCache, VersionedCache
+from project.mailer import MailDispatcher
+from project.metrics import RequestMetrics
+from project.passwords import PasswordHasher
+from project.photos import PhotoStore
+from project.profiling import RequestProfiler
+from project.ratelimit import RateLimiter
+from project.routing import RoutingSQLAlchemy, read_only
 
 
-app = Flask(__name__, instance_relative_config=True)
-app.config.from_pyfile('flask.cfg')
-
-db = SQLAlchemy(app)
-bcrypt = Bcrypt(app)
-mail = Mail(app)
-
+# The extensions are created unbound and attached to an application in
+# create_app(), so importing the package reads no configuration and opens
+# no connections, pools or threads.
+db = RoutingSQLAlchemy()
+metrics = RequestMetrics()
+profiler = RequestProfiler()
+passwords = PasswordHasher()
+photos = PhotoStore()
+limiter = RateLimiter()
+mail = Mail()
+mail_dispatcher = MailDispatcher(mail=mail)
+recipe_cache = VersionedCache('recipes')
+user_cache = LRUCache()
+static_files = Assets()
 login_manager = LoginManager()
-login_manager.init_app(app)
 login_manager.login_view = "users.login"
 
+
+@metrics.add_collector
+def cache_metrics():
+    caches = [('users', user_cache.stats()), ('recipes', recipe_cache.backend.stats())]
+    return [
+        ('cache_hits_total', 'counter', 'Cache lookups that found an entry.',
+         [('cache="{}"'.format(name), stats['hits']) for name, stats in caches]),
+        ('cache_misses_total', 'counter', 'Cache lookups that found nothing.',
+         [('cache="{}"'.format(name), stats['misses']) for name, stats in caches]),
+        ('cache_entries', 'gauge', 'Entries currently cached.',
+         [('cache="{}"'.format(name), stats['entries']) for name, stats in caches]),
+    ]
+
+
+@metrics.add_collector
+def rate_limit_metrics():
+    counts = sorted(limiter.stats().items())
+    return [
+        ('rate_limit_attempts_total', 'counter',
+         'Rate limited attempts, by action and whether they were allowed.',
+         [('action="{}",result="{}"'.format(action, result), count)
+          for (action, result), count in counts]),
+        ('rate_limit_buckets', 'gauge', 'Token buckets currently kept.',
+         [('', limiter.backend.stats()['keys'])]),
+    ]
+
+
+@metrics.add_collector
+def replica_metrics():
+    replicas = current_app.extensions.get('read_replicas')
+    if replicas is None:
+        return []
+    return [
+        ('db_replica_sessions_total', 'counter', 'Sessions that read from each replica.',
+         [('bind="{}"'.format(bind), replicas.sessions[bind]) for bind in replicas.binds]),
+        ('db_replica_sessions_in_use', 'gauge', 'Sessions reading from each replica now.',
+         [('bind="{}"'.format(bind), replicas.in_use[bind]) for bind in replicas.binds]),
+    ]
+
+
+@metrics.add_collector
+def pool_metrics():
+    pools = sorted(current_app.extensions.get('db_pools', {}).items(),
+                   key=lambda item: item[0] or '')
+    stats = [('bind="{}"'.format(bind or 'primary'), pool.snapshot()) for bind, pool in pools]
+    return [
+        ('db_pool_connections_checked_out', 'gauge', 'Connections checked out of each pool.',
+         [(labels, values['checked_out']) for labels, values in stats]),
+        ('db_pool_connections_idle', 'gauge', 'Open connections waiting in each pool.',
+         [(labels, values['idle']) for labels, values in stats]),
+        ('db_pool_connections_opened_total', 'counter', 'Connections each pool opened.',
+         [(labels, values['opened']) for labels, values in stats]),
+        ('db_pool_connections_closed_total', 'counter', 'Connections each pool closed.',
+         [(labels, values['closed']) for labels, values in stats]),
+        ('db_pool_connections_invalidated_total', 'counter',
+         'Connections each pool found broken or stale.',
+         [(labels, values['invalidated']) for labels, values in stats]),
+        ('db_pool_checkouts_total', 'counter', 'Checkouts that were timed, per pool.',
+         [(labels, values['waits']) for labels, values in stats]),
+        ('db_pool_checkout_wait_seconds_total', 'counter',
+         'Time checkouts spent waiting for a connection, per pool.',
+         [(labels, values['wait_seconds']) for labels, values in stats]),
+    ]
+
+
+@metrics.add_collector
+def profiler_metrics():
+    sampled = sorted(profiler.sampled.items())
+    return [
+        ('profiler_sampled_requests_total', 'counter', 'Requests profiled, per endpoint.',
+         [('endpoint="{}"'.format(endpoint), count) for endpoint, count in sampled]),
+    ]
+
+
 from project.models import User
+import project.signals
+from project.autocomplete import title_index
+from project.duplicates import duplicate_index
+from project.logins import login_times
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.filter(User.id == int(user_id)).first()
+    user_id = int(user_id)
+    values = user_cache.get(user_id)
+    if values is not None:
+        return login_times.apply(User.from_snapshot(values))
+    with read_only():
+        user = User.query.filter(User.id == user_id).first()
+    if user is not None:
+        user_cache.set(user_id, user.snapshot())
+        login_times.apply(user)
+    return user
+
+
+def create_app(config=None):
+    """Create the application from instance/flask.cfg, with the settings
+    in the ``config`` mapping (if given) taking precedence."""
+    app = Flask(__name__, instance_relative_config=True)
+    app.config.from_pyfile('flask.cfg')
+    if config is not None:
+        app.config.update(config)
+
+    db.init_app(app)
+    metrics.init_app(app)
+    profiler.init_app(app)
+    passwords.init_app(app)
+    photos.init_app(app)
+    limiter.init_app(app)
+    mail.init_app(app)
+    mail_dispatcher.init_app(app, mail)
+    login_times.init_app(app)
+    recipe_cache.init_app(app)
+    user_cache.max_entries = app.config['USER_CACHE_MAX_ENTRIES']
+    user_cache.ttl = app.config['USER_CACHE_TTL']
+    title_index.max_age = app.config['AUTOCOMPLETE_MAX_AGE']
+    duplicate_index.max_age = app.config['DUPLICATES_MAX_AGE']
+    duplicate_index.threshold = app.config['DUPLICATES_THRESHOLD']
+    static_files.init_app(app)
+    login_manager.init_app(app)
 
+    # the views and commands are only needed once an app is created
+    from project.users.views import users_blueprint
+    from project.recipes.views import recipes_blueprint
+    from project.api.views import api_blueprint
+    from project.commands import assets_cli, maintenance_cli, recipes_cli, users_cli
 
-from project.users.views import users_blueprint
-from project.recipes.views import recipes_blueprint
+    # register the blueprints
+    app.register_blueprint(users_blueprint)
+    app.register_blueprint(recipes_blueprint)
+    app.register_blueprint(api_blueprint)
 
+    # register the command line interface
+    app.cli.add_command(recipes_cli)
+    app.cli.add_command(users_cli)
+    app.cli.add_command(assets_cli)
+    app.cli.add_command(maintenance_cli)
 
-# register the blueprints
-app.register_blueprint(users_blueprint)
-app.register_blueprint(recipes_blueprint)
+    return app
@@ -0,0 +1,166 @@
+import gzip
+import json
+import zlib
+
+from flask import Blueprint, abort, current_app, jsonify, request
+
+from project import db
+from project.bulk import RECIPE_FIELDS, RecordError, existing_category_ids, \
+    insert_rows_returning_ids, recipe_rows
+from project.models import Recipe
+from project.pagination import keyset_paginate
+from project.routing import read_only
+
+
+api_blueprint = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# listings carry the stored summary; only a single recipe is returned with
+# its full description, which is deferred everywhere else
+LIST_FIELDS = ('id', 'recipe_title', 'recipe_summary', 'category_id')
+
+
+##########################
+#### helper functions ####
+##########################
+
+def recipe_query(fields=LIST_FIELDS):
+    """Query only the columns the API returns, as plain rows."""
+    return db.session.query(*[getattr(Recipe, field) for field in fields])
+
+
+def parse_ids(value):
+    try:
+        ids = [int(id) for id in value.split(',') if id.strip()]
+    except ValueError:
+        abort(400, 'ids must be a comma separated list of integers.')
+    if len(ids) > current_app.config['API_MAX_BATCH_SIZE']:
+        abort(400, 'At most {} ids can be fetched at once.'.format(
+            current_app.config['API_MAX_BATCH_SIZE']))
+    return ids
+
+
+def json_body():
+    """Return the decoded JSON request body, which may be gzip compressed."""
+    data = request.get_data(cache=False)
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            data = decompressor.decompress(data, current_app.config['API_MAX_BODY_SIZE'])
+        except zlib.error:
+            abort(400, 'The request body is not valid gzip.')
+        if decompressor.unconsumed_tail:
+            abort(413)
+    try:
+        return json.loads(data.decode('utf-8'))
+    except ValueError:
+        abort(400, 'The request body is not valid JSON.')
+
+
+def validate_recipes(records):
+    """Return the rows for ``records`` and a list of error messages."""
+    rows, errors = [], []
+    category_ids = existing_category_ids()
+    for number, record in enumerate(records):
+        if not isinstance(record, dict) or not all(
+                isinstance(record.get(field) or '', str)
+                for field in ('recipe_title', 'recipe_description')):
+            errors.append('record {}: expected an object with string '
+                          'recipe_title and recipe_description'.format(number))
+            continue
+        try:
+            rows.extend(recipe_rows([record], number, category_ids))
+        except RecordError as error:
+            errors.append(str(error))
+    return rows, errors
+
+
+@api_blueprint.after_request
+def compress(response):
+    """Gzip the response body when the client accepts it and it is large
+    enough to be worth it."""
+    response.vary.add('Accept-Encoding')
+    if response.direct_passthrough or 'Content-Encoding' in response.headers \
+            or not request.accept_encodings['gzip']:
+        return response
+    data = response.get_data()
+    if len(data) >= current_app.config['API_GZIP_MIN_SIZE']:
+        response.set_data(gzip.compress(data, current_app.config['API_GZIP_LEVEL']))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+@api_blueprint.errorhandler(400)
+@api_blueprint.errorhandler(404)
+@api_blueprint.errorhandler(413)
+def json_error(error):
+    response = jsonify(error=error.description)
+    response.status_code = error.code
+    return response
+
+
+################
+#### routes ####
+################
+
+@api_blueprint.route('/recipes', methods=['GET'])
+@read_only()
+def list_recipes():
+    """Return a page of recipes in id order, optionally only those in
+    ``category``, or with ``ids`` the recipes with those ids, in the order
+    given."""
+    if 'ids' in request.args:
+        ids = parse_ids(request.args['ids'])
+        rows = recipe_query().filter(Recipe.id.in_(ids)).all() if ids else []
+        found = {row.id: row._asdict() for row in rows}
+        return jsonify(recipes=[found[id] for id in ids if id in found],
+                       missing=[id for id in ids if id not in found])
+
+    per_page = min(request.args.get('per_page', current_app.config['RECIPES_PER_PAGE'],
+                                    type=int),
+                   current_app.config['API_MAX_PER_PAGE'])
+    if per_page < 1:
+        abort(400, 'per_page must be positive.')
+    query = recipe_query()
+    category_id = request.args.get('category', type=int)
+    if category_id is not None:
+        query = query.filter(Recipe.category_id == category_id)
+    page = keyset_paginate(query, Recipe.id, per_page=per_page,
+                           after=request.args.get('after', type=int),
+                           before=request.args.get('before', type=int))
+    return jsonify(recipes=[row._asdict() for row in page],
+                   next_cursor=page.next_cursor,
+                   prev_cursor=page.prev_cursor)
+
+
+@api_blueprint.route('/recipes/<int:recipe_id>', methods=['GET'])
+@read_only()
+def get_recipe(recipe_id):
+    row = recipe_query(RECIPE_FIELDS).filter(Recipe.id == recipe_id).first()
+    if row is None:
+        abort(404, 'No recipe with id {}.'.format(recipe_id))
+    return jsonify(row._asdict())
+
+
+@api_blueprint.route('/recipes', methods=['POST'])
+def create_recipes():
+    """Create every recipe in ``{"recipes": [...]}`` in one transaction, or
+    none of them if any is invalid, and return their ids in order."""
+    body = json_body()
+    records = body.get('recipes') if isinstance(body, dict) else None
+    if not isinstance(records, list) or not records:
+        abort(400, 'Expected an object with a non-empty "recipes" list.')
+    if len(records) > current_app.config['API_MAX_BATCH_SIZE']:
+        abort(400, 'At most {} recipes can be created at once.'.format(
+            current_app.config['API_MAX_BATCH_SIZE']))
+
+    rows, errors = validate_recipes(records)
+    if errors:
+        response = jsonify(error='Invalid recipes, none were created.', errors=errors)
+        response.status_code = 400
+        return response
+
+    ids = insert_rows_returning_ids(Recipe.__table__, rows)
+    db.session.commit()
+    response = jsonify(ids=ids)
+    response.status_code = 201
+    return response
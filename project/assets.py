@@ -0,0 +1,211 @@
+import base64
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import urllib.request
+
+import flask
+from flask import current_app, request, send_from_directory
+from markupsafe import Markup
+
+try:
+    import brotli
+except ImportError:
+    # only gzip variants are built without it
+    brotli = None
+
+
+MANIFEST = 'manifest.json'
+HASH_LENGTH = 12
+ONE_YEAR = 365 * 24 * 60 * 60
+COMPRESSIBLE = {'.css', '.js', '.json', '.map', '.svg', '.txt', '.html', '.xml',
+                '.eot', '.ttf'}
+
+# most preferred first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+class AssetError(Exception):
+    pass
+
+
+def fingerprinted(filename, data):
+    """Return ``filename`` with the hash of ``data`` before its extension,
+    so a changed file gets a new URL."""
+    root, extension = os.path.splitext(filename)
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    return '{}.{}{}'.format(root, digest, extension)
+
+
+def compressed(filename, data):
+    """Return ``{encoding: bytes}`` for the encodings of ``data`` worth
+    serving instead of it: smaller, of a file type that compresses."""
+    if os.path.splitext(filename)[1] not in COMPRESSIBLE:
+        return {}
+    variants = {'gzip': gzip.compress(data, 9)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(data, quality=11)
+    return {encoding: body for encoding, body in variants.items() if len(body) < len(data)}
+
+
+def check_integrity(data, integrity):
+    """Check ``data`` against a subresource integrity value such as
+    ``sha384-<base64 digest>``."""
+    algorithm, _, expected = integrity.partition('-')
+    digest = base64.b64encode(hashlib.new(algorithm, data).digest()).decode('ascii')
+    if digest != expected:
+        raise AssetError('Expected {} but got {}-{}'.format(integrity, algorithm, digest))
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'wb') as output:
+        output.write(data)
+    os.replace(path + '.tmp', path)
+
+
+def vendor(static_folder, sources, timeout=30):
+    """Download each of ``sources`` (``{filename: (url, integrity)}``)
+    missing from ``static_folder``, checking its integrity when one is
+    given, and return the filenames downloaded."""
+    downloaded = []
+    for filename, (url, integrity) in sorted(sources.items()):
+        path = os.path.join(static_folder, filename)
+        if os.path.exists(path):
+            continue
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                data = response.read()
+        except OSError as error:
+            raise AssetError('Cannot download {}: {}'.format(url, error))
+        if integrity:
+            check_integrity(data, integrity)
+        _write(path, data)
+        downloaded.append(filename)
+    return downloaded
+
+
+def build(static_folder, output='build'):
+    """Copy every file of ``static_folder`` to ``output`` (inside it)
+    under a fingerprinted name, with a ``.gz`` and (with brotli installed)
+    ``.br`` copy when those are smaller, and write the manifest mapping
+    each filename to its copy and encodings.
+
+    Copies from earlier builds are kept, so pages rendered by processes
+    still running the old manifest keep working during a deploy.
+    """
+    manifest = {}
+    build_folder = os.path.join(static_folder, output)
+    for directory, subdirectories, filenames in os.walk(static_folder):
+        if os.path.abspath(directory) == os.path.abspath(build_folder):
+            subdirectories[:] = []
+            continue
+        subdirectories.sort()
+        for name in sorted(filenames):
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(directory, name)
+            filename = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            with open(path, 'rb') as source:
+                data = source.read()
+            target = '/'.join([output, fingerprinted(filename, data)])
+            variants = compressed(filename, data)
+            _write(os.path.join(static_folder, target), data)
+            for encoding, suffix in ENCODINGS:
+                if encoding in variants:
+                    _write(os.path.join(static_folder, target + suffix), variants[encoding])
+            manifest[filename] = {'path': target, 'encodings': sorted(variants)}
+    _write(os.path.join(build_folder, MANIFEST),
+           json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def load_manifest(static_folder, output='build'):
+    try:
+        with open(os.path.join(static_folder, output, MANIFEST), encoding='utf-8') as source:
+            return json.load(source)
+    except FileNotFoundError:
+        return {}
+
+
+class Assets(object):
+    """Fingerprinted, precompressed static files.
+
+    ``flask assets build`` downloads the files listed in ``ASSETS_VENDOR``
+    and copies the static folder to ``ASSETS_BUILD_DIR`` under names
+    carrying a hash of their contents, with gzip and brotli variants.
+    When that manifest exists, ``url_for('static', ...)`` in templates
+    links to the copies, which are served with the best encoding the
+    client accepts and cached for a year as immutable.  Without it, files
+    are linked and served as they are, and vendored files that were never
+    downloaded are linked from where they would be downloaded from, with
+    ``cdn_attributes(filename)`` giving their integrity attributes.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        output = app.config.get('ASSETS_BUILD_DIR', 'build')
+        manifest = load_manifest(app.static_folder, output)
+        app.extensions['assets'] = {
+            'manifest': manifest,
+            'served': {entry['path']: entry['encodings'] for entry in manifest.values()},
+        }
+        app.jinja_env.globals['url_for'] = self.url_for
+        app.jinja_env.globals['cdn_attributes'] = self.cdn_attributes
+        app.view_functions['static'] = self.send_static_file
+
+    def url_for(self, endpoint, **values):
+        """``flask.url_for``, linking static files to their built copies."""
+        filename = values.get('filename')
+        if endpoint == 'static' and filename is not None:
+            entry = current_app.extensions['assets']['manifest'].get(filename)
+            if entry is not None:
+                values['filename'] = entry['path']
+            else:
+                source = self._cdn_source(filename)
+                if source is not None:
+                    return source[0]
+        return flask.url_for(endpoint, **values)
+
+    def cdn_attributes(self, filename):
+        """The ``integrity`` and ``crossorigin`` attributes for the tag
+        linking static file ``filename``, when it is linked from its
+        source; nothing otherwise."""
+        source = self._cdn_source(filename)
+        if source is None or not source[1]:
+            return Markup('')
+        return Markup(' integrity="{}" crossorigin="anonymous"').format(source[1])
+
+    def _cdn_source(self, filename):
+        # (url, integrity) for a vendored file that was never downloaded
+        if filename in current_app.extensions['assets']['manifest']:
+            return None
+        source = current_app.config.get('ASSETS_VENDOR', {}).get(filename)
+        if source is None or os.path.exists(os.path.join(current_app.static_folder, filename)):
+            return None
+        return source
+
+    def send_static_file(self, filename):
+        encodings = current_app.extensions['assets']['served'].get(filename)
+        if encodings is None:
+            return current_app.send_static_file(filename)
+        chosen = None
+        for encoding, suffix in ENCODINGS:
+            if encoding in encodings and request.accept_encodings[encoding]:
+                chosen = encoding
+                break
+        response = send_from_directory(
+            current_app.static_folder, filename + suffix if chosen else filename,
+            mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+            cache_timeout=ONE_YEAR)
+        if chosen:
+            response.headers['Content-Encoding'] = chosen
+        if encodings:
+            response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = 'public, max-age={}, immutable'.format(ONE_YEAR)
+        return response
@@ -0,0 +1,158 @@
+import sys
+import threading
+import time
+from bisect import bisect_left, insort
+
+from project import db, metrics
+from project.models import Recipe
+from project.routing import read_only
+from project.signals import recipes_added
+
+
+def normalize(text):
+    """Lower case ``text`` and collapse its whitespace, as titles are
+    indexed and prefixes looked up."""
+    return ' '.join(text.casefold().split())
+
+
+class TitleIndex(object):
+    """In-process prefix index of recipe titles for type-ahead.
+
+    A sorted list holds one ``(key, id, title)`` entry for every word a
+    title has, the key being the normalized title from that word on, so a
+    prefix of any word of the title finds it with one bisect.  The list is
+    loaded from the recipes table on first use and recipes committed by
+    this process are inserted as they are, so lookups never touch the
+    database.  Recipes added by other processes appear once the index is
+    older than ``max_age`` seconds and a lookup loads it again; meanwhile
+    other lookups keep using the old one.
+    """
+
+    def __init__(self, max_age=300):
+        self.max_age = max_age
+        self._entries = None
+        self._loaded_at = 0
+        self._pending = None
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    @staticmethod
+    def _keys(title):
+        key = normalize(title)
+        start = 0
+        while start < len(key):
+            yield key[start:]
+            start = key.find(' ', start)
+            if start == -1:
+                break
+            start += 1
+
+    def _size(self, entries):
+        size = 0
+        titles = set()
+        for key, id, title in entries:
+            size += sys.getsizeof((key, id, title)) + sys.getsizeof(key) + sys.getsizeof(id)
+            if title not in titles:
+                titles.add(title)
+                size += sys.getsizeof(title)
+        return size
+
+    def _stale(self):
+        return self._entries is None or (
+            self.max_age and time.time() - self._loaded_at > self.max_age)
+
+    def _load(self):
+        # while a reload is under way, lookups go on with the old entries
+        if not self._load_lock.acquire(self._entries is None):
+            return
+        try:
+            if not self._stale():
+                return
+            loaded_at = time.time()
+            with self._lock:
+                self._pending = []
+            with read_only():
+                rows = db.session.query(Recipe.id, Recipe.recipe_title).all()
+            with self._lock:
+                # recipes committed while loading may be in the rows as well
+                rows.extend(self._pending)
+                entries = sorted({(key, id, title)
+                                  for id, title in rows for key in self._keys(title)})
+                self._bytes = self._size(entries)
+                self._entries = entries
+                self._loaded_at = loaded_at
+                self._pending = None
+        finally:
+            self._load_lock.release()
+
+    def add(self, id, title):
+        """Index a newly committed recipe."""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((id, title))
+            if self._entries is None:
+                return
+            entries = [(key, id, title) for key in self._keys(title)]
+            for entry in entries:
+                insort(self._entries, entry)
+            self._bytes += self._size(entries)
+
+    def complete(self, prefix, limit=10):
+        """Return up to ``limit`` ``(id, title)`` pairs of recipes with a
+        word of their title starting with ``prefix``, in order of the
+        matching part of the title."""
+        prefix = normalize(prefix)
+        if not prefix or limit < 1:
+            return []
+        if self._stale():
+            self._load()
+        matches, seen = [], set()
+        with self._lock:
+            entries = self._entries
+            index = bisect_left(entries, (prefix,))
+            while index < len(entries) and len(matches) < limit:
+                key, id, title = entries[index]
+                if not key.startswith(prefix):
+                    break
+                if id not in seen:
+                    seen.add(id)
+                    matches.append((id, title))
+                index += 1
+        return matches
+
+    def clear(self):
+        """Drop the index, to be loaded again on the next lookup."""
+        with self._lock:
+            self._entries = None
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries or ()),
+                    'bytes': self._bytes + sys.getsizeof(self._entries or [])}
+
+
+title_index = TitleIndex()
+
+
+@recipes_added.connect
+def index_added_recipes(sender, recipes):
+    # bulk imports do not know the ids of the rows they insert
+    if not all(recipe.get('id') for recipe in recipes):
+        title_index.clear()
+        return
+    for recipe in recipes:
+        title_index.add(recipe['id'], recipe['recipe_title'])
+
+
+@metrics.add_collector
+def autocomplete_metrics():
+    stats = title_index.stats()
+    return [
+        ('autocomplete_index_entries', 'gauge', 'Entries in the title prefix index.',
+         [('', stats['entries'])]),
+        ('autocomplete_index_bytes', 'gauge',
+         'Approximate memory used by the title prefix index.',
+         [('', stats['bytes'])]),
+    ]
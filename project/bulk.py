@@ -0,0 +1,305 @@
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from itertools import islice
+
+from project import db, minhash, passwords
+from project.models import Category, Recipe, User, normalize_email, summarize
+from project.signals import note_recipes_added
+
+
+RECIPE_FIELDS = ('id', 'recipe_title', 'recipe_description', 'category_id')
+USER_FIELDS = ('id', 'email', 'name', 'password_hash', 'email_confirmed',
+               'email_confirmed_on', 'registered_on')
+
+
+class RecordError(ValueError):
+    """Raised for a record that cannot be imported."""
+
+    def __init__(self, number, message):
+        super(RecordError, self).__init__(
+            'record {}: {}'.format(number, message))
+        self.number = number
+
+
+def file_format(path, format=None):
+    """Return 'csv' or 'jsonl', from ``format`` or the file extension."""
+    if format:
+        return format
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+def read_records(fileobj, format):
+    """Yield one dict per line of a JSONL or CSV file without reading the
+    whole file into memory; raise RecordError for a line that is not one."""
+    if format == 'csv':
+        records = csv.DictReader(fileobj)
+        number = 0
+        while True:
+            number += 1
+            try:
+                record = next(records)
+            except StopIteration:
+                return
+            except csv.Error as error:
+                raise RecordError(number, str(error))
+            yield record
+    else:
+        number = 0
+        for line in fileobj:
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                record = json.loads(line)
+            except ValueError as error:
+                raise RecordError(number, 'invalid JSON: {}'.format(error))
+            if not isinstance(record, dict):
+                raise RecordError(number, 'expected a JSON object')
+            yield record
+
+
+def write_records(fileobj, records, fields, format):
+    """Write ``records`` (dicts keyed by ``fields``) as JSONL or CSV and
+    return how many were written."""
+    count = 0
+    if format == 'csv':
+        writer = csv.DictWriter(fileobj, fieldnames=fields)
+        writer.writeheader()
+        for count, record in enumerate(records, 1):
+            writer.writerow(record)
+    else:
+        for count, record in enumerate(records, 1):
+            fileobj.write(json.dumps(record, separators=(',', ':')))
+            fileobj.write('\n')
+    return count
+
+
+def batched(iterable, size):
+    """Yield lists of up to ``size`` items from ``iterable``."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def read_checkpoint(path):
+    """Return how many records a previous run already committed."""
+    try:
+        with open(path) as checkpoint:
+            return int(checkpoint.read().strip() or 0)
+    except IOError:
+        return 0
+
+
+def write_checkpoint(path, count):
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as checkpoint:
+        checkpoint.write(str(count))
+    os.replace(temporary, path)
+
+
+def recipe_rows(records, first_number, category_ids=None):
+    """Return the recipes table rows for a batch of imported records.
+
+    A record's ``category_id`` is optional but must be one of
+    ``category_ids`` (by default, every existing category).
+    """
+    if category_ids is None:
+        category_ids = existing_category_ids()
+    rows = []
+    for number, record in enumerate(records, first_number):
+        title = (record.get('recipe_title') or '').strip()
+        description = (record.get('recipe_description') or '').strip()
+        if not title or not description:
+            raise RecordError(number, 'recipe_title and recipe_description are required')
+        category_id = record.get('category_id')
+        if category_id in ('', None):
+            category_id = None
+        else:
+            try:
+                category_id = int(category_id)
+            except (TypeError, ValueError):
+                category_id = None
+            if category_id not in category_ids:
+                raise RecordError(number, 'unknown category_id {!r}'.format(
+                    record['category_id']))
+        rows.append({'recipe_title': title, 'recipe_description': description,
+                     'recipe_summary': summarize(description),
+                     'category_id': category_id,
+                     'minhash': minhash.signature(title, description)})
+    return rows
+
+
+def existing_category_ids():
+    return {id for id, in db.session.query(Category.id)}
+
+
+def user_rows(records, first_number):
+    """Return the users table rows for a batch of imported records.
+
+    Records carry either a ``password_hash`` made by a previous export,
+    which is stored as is, or a plaintext ``password``; all plaintext
+    passwords in the batch are hashed in parallel.
+    """
+    rows, plaintext = [], []
+    now = datetime.now()
+    for number, record in enumerate(records, first_number):
+        email = (record.get('email') or '').strip()
+        if not email:
+            raise RecordError(number, 'email is required')
+        if record.get('password_hash'):
+            password = record['password_hash'].encode('utf-8')
+        elif record.get('password'):
+            password = None
+            plaintext.append((len(rows), record['password']))
+        else:
+            raise RecordError(number, 'password or password_hash is required')
+        try:
+            email_confirmed_on = _parse_datetime(record.get('email_confirmed_on'))
+            registered_on = _parse_datetime(record.get('registered_on')) or now
+        except ValueError as error:
+            raise RecordError(number, str(error))
+        rows.append({
+            'email': email,
+            'email_normalized': normalize_email(email),
+            'name': (record.get('name') or '').strip() or None,
+            '_password': password,
+            'authenticated': False,
+            'email_confirmation_sent_on': None,
+            'email_confirmed': _parse_bool(record.get('email_confirmed')),
+            'email_confirmed_on': email_confirmed_on,
+            'registered_on': registered_on,
+            'last_logged_in': None,
+            'current_logged_in': now,
+        })
+    if plaintext:
+        hashes = passwords.hash_many([password for _, password in plaintext])
+        for (index, _), hashed in zip(plaintext, hashes):
+            rows[index]['_password'] = hashed
+    return rows
+
+
+def insert_rows(table, rows):
+    """Insert ``rows`` into ``table`` in the current transaction with a
+    single statement: COPY on PostgreSQL, an executemany elsewhere."""
+    if not rows:
+        return
+    if db.session.bind.dialect.name == 'postgresql':
+        _copy_rows(table, rows)
+    else:
+        db.session.execute(table.insert(), rows)
+    if table is Recipe.__table__:
+        _recipes_inserted(rows)
+
+
+def insert_rows_returning_ids(table, rows):
+    """Insert ``rows`` into ``table`` in the current transaction and return
+    their new ids in order: one multi-row INSERT ... RETURNING on
+    PostgreSQL, an INSERT per row elsewhere."""
+    if not rows:
+        return []
+    if db.session.bind.dialect.name == 'postgresql':
+        result = db.session.execute(table.insert().values(rows).returning(table.c.id))
+        ids = [row[0] for row in result]
+    else:
+        ids = [db.session.execute(table.insert(), row).inserted_primary_key[0]
+               for row in rows]
+    if table is Recipe.__table__:
+        _recipes_inserted([dict(row, id=id) for row, id in zip(rows, ids)])
+    return ids
+
+
+def _recipes_inserted(rows):
+    Category.count_recipes_added(db.session.connection(),
+                                 [row.get('category_id') for row in rows])
+    note_recipes_added(db.session, rows)
+
+
+def _copy_rows(table, rows):
+    columns = list(rows[0])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([_copy_value(row[column]) for column in columns])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert('COPY {} ({}) FROM STDIN WITH CSV'.format(
+        table.name, ', '.join('"{}"'.format(column) for column in columns)), buffer)
+
+
+def _copy_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, bytes):
+        return '\\x' + value.hex()
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def export_recipes(batch_size):
+    """Yield every recipe as a record, reading ``batch_size`` rows at a
+    time in id order."""
+    for row in _keyset_rows(Recipe, batch_size, RECIPE_FIELDS):
+        yield {'id': row.id,
+               'recipe_title': row.recipe_title,
+               'recipe_description': row.recipe_description,
+               'category_id': row.category_id}
+
+
+def export_users(batch_size):
+    """Yield every user as a record, including the password hash."""
+    for row in _keyset_rows(User, batch_size):
+        yield {'id': row.id,
+               'email': row.email,
+               'name': row.name,
+               'password_hash': bytes(row['_password']).decode('utf-8'),
+               'email_confirmed': bool(row.email_confirmed),
+               'email_confirmed_on': _format_datetime(row.email_confirmed_on),
+               'registered_on': _format_datetime(row.registered_on)}
+
+
+def _keyset_rows(model, batch_size, columns=None):
+    table = model.__table__
+    query = table.select() if columns is None else \
+        db.select([table.c[column] for column in columns])
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            query.where(table.c.id > last_id)
+                          .order_by(table.c.id)
+                          .limit(batch_size)).fetchall()
+        if not rows:
+            return
+        for row in rows:
+            yield row
+        last_id = rows[-1].id
+
+
+def _parse_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 't', 'yes')
+    return bool(value)
+
+
+def _parse_datetime(value):
+    if not value:
+        return None
+    for pattern in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S',
+                    '%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S'):
+        try:
+            return datetime.strptime(value, pattern)
+        except ValueError:
+            pass
+    raise ValueError('invalid date and time: {!r}'.format(value))
+
+
+def _format_datetime(value):
+    return value.isoformat() if value is not None else None
@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import OrderedDict
+
+from werkzeug.utils import import_string
+
+
+class LRUCache(object):
+    """Thread-safe in-process cache with LRU eviction and per-entry expiry.
+
+    This is the default cache backend.  Any object providing the same
+    ``get``/``set``/``delete``/``clear``/``stats`` methods (for example a client for a
+    cache shared between worker processes) can be configured instead through
+    ``CACHE_BACKEND``, and must be when several processes serve the app: each
+    has its own copy of this one, which the others cannot invalidate.
+    """
+
+    def __init__(self, max_entries=256, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        expires = time.time() + ttl if ttl else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': len(self._entries)}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class VersionedCache(object):
+    """A cache namespace invalidated by bumping a version token.
+
+    Entries are stored under keys that include the current version, so a bump
+    makes every existing entry unreachable and they simply age out of the
+    backend.  The version itself lives in the backend with the same TTL as the
+    entries; when it is missing (first use, evicted or expired) a new
+    time-based token is chosen, so a reset can never resurrect old entries.
+
+    A bump only reaches the processes sharing the backend, so with an
+    in-process backend every other worker keeps its entries (and answers
+    revalidations from them) until they expire.
+    """
+
+    def __init__(self, namespace, app=None):
+        self.namespace = namespace
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        backend_class = import_string(app.config['CACHE_BACKEND'])
+        self.backend = backend_class(max_entries=app.config['CACHE_MAX_ENTRIES'],
+                                     ttl=app.config['CACHE_TTL'])
+
+    @property
+    def _version_key(self):
+        return '{}:version'.format(self.namespace)
+
+    def version(self):
+        version = self.backend.get(self._version_key)
+        if version is None:
+            version = int(time.time() * 1000)
+            self.backend.set(self._version_key, version)
+        return version
+
+    def bump(self):
+        self.backend.set(self._version_key, self.version() + 1)
+
+    def _key(self, key):
+        return '{}:{}:{}'.format(self.namespace, self.version(), key)
+
+    def get(self, key):
+        return self.backend.get(self._key(key))
+
+    def set(self, key, value):
+        self.backend.set(self._key(key), value)
+
+    def clear(self):
+        self.backend.clear()
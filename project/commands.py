@@ -0,0 +1,268 @@
+import os
+import time
+from itertools import islice
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import inspect
+from sqlalchemy.exc import SQLAlchemyError
+
+from project import assets, db, duplicate_index, maintenance, minhash
+from project.bulk import RECIPE_FIELDS, USER_FIELDS, RecordError, batched, \
+    export_recipes, export_users, file_format, insert_rows, read_checkpoint, \
+    read_records, recipe_rows, user_rows, write_checkpoint, write_records
+from project.models import Category, Recipe, User, normalize_email, summarize
+
+
+recipes_cli = AppGroup('recipes', help='Import and export recipes.')
+users_cli = AppGroup('users', help='Import and export users.')
+assets_cli = AppGroup('assets', help='Build the static files.')
+maintenance_cli = AppGroup('maintenance', help='Run housekeeping jobs.')
+
+
+def import_options(command):
+    command = click.option('--checkpoint', type=click.Path(dir_okay=False),
+                           help='File recording progress, so a failed import '
+                                'can be resumed (default: PATH.checkpoint).')(command)
+    command = click.option('--batch-size', default=1000, show_default=True,
+                           help='Records inserted per transaction.')(command)
+    command = click.option('--format', type=click.Choice(['jsonl', 'csv']),
+                           help='File format (default: from the extension).')(command)
+    return click.argument('path', type=click.Path(exists=True, dir_okay=False))(command)
+
+
+def export_options(command):
+    command = click.option('--batch-size', default=1000, show_default=True,
+                           help='Rows read from the database at a time.')(command)
+    command = click.option('--format', type=click.Choice(['jsonl', 'csv']),
+                           help='File format (default: from the extension).')(command)
+    return click.argument('path', type=click.Path(dir_okay=False, writable=True))(command)
+
+
+def run_import(path, format, batch_size, checkpoint, table, make_rows):
+    """Stream records from ``path`` into ``table`` one batch per
+    transaction, recording progress in ``checkpoint`` after each commit."""
+    checkpoint = checkpoint or path + '.checkpoint'
+    done = read_checkpoint(checkpoint)
+    if done:
+        click.echo('Resuming after record {}'.format(done), err=True)
+
+    imported = 0
+    started = time.time()
+    with open(path, newline='') as fileobj:
+        records = islice(read_records(fileobj, file_format(path, format)), done, None)
+        try:
+            # records are parsed as batches are read, so this covers both
+            for batch in batched(records, batch_size):
+                insert_rows(table, make_rows(batch, done + 1))
+                db.session.commit()
+                done += len(batch)
+                imported += len(batch)
+                write_checkpoint(checkpoint, done)
+                click.echo('{} records imported ({:.0f} rows/sec)'.format(
+                    done, imported / max(time.time() - started, 1e-6)), err=True)
+        except (RecordError, SQLAlchemyError, ValueError) as error:
+            db.session.rollback()
+            raise click.ClickException(
+                '{} ({} records imported; run the command again to '
+                'resume)'.format(error, done))
+
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    _report('Imported', imported, started)
+
+
+def run_export(path, format, records, fields):
+    started = time.time()
+    with open(path, 'w', newline='') as fileobj:
+        count = write_records(fileobj, records, fields, file_format(path, format))
+    _report('Exported', count, started)
+
+
+def _report(action, count, started):
+    elapsed = time.time() - started
+    click.echo('{} {} records in {:.2f}s ({:.0f} rows/sec)'.format(
+        action, count, elapsed, count / max(elapsed, 1e-6)))
+
+
+def flagged_recipe_rows(records, first_number):
+    """Return the rows for a batch of recipes, warning about those that
+    look like recipes already stored or earlier in the batch."""
+    rows = recipe_rows(records, first_number)
+    for position, matches in duplicate_index.duplicates_in(rows):
+        click.echo('Record {} looks like a duplicate of {}'.format(
+            first_number + position,
+            ', '.join(title if id is None else '{} (#{})'.format(title, id)
+                      for id, title in matches)), err=True)
+    return rows
+
+
+@recipes_cli.command('import')
+@import_options
+def import_recipes(path, format, batch_size, checkpoint):
+    """Import recipes from a JSONL or CSV file, warning about likely
+    duplicates."""
+    run_import(path, format, batch_size, checkpoint, Recipe.__table__, flagged_recipe_rows)
+
+
+@recipes_cli.command('export')
+@export_options
+def export_recipes_command(path, format, batch_size):
+    """Export all recipes to a JSONL or CSV file."""
+    run_export(path, format, export_recipes(batch_size), RECIPE_FIELDS)
+
+
+@recipes_cli.command('recount')
+def recount_recipes():
+    """Recompute every category's recipe count from the recipes table."""
+    Category.recount()
+    db.session.commit()
+    click.echo('Recounted recipes in {} categories'.format(Category.query.count()))
+
+
+@recipes_cli.command('backfill')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Recipes updated per transaction.')
+def backfill_recipes(batch_size):
+    """Store the description summaries and the signatures used to spot
+    duplicates for recipes stored without them."""
+    table = Recipe.__table__
+    started = time.time()
+    count = 0
+    while True:
+        rows = db.session.execute(
+            db.select([table.c.id, table.c.recipe_title, table.c.recipe_description])
+              .where(db.or_(table.c.minhash.is_(None), table.c.recipe_summary.is_(None)))
+              .order_by(table.c.id)
+              .limit(batch_size)).fetchall()
+        if not rows:
+            break
+        db.session.execute(
+            table.update().where(table.c.id == db.bindparam('recipe_id')),
+            [{'recipe_id': row.id,
+              'recipe_summary': summarize(row.recipe_description),
+              'minhash': minhash.signature(row.recipe_title, row.recipe_description)}
+             for row in rows])
+        db.session.commit()
+        count += len(rows)
+    duplicate_index.clear()
+    _report('Backfilled', count, started)
+
+
+@users_cli.command('import')
+@import_options
+def import_users(path, format, batch_size, checkpoint):
+    """Import users from a JSONL or CSV file.
+
+    Each record needs an email and either a password_hash (as exported)
+    or a plaintext password, which is hashed in parallel.
+    """
+    run_import(path, format, batch_size, checkpoint, User.__table__, user_rows)
+
+
+@users_cli.command('export')
+@export_options
+def export_users_command(path, format, batch_size):
+    """Export all users, with password hashes, to a JSONL or CSV file."""
+    run_export(path, format, export_users(batch_size), USER_FIELDS)
+
+
+@users_cli.command('normalize-emails')
+@click.option('--batch-size', default=1000, show_default=True,
+              help='Users updated per transaction.')
+def normalize_emails(batch_size):
+    """Fill in the normalized email addresses used to look users up,
+    first adding their column to a database created before it existed,
+    and then create their unique index."""
+    table = User.__table__
+    inspector = inspect(db.session.connection())
+    if 'email_normalized' not in [column['name'] for column in inspector.get_columns('users')]:
+        db.session.execute('ALTER TABLE users ADD COLUMN email_normalized VARCHAR')
+        db.session.commit()
+    started = time.time()
+    count = 0
+    while True:
+        rows = db.session.execute(
+            db.select([table.c.id, table.c.email])
+              .where(table.c.email_normalized.is_(None))
+              .order_by(table.c.id)
+              .limit(batch_size)).fetchall()
+        if not rows:
+            break
+        db.session.execute(
+            table.update().where(table.c.id == db.bindparam('user_id')),
+            [{'user_id': row.id, 'email_normalized': normalize_email(row.email)}
+             for row in rows])
+        db.session.commit()
+        count += len(rows)
+    _report('Normalized', count, started)
+
+    index = 'ix_users_email_normalized'
+    if index in [existing['name'] for existing in inspect(db.session.connection())
+                 .get_indexes('users')]:
+        return
+    clashes = db.session.execute(
+        db.select([table.c.email_normalized])
+          .group_by(table.c.email_normalized)
+          .having(db.func.count() > 1)).fetchall()
+    if clashes:
+        raise click.ClickException(
+            'Some users share an email address differing only in case ({}); '
+            'merge or rename them and run the command again'.format(
+                ', '.join(row.email_normalized for row in clashes)))
+    if db.session.connection().dialect.name == 'postgresql':
+        # build the index without locking out writes, which needs to run
+        # outside a transaction
+        db.session.commit()
+        with db.engine.connect() as connection:
+            connection.execution_options(isolation_level='AUTOCOMMIT').execute(
+                'CREATE UNIQUE INDEX CONCURRENTLY {} ON users (email_normalized)'.format(index))
+    else:
+        next(existing for existing in table.indexes if existing.name == index) \
+            .create(db.session.connection())
+        db.session.commit()
+    click.echo('Created index {}'.format(index))
+
+
+@assets_cli.command('build')
+@click.option('--offline', is_flag=True,
+              help='Do not download vendored files that are missing.')
+def build_assets(offline):
+    """Download the vendored files, then fingerprint and compress every
+    static file for serving with far-future caching."""
+    static_folder = current_app.static_folder
+    if not offline:
+        try:
+            for filename in assets.vendor(static_folder, current_app.config['ASSETS_VENDOR']):
+                click.echo('Downloaded {}'.format(filename))
+        except assets.AssetError as error:
+            raise click.ClickException(str(error))
+    manifest = assets.build(static_folder, current_app.config['ASSETS_BUILD_DIR'])
+    click.echo('Built {} files ({} compressed)'.format(
+        len(manifest), sum(1 for entry in manifest.values() if entry['encodings'])))
+
+
+@maintenance_cli.command('run')
+@click.argument('jobs', nargs=-1, type=click.Choice(list(maintenance.JOBS)))
+@click.option('--batch-size', type=int,
+              help='Rows changed per transaction (default: MAINTENANCE_BATCH_SIZE).')
+@click.option('--pause', type=float,
+              help='Seconds between batches (default: MAINTENANCE_BATCH_PAUSE).')
+@click.option('--every', type=float, default=0,
+              help='Keep running the jobs, this many seconds apart.')
+def run_maintenance(jobs, batch_size, pause, every):
+    """Run the named housekeeping jobs, or all of them, once or (with
+    --every) until stopped.  Rows are changed in short batches, so this
+    is safe to run from cron on a live database."""
+    while True:
+        for name in jobs or maintenance.JOBS:
+            try:
+                report = maintenance.run(name, batch_size, pause)
+            except SQLAlchemyError as error:
+                db.session.rollback()
+                raise click.ClickException('{} failed: {}'.format(name, error))
+            click.echo('{}: {} rows in {} batches ({:.2f}s)'.format(*report))
+        if not every:
+            break
+        time.sleep(every)
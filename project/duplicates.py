@@ -0,0 +1,124 @@
+import threading
+import time
+
+from project import db, metrics
+from project.minhash import LSHIndex
+from project.models import Recipe
+from project.routing import read_only
+from project.signals import recipes_added
+
+
+class DuplicateIndex(object):
+    """The MinHash signatures of the stored recipes in an LSH index, for
+    finding recipes that are probably the same as a new one.
+
+    The signatures are stored with the recipes, so loading the index only
+    reads them back; recipes with no signature yet (see ``flask recipes
+    backfill``) are left out.  Like the title index, it is loaded on first
+    use, recipes committed by this process are added as they are, and it
+    is loaded again once older than ``max_age`` seconds.
+    """
+
+    def __init__(self, max_age=300, threshold=0.6):
+        self.max_age = max_age
+        self.threshold = threshold
+        self._index = None
+        self._loaded_at = 0
+        self._pending = None
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def _stale(self):
+        return self._index is None or (
+            self.max_age and time.time() - self._loaded_at > self.max_age)
+
+    def _load(self):
+        # while a reload is under way, lookups go on with the old index
+        if not self._load_lock.acquire(self._index is None):
+            return
+        try:
+            if not self._stale():
+                return
+            loaded_at = time.time()
+            with self._lock:
+                self._pending = []
+            with read_only():
+                rows = db.session.query(Recipe.id, Recipe.recipe_title, Recipe.minhash) \
+                    .filter(Recipe.minhash.isnot(None)).all()
+            with self._lock:
+                # recipes committed while loading may be in the rows as well;
+                # rows of bulk imports come without ids
+                rows.extend(self._pending)
+                index, seen = LSHIndex(), set()
+                for id, title, signature in rows:
+                    if id is None or id not in seen:
+                        seen.add(id)
+                        self._insert(index, id, title, signature)
+                self._index = index
+                self._loaded_at = loaded_at
+                self._pending = None
+        finally:
+            self._load_lock.release()
+
+    @staticmethod
+    def _insert(index, id, title, signature):
+        if signature is not None:
+            index.add(bytes(signature), (id, title))
+
+    def add(self, id, title, signature):
+        """Index a newly committed recipe."""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((id, title, signature))
+            if self._index is not None:
+                self._insert(self._index, id, title, signature)
+
+    def similar(self, signature, limit=3):
+        """Return up to ``limit`` ``(id, title)`` pairs of the recipes most
+        likely to be duplicates of one with ``signature``."""
+        if self._stale():
+            self._load()
+        with self._lock:
+            matches = self._index.similar(signature, self.threshold)
+        return [item for score, item in matches[:limit]]
+
+    def duplicates_in(self, rows, limit=3):
+        """Yield ``(position, matches)`` for each of ``rows`` (recipe table
+        rows about to be inserted together) resembling a stored recipe or
+        an earlier one of the rows, which is matched as ``(None, title)``."""
+        batch = LSHIndex()
+        for position, row in enumerate(rows):
+            signature = row['minhash']
+            matches = self.similar(signature, limit)
+            if len(matches) < limit:
+                matches.extend(item for score, item in
+                               batch.similar(signature, self.threshold)[:limit - len(matches)])
+            if matches:
+                yield position, matches
+            batch.add(signature, (None, row['recipe_title']))
+
+    def clear(self):
+        """Drop the index, to be loaded again on the next lookup."""
+        with self._lock:
+            self._index = None
+
+    def stats(self):
+        with self._lock:
+            return {'signatures': len(self._index or ())}
+
+
+duplicate_index = DuplicateIndex()
+
+
+@recipes_added.connect
+def index_added_signatures(sender, recipes):
+    for recipe in recipes:
+        duplicate_index.add(recipe.get('id'), recipe['recipe_title'], recipe.get('minhash'))
+
+
+@metrics.add_collector
+def duplicate_metrics():
+    return [
+        ('duplicate_index_signatures', 'gauge', 'Recipe signatures in the duplicate index.',
+         [('', duplicate_index.stats()['signatures'])]),
+    ]
@@ -0,0 +1,170 @@
+import atexit
+import logging
+import os
+import threading
+
+from sqlalchemy import and_, bindparam, case, or_
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm.attributes import set_committed_value
+
+from project import db, user_cache
+from project.models import User
+
+
+logger = logging.getLogger(__name__)
+
+
+def latest_two(*times):
+    """Return the latest and the second latest of ``times``, ignoring
+    None (either may be None if there are too few)."""
+    times = sorted((time for time in times if time is not None), reverse=True)
+    times += [None, None]
+    return times[0], times[1]
+
+
+def merge_logins(current, last, previous, latest):
+    """Return the ``(current_logged_in, last_logged_in)`` of a user stored
+    with ``current`` and ``last`` after logins at ``previous`` (which may be
+    None) and ``latest``: the two latest logins, whichever order the
+    updates are applied in."""
+    if current is None or current < latest:
+        return latest, latest_two(current, previous)[0]
+    return current, latest_two(last, latest)[0]
+
+
+# The same as merge_logins() in SQL, so each UPDATE works from the row as
+# it is, whatever other processes wrote since the login was recorded.
+_users = User.__table__
+_previous = bindparam('previous', type_=db.DateTime)
+_latest = bindparam('latest', type_=db.DateTime)
+_newer = or_(_users.c.current_logged_in.is_(None), _users.c.current_logged_in < _latest)
+UPDATE_LOGINS = _users.update().where(_users.c.id == bindparam('user_id')).values(
+    current_logged_in=case([(_newer, _latest)], else_=_users.c.current_logged_in),
+    last_logged_in=case([
+        (and_(_newer, _previous.isnot(None),
+              or_(_users.c.current_logged_in.is_(None),
+                  _users.c.current_logged_in < _previous)), _previous),
+        (_newer, _users.c.current_logged_in),
+        (or_(_users.c.last_logged_in.is_(None), _users.c.last_logged_in < _latest), _latest),
+    ], else_=_users.c.last_logged_in))
+
+
+class LoginRecorder(object):
+    """Write-behind buffer of users' login times.
+
+    Logging in only records the time here; the two latest logins of each
+    user are kept in memory and written with one batched UPDATE every
+    ``LOGIN_FLUSH_INTERVAL`` seconds, as soon as ``LOGIN_BUFFER_SIZE``
+    users are waiting, and when the process exits.  The UPDATE keeps the
+    latest login in ``current_logged_in`` and the one before it in
+    ``last_logged_in`` even when other processes wrote in between, and
+    users loaded meanwhile are shown the buffered times.  With an interval
+    of 0 each login is written straight away.
+
+    The flushing thread starts on the first login of each process, so a
+    pre-forking server never inherits it.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        self._pending = {}
+        self._pid = None
+        self._exit_handler = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.interval = app.config.get('LOGIN_FLUSH_INTERVAL', 5)
+        self.buffer_size = app.config.get('LOGIN_BUFFER_SIZE', 1000)
+
+    def record(self, user_id, at):
+        """Record that user ``user_id`` logged in at ``at``."""
+        if not self.interval:
+            self._write({user_id: (at, None)})
+            return
+        self._start()
+        with self._lock:
+            self._pending[user_id] = latest_two(at, *self._pending.get(user_id, ()))
+            full = len(self._pending) >= self.buffer_size
+        if full:
+            self._wakeup.set()
+
+    def apply(self, user):
+        """Show ``user`` the login times still waiting to be written."""
+        with self._lock:
+            pending = self._pending.get(user.id)
+        if pending is not None:
+            latest, previous = pending
+            current, last = merge_logins(user.current_logged_in, user.last_logged_in,
+                                         previous, latest)
+            set_committed_value(user, 'current_logged_in', current)
+            set_committed_value(user, 'last_logged_in', last)
+        return user
+
+    def flush(self):
+        """Write the buffered login times now."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        try:
+            self._write(pending)
+        except SQLAlchemyError:
+            logger.exception('Cannot write the login times of %d users', len(pending))
+            with self._lock:
+                for user_id, times in pending.items():
+                    self._pending[user_id] = latest_two(
+                        *(times + self._pending.get(user_id, ())))
+
+    def _write(self, pending):
+        try:
+            db.session.execute(UPDATE_LOGINS, [
+                {'user_id': user_id, 'latest': latest, 'previous': previous}
+                for user_id, (latest, previous) in pending.items()])
+            db.session.commit()
+        except SQLAlchemyError:
+            db.session.rollback()
+            raise
+        for user_id in pending:
+            user_cache.delete(user_id)
+
+    def shutdown(self):
+        """Stop the flushing thread and write what is buffered."""
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            self._pid = None
+        self._wakeup.set()
+        self._thread.join()
+        with self.app.app_context():
+            self.flush()
+            db.session.remove()
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._work, name='login-recorder')
+            self._thread.daemon = True
+            self._thread.start()
+            if not self._exit_handler:
+                atexit.register(self.shutdown)
+                self._exit_handler = True
+
+    def _work(self):
+        pid = os.getpid()
+        with self.app.app_context():
+            while self._pid == pid:
+                self._wakeup.wait(self.interval)
+                self._wakeup.clear()
+                if self._pid != pid:
+                    return
+                self.flush()
+                db.session.remove()
+
+
+login_times = LoginRecorder()
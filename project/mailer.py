@@ -0,0 +1,147 @@
+import atexit
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class MailDispatcher(object):
+    """Sends Flask-Mail messages from a small pool of long-lived workers.
+
+    Messages are put on a bounded queue and sent by ``MAIL_WORKERS``
+    threads.  Each worker keeps its SMTP connection open while the queue
+    has work, sending up to ``MAIL_BATCH_SIZE`` messages before
+    reconnecting, and closes it after ``MAIL_IDLE_TIMEOUT`` seconds
+    without mail.  A failed delivery is retried ``MAIL_MAX_RETRIES`` times
+    on a fresh connection, waiting ``MAIL_RETRY_BACKOFF`` seconds and
+    doubling the wait after each attempt.
+
+    Workers start on the first message sent in each process, so a
+    pre-forking server never inherits them, and queued mail is flushed
+    when the process exits.
+    """
+
+    def __init__(self, app=None, mail=None):
+        self.app = app
+        self.mail = mail
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app, mail)
+
+    def init_app(self, app, mail):
+        self.app = app
+        self.mail = mail
+        self.workers = app.config.get('MAIL_WORKERS', 2)
+        self.queue_size = app.config.get('MAIL_QUEUE_SIZE', 100)
+        self.batch_size = app.config.get('MAIL_BATCH_SIZE', 20)
+        self.idle_timeout = app.config.get('MAIL_IDLE_TIMEOUT', 30)
+        self.max_retries = app.config.get('MAIL_MAX_RETRIES', 3)
+        self.retry_backoff = app.config.get('MAIL_RETRY_BACKOFF', 1.0)
+
+    def send(self, message):
+        """Queue ``message`` for delivery.  Returns False, and logs the
+        message, if the queue is full."""
+        self._start()
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            logger.error('Mail queue is full, dropping message %r to %s',
+                         message.subject, message.send_to)
+            return False
+        return True
+
+    def flush(self):
+        """Block until every queued message has been handled."""
+        if self._pid == os.getpid():
+            self._queue.join()
+
+    def shutdown(self):
+        """Deliver the queued messages, then stop the workers."""
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            for _ in self._threads:
+                self._queue.put(_STOP)
+            for thread in self._threads:
+                thread.join()
+            self._pid = None
+
+    def _start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._threads = [threading.Thread(target=self._work,
+                                              name='mail-dispatcher-{}'.format(number))
+                             for number in range(self.workers)]
+            for thread in self._threads:
+                thread.daemon = True
+                thread.start()
+            if self._pid is None:
+                atexit.register(self.shutdown)
+            self._pid = os.getpid()
+
+    def _work(self):
+        connection = None
+        sent = 0
+        with self.app.app_context():
+            while True:
+                try:
+                    message = self._queue.get(timeout=self.idle_timeout)
+                except queue.Empty:
+                    connection = self._close(connection)
+                    continue
+                try:
+                    if message is _STOP:
+                        connection = self._close(connection)
+                        return
+                    if connection is not None and sent >= self.batch_size:
+                        connection = self._close(connection)
+                    if connection is None:
+                        sent = 0
+                    connection = self._deliver(connection, message)
+                    sent += 1
+                finally:
+                    self._queue.task_done()
+
+    def _deliver(self, connection, message):
+        """Send ``message``, reconnecting and backing off on failure.
+        Returns the connection to reuse for the next message."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                if connection is None:
+                    connection = self._open()
+                connection.send(message)
+                return connection
+            except (smtplib.SMTPException, OSError):
+                connection = self._close(connection)
+                if attempt == self.max_retries:
+                    logger.exception('Giving up sending %r to %s',
+                                     message.subject, message.send_to)
+                    return None
+                time.sleep(self.retry_backoff * 2 ** attempt)
+            except Exception:
+                logger.exception('Cannot send %r to %s',
+                                 message.subject, message.send_to)
+                return connection
+
+    def _open(self):
+        connection = self.mail.connect()
+        connection.__enter__()
+        return connection
+
+    def _close(self, connection):
+        if connection is not None:
+            try:
+                connection.__exit__(None, None, None)
+            except (smtplib.SMTPException, OSError):
+                pass
+        return None
@@ -0,0 +1,87 @@
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, exists, or_, select
+
+from project import db
+from project.models import Recipe, User
+
+
+Report = namedtuple('Report', 'job rows batches seconds')
+
+# name -> function returning the statement to run on each batch of rows
+# matching a condition, in the order the jobs run
+JOBS = OrderedDict()
+
+
+def job(name):
+    def register(function):
+        JOBS[name] = function
+        return function
+    return register
+
+
+@job('unconfirmed-users')
+def purge_unconfirmed_users():
+    """Delete users whose email address is not confirmed, who registered
+    and last logged in more than ``MAINTENANCE_UNCONFIRMED_DAYS`` ago, and
+    who own no recipes."""
+    cutoff = datetime.now() - timedelta(days=current_app.config['MAINTENANCE_UNCONFIRMED_DAYS'])
+    users, recipes = User.__table__, Recipe.__table__
+    return users.delete(), and_(
+        users.c.email_confirmed.isnot(True),
+        users.c.registered_on < cutoff,
+        or_(users.c.current_logged_in.is_(None), users.c.current_logged_in < cutoff),
+        ~exists().where(recipes.c.user_id == users.c.id))
+
+
+@job('session-flags')
+def clear_session_flags():
+    """Clear the ``authenticated`` flags left set when logins were still
+    recorded in the users table; the session alone tracks them now."""
+    users = User.__table__
+    return users.update().values(authenticated=False), users.c.authenticated.is_(True)
+
+
+def run_in_batches(statement, condition, batch_size, pause, sleep=time.sleep):
+    """Run ``statement`` on the rows matching ``condition`` in batches of
+    at most ``batch_size`` consecutive ids, committing each batch and
+    pausing ``pause`` seconds before the next, so no transaction holds
+    locks for long or sends replicas a burst of changes.
+
+    Return the number of rows changed and of batches.
+    """
+    id = statement.table.c.id
+    rows = batches = 0
+    after = None
+    while True:
+        query = select([id]).where(condition).order_by(id).limit(batch_size)
+        if after is not None:
+            query = query.where(id > after)
+        ids = [row[0] for row in db.session.execute(query)]
+        if not ids:
+            db.session.commit()
+            return rows, batches
+        if batches:
+            sleep(pause)
+        # the condition is checked again, for rows changed since they were read
+        result = db.session.execute(statement.where(and_(id >= ids[0], id <= ids[-1], condition)))
+        db.session.commit()
+        rows += result.rowcount
+        batches += 1
+        after = ids[-1]
+        if len(ids) < batch_size:
+            return rows, batches
+
+
+def run(name, batch_size=None, pause=None):
+    """Run the job ``name`` and return its :class:`Report`."""
+    config = current_app.config
+    batch_size = batch_size or config['MAINTENANCE_BATCH_SIZE']
+    pause = config['MAINTENANCE_BATCH_PAUSE'] if pause is None else pause
+    started = time.time()
+    statement, condition = JOBS[name]()
+    rows, batches = run_in_batches(statement, condition, batch_size, pause)
+    return Report(name, rows, batches, time.time() - started)
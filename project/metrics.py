@@ -0,0 +1,150 @@
+import hmac
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.exceptions import Forbidden
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def trusted_request():
+    """Return whether the current request may see internal details: it
+    comes from one of ``METRICS_ALLOWED_ADDRESSES`` or carries
+    ``Authorization: Bearer <METRICS_TOKEN>``."""
+    config = current_app.config
+    if request.remote_addr in config.get('METRICS_ALLOWED_ADDRESSES', ()):
+        return True
+    token = config.get('METRICS_TOKEN')
+    scheme, _, credentials = request.headers.get('Authorization', '').partition(' ')
+    # compared as bytes: compare_digest() rejects non-ASCII strings
+    return bool(token) and scheme.lower() == 'bearer' and \
+        hmac.compare_digest(credentials.strip().encode('utf-8'), token.encode('utf-8'))
+
+
+class Histogram(object):
+    """Counts of observed values in fixed, cumulative buckets."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield '{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, cumulative)
+        yield '{}_sum{{{}}} {}'.format(name, labels, self.sum)
+        yield '{}_count{{{}}} {}'.format(name, labels, self.count)
+
+
+class RequestMetrics(object):
+    """Per-endpoint request latency, SQL statement count and SQL time.
+
+    When ``METRICS_ENABLED`` is set, every request is timed and the SQL
+    statements it runs are counted and timed through SQLAlchemy engine
+    events.  The totals are kept as histograms per endpoint in memory and
+    served in the Prometheus text format at ``/metrics`` to trusted
+    requests only (see :func:`trusted_request`).  When disabled no hooks
+    are installed at all.
+
+    Other parts of the app can publish values on the same page with
+    :meth:`add_collector`.
+    """
+
+    def __init__(self, app=None):
+        self.histograms = {}
+        self.collectors = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', False)
+        if not self.enabled:
+            return
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.add_url_rule('/metrics', 'metrics', self.render)
+        # the listeners apply to every engine, so add them only once even
+        # when several apps are created
+        if not event.contains(Engine, 'before_cursor_execute', self._before_execute):
+            event.listen(Engine, 'before_cursor_execute', self._before_execute)
+            event.listen(Engine, 'after_cursor_execute', self._after_execute)
+
+    def add_collector(self, collector):
+        """Add a callable returning ``(name, type, help, samples)`` tuples,
+        where ``samples`` is a list of ``(labels, value)`` pairs."""
+        self.collectors.append(collector)
+        return collector
+
+    def _start_request(self):
+        self._local.statements = 0
+        self._local.sql_time = 0.0
+        self._local.started = time.time()
+
+    def _finish_request(self, response):
+        started = getattr(self._local, 'started', None)
+        if started is None:
+            return response
+        elapsed = time.time() - started
+        self._local.started = None
+        endpoint = request.endpoint or 'unknown'
+        with self._lock:
+            histograms = self.histograms.get(endpoint)
+            if histograms is None:
+                histograms = self.histograms[endpoint] = (
+                    Histogram(LATENCY_BUCKETS),
+                    Histogram(STATEMENT_BUCKETS),
+                    Histogram(LATENCY_BUCKETS))
+            histograms[0].observe(elapsed)
+            histograms[1].observe(self._local.statements)
+            histograms[2].observe(self._local.sql_time)
+        return response
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if getattr(self._local, 'started', None) is not None:
+            conn.info.setdefault('metrics_query_start', []).append(time.time())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if getattr(self._local, 'started', None) is not None:
+            starts = conn.info.get('metrics_query_start')
+            if starts:
+                self._local.sql_time += time.time() - starts.pop()
+                self._local.statements += 1
+
+    def render(self):
+        if not trusted_request():
+            raise Forbidden()
+        lines = []
+        with self._lock:
+            for name, help, index in (
+                    ('http_request_duration_seconds', 'Request latency.', 0),
+                    ('http_request_sql_statements', 'SQL statements per request.', 1),
+                    ('http_request_sql_duration_seconds', 'SQL time per request.', 2)):
+                lines.append('# HELP {} {}'.format(name, help))
+                lines.append('# TYPE {} histogram'.format(name))
+                for endpoint in sorted(self.histograms):
+                    lines.extend(self.histograms[endpoint][index].samples(
+                        name, 'endpoint="{}"'.format(endpoint)))
+        for collector in self.collectors:
+            for name, type, help, samples in collector():
+                lines.append('# HELP {} {}'.format(name, help))
+                lines.append('# TYPE {} {}'.format(name, type))
+                for labels, value in samples:
+                    lines.append('{}{{{}}} {}'.format(name, labels, value))
+        return Response('\n'.join(lines) + '\n',
+                        mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,98 @@
+import random
+import re
+import struct
+import zlib
+
+
+NUM_HASHES = 64
+BANDS = 16
+ROWS = NUM_HASHES // BANDS
+SHINGLE_WORDS = 3
+
+# Signatures are stored, so the hash functions must be the same in every
+# process: shingles are hashed with CRC-32 and permuted with a fixed seed.
+_PRIME = (1 << 61) - 1
+_MASK = 0xffffffff
+_random = random.Random(20180117)
+_PERMUTATIONS = [(_random.randrange(1, _PRIME), _random.randrange(0, _PRIME))
+                 for _ in range(NUM_HASHES)]
+_FORMAT = struct.Struct('<{}I'.format(NUM_HASHES))
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def shingles(text):
+    """Return the set of overlapping runs of ``SHINGLE_WORDS`` words in
+    ``text``, ignoring case and punctuation."""
+    words = WORD_RE.findall(text.casefold())
+    if len(words) <= SHINGLE_WORDS:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[start:start + SHINGLE_WORDS])
+            for start in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def signature(*texts):
+    """Return the MinHash signature of the shingles of ``texts`` as
+    ``NUM_HASHES`` packed 32-bit values.
+
+    Two signatures agree in about the same fraction of positions as the
+    shingle sets they were made from have in common (their Jaccard
+    similarity).
+    """
+    hashes = [zlib.crc32(shingle.encode('utf-8'))
+              for text in texts for shingle in shingles(text)] or [0]
+    return _FORMAT.pack(*[min((a * value + b) % _PRIME for value in hashes) & _MASK
+                          for a, b in _PERMUTATIONS])
+
+
+def similarity(first, second):
+    """Estimate the Jaccard similarity of two signatures."""
+    return sum(a == b for a, b in zip(_FORMAT.unpack(first), _FORMAT.unpack(second))) \
+        / NUM_HASHES
+
+
+def band_keys(signature):
+    """Split ``signature`` into ``BANDS`` keys of ``ROWS`` values each."""
+    size = ROWS * 4
+    return [signature[start:start + size] for start in range(0, len(signature), size)]
+
+
+class LSHIndex(object):
+    """Locality-sensitive hashing index of MinHash signatures.
+
+    Each signature is filed under each of its bands, and only signatures
+    sharing at least one whole band with the one looked up are compared
+    with it, so a lookup costs about the same however many signatures
+    are indexed.  With 16 bands of 4 values, pairs that are 60% similar
+    share a band 89% of the time and pairs that are 20% similar 3% of
+    the time.
+    """
+
+    def __init__(self):
+        self.items = []
+        self.buckets = [{} for _ in range(BANDS)]
+
+    def add(self, signature, item):
+        number = len(self.items)
+        self.items.append((signature, item))
+        for buckets, key in zip(self.buckets, band_keys(signature)):
+            buckets.setdefault(key, []).append(number)
+
+    def similar(self, signature, threshold):
+        """Return ``(similarity, item)`` pairs of the indexed signatures
+        at least ``threshold`` similar to ``signature``, most similar
+        first."""
+        candidates = set()
+        for buckets, key in zip(self.buckets, band_keys(signature)):
+            candidates.update(buckets.get(key, ()))
+        matches = []
+        for number in sorted(candidates):
+            other, item = self.items[number]
+            score = similarity(signature, other)
+            if score >= threshold:
+                matches.append((score, item))
+        matches.sort(key=lambda match: -match[0])
+        return matches
+
+    def __len__(self):
+        return len(self.items)
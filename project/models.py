@@ -1,30 +1,137 @@
-from project import db, bcrypt
+from collections import Counter
+
+from project import db, minhash, passwords
+from sqlalchemy import event
 from sqlalchemy.ext.hybrid import hybrid_method, hybrid_property
+from sqlalchemy.orm import make_transient_to_detached, validates
+from sqlalchemy.orm.attributes import set_committed_value
 from datetime import datetime
 
 
+# Longest preview of a recipe's description shown in listings
+SUMMARY_LENGTH = 150
+
+
+def summarize(text, length=SUMMARY_LENGTH):
+    """Return ``text`` with its whitespace collapsed, cut at the last word
+    that fits in ``length`` characters and marked with an ellipsis."""
+    text = ' '.join(text.split())
+    if len(text) <= length:
+        return text
+    cut = text.rfind(' ', 0, length + 1)
+    if cut < length // 2:
+        cut = length
+    return text[:cut].rstrip(' ,.;:') + '\u2026'
+
+
+def normalize_email(email):
+    """Return ``email`` as stored in ``User.email_normalized``: without
+    surrounding whitespace and lowercased, so lookups ignore case."""
+    return email.strip().lower()
+
+
+class Category(db.Model):
+    """A recipe category, with a count of its recipes kept up to date as
+    recipes are inserted so listings never need to count them."""
+    __tablename__ = 'categories'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String, unique=True, nullable=False)
+    recipe_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __init__(self, name):
+        self.name = name
+        self.recipe_count = 0
+
+    @classmethod
+    def count_recipes_added(cls, connection, category_ids):
+        """Add recipes just inserted in the categories ``category_ids``
+        (one id per recipe, None for none) to the counts, with one UPDATE
+        per category in the inserting transaction."""
+        counts = Counter(id for id in category_ids if id is not None)
+        for category_id, count in counts.items():
+            connection.execute(cls.__table__.update()
+                               .where(cls.__table__.c.id == category_id)
+                               .values(recipe_count=cls.__table__.c.recipe_count + count))
+
+    @classmethod
+    def recount(cls):
+        """Recalculate every count from the recipes table."""
+        recipes = Recipe.__table__
+        db.session.execute(cls.__table__.update().values(
+            recipe_count=db.select([db.func.count(recipes.c.id)])
+                           .where(recipes.c.category_id == cls.__table__.c.id)
+                           .as_scalar()))
+
+    def __repr__(self):
+        return '<Category {}>'.format(self.name)
+
+
 class Recipe(db.Model):
     """docstring for Recipe"""
     __tablename__ = "recipes"
+    # per-category and per-owner listings seek by category or owner and
+    # page through by id
+    __table_args__ = (db.Index('ix_recipes_category_id_id', 'category_id', 'id'),
+                      db.Index('ix_recipes_user_id_id', 'user_id', 'id'))
 
     id = db.Column(db.Integer, primary_key=True)
     recipe_title = db.Column(db.String, nullable=False)
-    recipe_description = db.Column(db.String, nullable=False)
-
-    def __init__(self, title, description):
+    # listings show the summary; the full description is only loaded for
+    # the recipe's own page
+    recipe_description = db.deferred(db.Column(db.String, nullable=False))
+    recipe_summary = db.Column(db.String(SUMMARY_LENGTH + 1), nullable=True)
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    # MinHash signature of the title and description, used to spot near
+    # duplicates; only loaded when asked for
+    minhash = db.deferred(db.Column(db.LargeBinary, nullable=True))
+    # name of the recipe's photo in the photo store (see project.photos)
+    photo = db.Column(db.String(68), nullable=True)
+
+    category = db.relationship('Category')
+    owner = db.relationship('User')
+
+    def __init__(self, title, description, category_id=None, user_id=None):
         self.recipe_title = title
         self.recipe_description = description
+        self.recipe_summary = summarize(description)
+        self.category_id = category_id
+        self.user_id = user_id
+
+    def fingerprint(self):
+        """Return the MinHash signature of the title and description,
+        computing it first if needed."""
+        if self.minhash is None:
+            self.minhash = minhash.signature(self.recipe_title, self.recipe_description)
+        return self.minhash
 
     def __repr__(self):
         return 'title {}'.format(self.name)
 
 
+@event.listens_for(Recipe, 'before_insert')
+def _fingerprint_recipe(mapper, connection, target):
+    target.fingerprint()
+
+
+@event.listens_for(Recipe, 'after_insert')
+def _count_recipe(mapper, connection, target):
+    Category.count_recipes_added(connection, [target.category_id])
+
+
 class User(db.Model):
     """docstring for User"""
     __tablename__ = 'users'
+    # users are looked up by their normalized email, which is unique; it
+    # is NULL only until `flask users normalize-emails` has filled it in
+    __table_args__ = (db.Index('ix_users_email_normalized', 'email_normalized', unique=True),)
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     email = db.Column(db.String, unique=True, nullable=False)
+    email_normalized = db.Column(db.String, nullable=True)
+    # shown as the author of the user's recipes; chosen on the profile page
+    name = db.Column(db.String, nullable=True)
     _password = db.Column(db.Binary(60), nullable=False)
     authenticated = db.Column(db.Boolean, default=False)
     email_confirmation_sent_on = db.Column(db.DateTime, nullable=True)
@@ -45,22 +152,47 @@ class User(db.Model):
         self.last_logged_in = None
         self.current_logged_in = datetime.now()
 
+    @validates('email')
+    def _normalize_email(self, key, email):
+        self.email_normalized = normalize_email(email)
+        return email
+
+    @classmethod
+    def with_email(cls, email):
+        """Return a query for the user with ``email``, whatever its case,
+        using the unique index on the normalized email."""
+        return cls.query.filter(cls.email_normalized == normalize_email(email))
+
     @hybrid_property
     def password(self):
         return self._password
 
     @password.setter
     def set_password(self, password_plaintext):
-        self._password = bcrypt.generate_password_hash(password_plaintext)
+        self._password = passwords.hash(password_plaintext)
 
     @hybrid_method
     def is_correct_password(self, password_plaintext):
-        return bcrypt.check_password_hash(self.password, password_plaintext)
+        return passwords.check(self.password, password_plaintext)
+
+    @property
+    def password_needs_rehash(self):
+        """True if the stored hash uses a different bcrypt cost than
+        the one currently configured."""
+        return passwords.needs_rehash(self.password)
+
+    @property
+    def display_name(self):
+        """The name shown as the author of this user's recipes: the one
+        they chose, or 'Anonymous', never anything from their email."""
+        return self.name or 'Anonymous'
 
     @property
     def is_authenticated(self):
-        """Return True if the user is authenticated."""
-        return self.authenticated
+        """Always True: only the user logged in to the session is ever
+        loaded, and logging out removes it from the session.  The
+        ``authenticated`` column is no longer written."""
+        return True
 
     @property
     def is_active(self):
@@ -72,6 +204,21 @@ class User(db.Model):
         """Always False, as anonymous users aren't supported."""
         return False
 
+    def snapshot(self):
+        """Return the column values of this user as a plain dict."""
+        return {attr.key: getattr(self, attr.key)
+                for attr in self.__mapper__.column_attrs}
+
+    @classmethod
+    def from_snapshot(cls, values):
+        """Attach a user rebuilt from :meth:`snapshot` to the session
+        without querying the database."""
+        user = cls.__mapper__.class_manager.new_instance()
+        for key, value in values.items():
+            set_committed_value(user, key, value)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
     def get_id(self):
         """Return the email address to satisfy Flask-Login's requirements."""
         """Requires use of Python 3"""
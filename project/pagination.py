@@ -0,0 +1,57 @@
+class KeysetPage(object):
+    """One page of rows from a keyset (cursor) paginated query.
+
+    The query is filtered on ``column`` relative to a cursor instead of using
+    OFFSET, so the database seeks straight to the page through the index on
+    ``column`` and at most ``per_page + 1`` rows are ever fetched.
+    """
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def keyset_paginate(query, column, per_page, after=None, before=None):
+    """Return the page of ``query`` following ``after`` or preceding ``before``.
+
+    ``column`` must be unique and indexed (normally the primary key).  Rows are
+    returned in ascending ``column`` order; the extra row fetched past the page
+    size only tells us whether another page exists and is never returned.
+    """
+    if before is not None:
+        rows = query.filter(column < before) \
+                    .order_by(column.desc()) \
+                    .limit(per_page + 1) \
+                    .all()
+        has_more = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        prev_cursor = _key(items[0], column) if has_more and items else None
+        next_cursor = _key(items[-1], column) if items else None
+    else:
+        if after is not None:
+            query = query.filter(column > after)
+        rows = query.order_by(column).limit(per_page + 1).all()
+        has_more = len(rows) > per_page
+        items = rows[:per_page]
+        next_cursor = _key(items[-1], column) if has_more else None
+        prev_cursor = _key(items[0], column) if after is not None and items else None
+    return KeysetPage(items, next_cursor=next_cursor, prev_cursor=prev_cursor)
+
+
+def _key(row, column):
+    return getattr(row, column.key)
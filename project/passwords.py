@@ -0,0 +1,81 @@
+import threading
+
+import bcrypt
+from werkzeug.exceptions import ServiceUnavailable
+
+from project.workers import WorkerPool
+
+
+class PasswordHasherBusy(ServiceUnavailable):
+    """Raised when every bcrypt worker is busy and the queue is full."""
+    description = 'Too many sign-in requests are being processed. ' \
+                  'Please try again in a moment.'
+
+
+def _hash_password(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check_password(hashed, password):
+    return bcrypt.checkpw(password, hashed)
+
+
+def _to_bytes(value):
+    if isinstance(value, str):
+        return value.encode('utf-8')
+    return bytes(value)
+
+
+class PasswordHasher(object):
+    """Hashes and verifies passwords with bcrypt in a pool of processes.
+
+    Each bcrypt call at a realistic cost takes a lot of CPU time, so it is
+    run outside the request thread in a separate process.  At most
+    ``BCRYPT_WORKERS`` calls run at once and ``BCRYPT_QUEUE_SIZE`` more
+    may wait; beyond that :class:`PasswordHasherBusy` (a 503) is raised
+    immediately instead of piling up blocked requests.  With
+    ``BCRYPT_WORKERS = 0`` hashing runs inline in the calling thread.
+
+    The pool is started on first use in each process, so it is never
+    inherited across a fork, and started again if a worker dies.
+    """
+
+    def __init__(self, app=None):
+        self._pool = WorkerPool()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.rounds = app.config['BCRYPT_LOG_ROUNDS']
+        self.workers = self._pool.workers = app.config['BCRYPT_WORKERS']
+        self._slots = threading.BoundedSemaphore(
+            self.workers + app.config['BCRYPT_QUEUE_SIZE'])
+
+    def hash(self, password):
+        return self._run(_hash_password, _to_bytes(password), self.rounds)
+
+    def hash_many(self, passwords):
+        """Hash a batch of passwords on all workers at once, for bulk
+        imports rather than requests; results keep the input order."""
+        passwords = [_to_bytes(password) for password in passwords]
+        if not self.workers:
+            return [_hash_password(password, self.rounds) for password in passwords]
+        return self._pool.map(_hash_password, passwords, [self.rounds] * len(passwords))
+
+    def check(self, hashed, password):
+        return self._run(_check_password, _to_bytes(hashed), _to_bytes(password))
+
+    def needs_rehash(self, hashed):
+        """Return True if ``hashed`` was made with a cost other than the
+        configured ``BCRYPT_LOG_ROUNDS``."""
+        return int(_to_bytes(hashed)[4:6]) != self.rounds
+
+    def _run(self, func, *args):
+        if not self.workers:
+            return func(*args)
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy()
+        try:
+            return self._pool.run(func, *args)
+        finally:
+            self._slots.release()
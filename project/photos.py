@@ -0,0 +1,191 @@
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import threading
+
+from flask import current_app, request
+from PIL import Image
+from werkzeug.exceptions import NotFound
+from werkzeug.wsgi import wrap_file
+
+from project.assets import ONE_YEAR
+from project.workers import WorkerPool
+
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+# leading bytes of each accepted image type, and the extension it is
+# stored with
+SIGNATURES = [(b'\xff\xd8\xff', 'jpg'), (b'\x89PNG\r\n\x1a\n', 'png'),
+              (b'GIF87a', 'gif'), (b'GIF89a', 'gif')]
+MIMETYPES = {'jpg': 'image/jpeg', 'png': 'image/png', 'gif': 'image/gif'}
+NAME_RE = re.compile(r'^[0-9a-f]{64}\.(jpg|png|gif)$')
+
+
+class PhotoError(ValueError):
+    pass
+
+
+def _make_thumbnail(source, target, size):
+    with Image.open(source) as image:
+        image.thumbnail(size)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        temporary = '{}.{}.tmp'.format(target, os.getpid())
+        image.save(temporary, 'JPEG', quality=85, optimize=True)
+    os.replace(temporary, target)
+
+
+class PhotoStore(object):
+    """Recipe photos stored on disk under the hash of their contents.
+
+    Uploads are copied to ``PHOTOS_DIRECTORY`` (relative to the instance
+    folder) a chunk at a time while being hashed, so the same photo
+    uploaded twice is stored once.  Thumbnails no larger than
+    ``PHOTOS_THUMBNAIL_SIZE`` are made by a pool of ``PHOTOS_WORKERS``
+    processes after the upload returns, and the full photo is served in
+    their place until they are ready, or for good if one cannot be made.
+    With ``PHOTOS_WORKERS = 0`` thumbnails are made inline.
+
+    Both are served with ETags and byte range support; as a stored file
+    never changes, clients may cache it for good.  The pool is started on
+    first use in each process, so it is never inherited across a fork, and
+    started again if a worker dies.
+    """
+
+    def __init__(self, app=None):
+        self._pool = WorkerPool()
+        self._pending = set()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = os.path.join(app.instance_path,
+                                      app.config.get('PHOTOS_DIRECTORY', 'photos'))
+        self.max_size = app.config.get('PHOTOS_MAX_SIZE', 8 * 1024 * 1024)
+        self.thumbnail_size = tuple(app.config.get('PHOTOS_THUMBNAIL_SIZE', (320, 240)))
+        self.workers = app.config.get('PHOTOS_WORKERS', 2)
+
+    @property
+    def workers(self):
+        return self._pool.workers
+
+    @workers.setter
+    def workers(self, workers):
+        self._pool.workers = workers
+
+    def path(self, name):
+        return os.path.join(self.directory, name[:2], name)
+
+    def thumbnail_path(self, name):
+        return os.path.join(self.directory, 'thumbnails', name[:2],
+                            os.path.splitext(name)[0] + '.jpg')
+
+    def save(self, upload):
+        """Store the uploaded file ``upload`` and start making its
+        thumbnail; return the name to store with the recipe."""
+        os.makedirs(self.directory, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        extension = None
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp',
+                                         delete=False) as output:
+            try:
+                while True:
+                    chunk = upload.stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    if extension is None:
+                        extension = next((extension for signature, extension in SIGNATURES
+                                          if chunk.startswith(signature)), None)
+                        if extension is None:
+                            raise PhotoError('Photos must be JPEG, PNG or GIF images.')
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise PhotoError('Photos must be at most {:g} MB.'.format(
+                            self.max_size / (1024 * 1024)))
+                    digest.update(chunk)
+                    output.write(chunk)
+            except Exception:
+                os.remove(output.name)
+                raise
+        if extension is None:
+            os.remove(output.name)
+            raise PhotoError('The photo is empty.')
+        name = '{}.{}'.format(digest.hexdigest(), extension)
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.exists(path):
+            os.remove(output.name)
+        else:
+            os.chmod(output.name, 0o644)
+            os.replace(output.name, path)
+        self.make_thumbnail(name)
+        return name
+
+    def make_thumbnail(self, name):
+        """Make the thumbnail of photo ``name`` unless it exists or is
+        being made."""
+        target = self.thumbnail_path(name)
+        with self._lock:
+            if name in self._pending or os.path.exists(target):
+                return
+            self._pending.add(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        args = (self.path(name), target, self.thumbnail_size)
+        if not self.workers:
+            try:
+                _make_thumbnail(*args)
+            except Exception:
+                logger.exception('Cannot make the thumbnail of %s', name)
+            with self._lock:
+                self._pending.discard(name)
+            return
+        try:
+            future = self._pool.submit(_make_thumbnail, *args)
+        except Exception:
+            logger.exception('Cannot queue the thumbnail of %s', name)
+            with self._lock:
+                self._pending.discard(name)
+            return
+        future.add_done_callback(lambda future: self._made(name, future))
+
+    def _made(self, name, future):
+        with self._lock:
+            self._pending.discard(name)
+        if future.exception() is not None:
+            logger.error('Cannot make the thumbnail of %s: %s', name, future.exception())
+
+    def send(self, name, thumbnail=False):
+        """Return a response serving photo ``name`` or its thumbnail."""
+        if not NAME_RE.match(name):
+            raise NotFound()
+        if thumbnail and os.path.exists(self.thumbnail_path(name)):
+            return self._send(self.thumbnail_path(name), 'image/jpeg', 't' + name, True)
+        # until the thumbnail is ready, the photo stands in for it
+        return self._send(self.path(name), MIMETYPES[name.rsplit('.', 1)[1]], name,
+                          not thumbnail)
+
+    def _send(self, path, mimetype, etag, immutable):
+        try:
+            file = open(path, 'rb')
+        except FileNotFoundError:
+            raise NotFound()
+        stat = os.fstat(file.fileno())
+        response = current_app.response_class(wrap_file(request.environ, file),
+                                              mimetype=mimetype, direct_passthrough=True)
+        response.content_length = stat.st_size
+        response.last_modified = stat.st_mtime
+        response.set_etag(etag)
+        response.headers['X-Content-Type-Options'] = 'nosniff'
+        if immutable:
+            response.headers['Cache-Control'] = 'public, max-age={}, immutable'.format(ONE_YEAR)
+        else:
+            response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request, accept_ranges=True,
+                                         complete_length=stat.st_size)
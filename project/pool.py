@@ -0,0 +1,122 @@
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+class TimedQueuePool(QueuePool):
+    """A QueuePool timing how long each checkout waits for a connection,
+    including opening a new one when the pool may still grow.
+
+    The waits are recorded in the pool's :class:`PoolStats`, which is
+    handed on when the engine recreates its pool.
+    """
+    stats = None
+
+    def _do_get(self):
+        started = time.time()
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        finally:
+            if self.stats is not None:
+                self.stats.observe_wait(time.time() - started)
+
+    def recreate(self):
+        pool = super(TimedQueuePool, self).recreate()
+        pool.stats = self.stats
+        return pool
+
+
+def ping_connection(dbapi_connection, connection_record, connection_proxy):
+    """Check a connection is still usable before handing it out; the pool
+    replaces one that is not with a fresh connection."""
+    try:
+        cursor = dbapi_connection.cursor()
+        cursor.execute('SELECT 1')
+        cursor.close()
+    except Exception as error:
+        raise exc.DisconnectionError(str(error))
+
+
+class PoolStats(object):
+    """Connections of one engine's pool, counted through pool events.
+
+    Keeps how many connections are open and checked out, how many were
+    opened, closed and invalidated over time (the pool's churn), and the
+    number and total time of checkout waits when the pool is a
+    :class:`TimedQueuePool`.  With ``pre_ping`` each connection is tested
+    with ``SELECT 1`` as it is checked out.
+    """
+
+    def __init__(self, engine, pre_ping=False):
+        self.engine = engine
+        self.open = 0
+        self.checked_out = 0
+        self.opened = 0
+        self.closed = 0
+        self.invalidated = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self._lock = threading.Lock()
+        pool = engine.pool
+        # the ping goes first so that a checkout it turns away is not counted
+        if pre_ping:
+            event.listen(pool, 'checkout', ping_connection)
+        event.listen(pool, 'connect', self._connect)
+        event.listen(pool, 'checkout', self._checkout)
+        event.listen(pool, 'checkin', self._checkin)
+        event.listen(pool, 'invalidate', self._invalidate)
+        event.listen(pool, 'close', self._close)
+        event.listen(pool, 'detach', self._detach)
+        pool.stats = self
+
+    @property
+    def idle(self):
+        return max(self.open - self.checked_out, 0)
+
+    def observe_wait(self, seconds):
+        with self._lock:
+            self.waits += 1
+            self.wait_time += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {'open': self.open, 'checked_out': self.checked_out,
+                    'idle': self.idle, 'opened': self.opened,
+                    'closed': self.closed, 'invalidated': self.invalidated,
+                    'waits': self.waits, 'wait_seconds': self.wait_time}
+
+    def _connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.open += 1
+            self.opened += 1
+
+    def _checkout(self, dbapi_connection, connection_record, connection_proxy):
+        # the record's info is cleared when its connection is replaced, so
+        # a checkout that ends in a reconnect is not checked in twice
+        connection_record.info['pool_stats_checked_out'] = True
+        with self._lock:
+            self.checked_out += 1
+
+    def _checkin(self, dbapi_connection, connection_record):
+        if connection_record.info.pop('pool_stats_checked_out', False):
+            with self._lock:
+                self.checked_out -= 1
+
+    def _invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidated += 1
+
+    def _close(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.open -= 1
+            self.closed += 1
+
+    def _detach(self, dbapi_connection, connection_record):
+        # the connection leaves the pool and is closed without events
+        checked_out = connection_record.info.pop('pool_stats_checked_out', False)
+        with self._lock:
+            self.open -= 1
+            if checked_out:
+                self.checked_out -= 1
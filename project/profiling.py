@@ -0,0 +1,177 @@
+import cProfile
+import hmac
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import request
+
+
+class StackSampler(object):
+    """Background thread recording the stacks of registered threads.
+
+    Every ``interval`` seconds the current frame of each registered thread
+    is read and counted as a collapsed stack (``outer;...;inner``) under
+    the key it was registered with.  The thread sleeps while no thread is
+    registered, and is only started by the first :meth:`watch`.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.watched = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def watch(self, thread_id, counts):
+        with self._lock:
+            self.watched[thread_id] = counts
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='stack-sampler')
+                self._thread.daemon = True
+                self._thread.start()
+        self._wakeup.set()
+
+    def unwatch(self, thread_id):
+        with self._lock:
+            self.watched.pop(thread_id, None)
+            if not self.watched:
+                self._wakeup.clear()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, counts in self.watched.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        counts[collapse(frame)] += 1
+
+
+def collapse(frame):
+    """Return the stack ending at ``frame`` as ``outer;...;inner``."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append('{} ({}:{})'.format(code.co_name, code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class RequestProfiler(object):
+    """Profiles a sample of requests and aggregates the results per
+    endpoint.
+
+    When ``PROFILER_ENABLED`` is set, each request is profiled with
+    probability ``PROFILER_SAMPLE_RATE``, or when it carries the
+    ``PROFILER_HEADER`` header set to ``PROFILER_SECRET``.  A profiled
+    request runs under cProfile while its stack is sampled every
+    ``PROFILER_STACK_INTERVAL`` seconds.  The totals per endpoint are
+    written to ``PROFILER_DIRECTORY`` (relative to the instance folder) at
+    most every ``PROFILER_DUMP_INTERVAL`` seconds, as a ``.pstats`` file
+    and a ``.collapsed`` file of stack counts for flame graph tools.
+    When disabled no hooks are installed at all.
+    """
+
+    def __init__(self, app=None):
+        self.profiles = {}
+        self.stacks = {}
+        self.sampled = Counter()
+        self.sampler = StackSampler()
+        self._lock = threading.Lock()
+        self._dump_lock = threading.Lock()
+        self._local = threading.local()
+        self._last_dump = time.time()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('PROFILER_ENABLED', False)
+        if not self.enabled:
+            return
+        self.sample_rate = app.config.get('PROFILER_SAMPLE_RATE', 0.0)
+        self.header = app.config.get('PROFILER_HEADER', 'X-Profile')
+        self.secret = app.config.get('PROFILER_SECRET')
+        self.dump_interval = app.config.get('PROFILER_DUMP_INTERVAL', 60)
+        self.directory = os.path.join(app.instance_path,
+                                      app.config.get('PROFILER_DIRECTORY', 'profiles'))
+        self.sampler.interval = app.config.get('PROFILER_STACK_INTERVAL', 0.005)
+        app.before_request(self._start_request)
+        app.teardown_request(self._finish_request)
+
+    def _wanted(self):
+        if self.secret:
+            token = request.headers.get(self.header)
+            # compared as bytes: compare_digest() rejects non-ASCII strings
+            if token is not None and hmac.compare_digest(token.encode('utf-8'),
+                                                         self.secret.encode('utf-8')):
+                return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _start_request(self):
+        if not self._wanted():
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # another profiler is already running in this thread
+            return
+        stacks = Counter()
+        self._local.profile = profile
+        self._local.stacks = stacks
+        self.sampler.watch(threading.get_ident(), stacks)
+
+    def _finish_request(self, exception=None):
+        profile = getattr(self._local, 'profile', None)
+        if profile is None:
+            return
+        profile.disable()
+        self.sampler.unwatch(threading.get_ident())
+        stacks = self._local.stacks
+        self._local.profile = self._local.stacks = None
+        endpoint = request.endpoint or 'unknown'
+        with self._lock:
+            if endpoint in self.profiles:
+                self.profiles[endpoint].add(profile)
+            else:
+                self.profiles[endpoint] = pstats.Stats(profile)
+            self.stacks.setdefault(endpoint, Counter()).update(stacks)
+            self.sampled[endpoint] += 1
+            dump = time.time() - self._last_dump >= self.dump_interval
+            if dump:
+                self._last_dump = time.time()
+        if dump:
+            self.dump()
+
+    def dump(self):
+        """Write the profiles gathered so far, one pair of files per
+        endpoint named after it and the process id.
+
+        Only copying them holds up the requests being profiled; the files
+        are written after, one dump at a time.
+        """
+        with self._lock:
+            # Stats.add() replaces the entries it changes, so a shallow
+            # copy of them is not affected by later requests
+            snapshot = [(endpoint, dict(stats.stats), sorted(self.stacks[endpoint].items()))
+                        for endpoint, stats in self.profiles.items()]
+        with self._dump_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            for endpoint, stats, stacks in snapshot:
+                path = os.path.join(self.directory, '{}.{}'.format(endpoint, os.getpid()))
+                # the format of Stats.dump_stats()
+                with open(path + '.pstats.tmp', 'wb') as output:
+                    marshal.dump(stats, output)
+                os.replace(path + '.pstats.tmp', path + '.pstats')
+                with open(path + '.collapsed.tmp', 'w') as output:
+                    for stack, count in stacks:
+                        output.write('{} {}\n'.format(stack, count))
+                os.replace(path + '.collapsed.tmp', path + '.collapsed')
@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask import request
+from werkzeug.exceptions import TooManyRequests
+from werkzeug.utils import import_string
+
+
+class RateLimited(TooManyRequests):
+    """Raised when a client has used up its attempts for now."""
+    description = 'Too many attempts. Please wait a moment and try again.'
+
+    def __init__(self, retry_after):
+        super(RateLimited, self).__init__()
+        self.retry_after = retry_after
+
+    def get_headers(self, environ=None):
+        headers = super(RateLimited, self).get_headers(environ)
+        headers.append(('Retry-After', str(int(self.retry_after) + 1)))
+        return headers
+
+
+class MemoryBucketStore(object):
+    """Token buckets kept in this process, split over ``shards`` dicts
+    with a lock each so concurrent requests rarely wait on one another.
+
+    This is the default store.  Any object with the same ``consume``,
+    ``clear`` and ``stats`` methods (for example one keeping the buckets
+    in a store shared between worker processes) can be configured
+    instead through ``RATELIMIT_BACKEND``.  Each shard keeps at most its
+    share of ``max_keys`` buckets, dropping the least recently used.
+    """
+
+    def __init__(self, shards=16, max_keys=100000):
+        self._shards = [(OrderedDict(), threading.Lock()) for _ in range(shards)]
+        self._max_per_shard = max(1, max_keys // shards)
+
+    def consume(self, key, capacity, period):
+        """Take one token from the bucket ``key``, which holds up to
+        ``capacity`` tokens and refills completely over ``period``
+        seconds.  Return ``(allowed, retry_after)``, where
+        ``retry_after`` is the number of seconds until a token is
+        available when none was."""
+        rate = capacity / period
+        now = time.monotonic()
+        buckets, lock = self._shards[hash(key) % len(self._shards)]
+        with lock:
+            tokens, updated = buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            buckets[key] = (tokens, now)
+            if len(buckets) > self._max_per_shard:
+                buckets.popitem(last=False)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+    def clear(self):
+        for buckets, lock in self._shards:
+            with lock:
+                buckets.clear()
+
+    def stats(self):
+        return {'keys': sum(len(buckets) for buckets, _ in self._shards)}
+
+
+class RateLimiter(object):
+    """Limits attempts at expensive actions by client IP and by email.
+
+    Every check takes a token from the client's IP bucket and, if an
+    email is given, from that email's bucket, both limited per action.
+    ``RATELIMIT_PER_IP`` and ``RATELIMIT_PER_EMAIL`` are ``(attempts,
+    seconds)``: a burst of up to ``attempts``, refilling at that many per
+    ``seconds``.  When either bucket is empty :class:`RateLimited` (a
+    429) is raised, so callers check before doing any database or bcrypt
+    work.  Nothing is limited when ``RATELIMIT_ENABLED`` is off.
+    """
+
+    def __init__(self, app=None):
+        self.counts = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config['RATELIMIT_ENABLED']
+        self.per_ip = app.config['RATELIMIT_PER_IP']
+        self.per_email = app.config['RATELIMIT_PER_EMAIL']
+        backend_class = import_string(app.config['RATELIMIT_BACKEND'])
+        self.backend = backend_class(shards=app.config['RATELIMIT_SHARDS'],
+                                     max_keys=app.config['RATELIMIT_MAX_KEYS'])
+
+    def check(self, action, email=None):
+        """Count an attempt at ``action`` by the current client, raising
+        :class:`RateLimited` if it has made too many."""
+        if not self.enabled:
+            return
+        limits = [('ip', request.remote_addr, self.per_ip)]
+        if email:
+            limits.append(('email', email.strip().lower(), self.per_email))
+        for kind, value, (capacity, period) in limits:
+            allowed, retry_after = self.backend.consume(
+                '{}:{}:{}'.format(action, kind, value), capacity, period)
+            if not allowed:
+                self._count(action, 'rejected_' + kind)
+                raise RateLimited(retry_after)
+        self._count(action, 'allowed')
+
+    def _count(self, action, result):
+        with self._lock:
+            key = (action, result)
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def reset(self):
+        """Forget every bucket and counter."""
+        self.backend.clear()
+        with self._lock:
+            self.counts.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
@@ -1,5 +1,6 @@
 from flask_wtf import FlaskForm as Form
-from wtforms import StringField
+from flask_wtf.file import FileAllowed, FileField
+from wtforms import SelectField, StringField
 from wtforms.validators import DataRequired
 
 
@@ -7,3 +8,6 @@ class AddRecipeForm(Form):
     """docstring for AddRecipeForm"""
     recipe_title = StringField('Recipe Title', validators=[DataRequired()])
     recipe_description = StringField('Recipe Description', validators=[DataRequired()])
+    category = SelectField('Category', coerce=int, default=0)
+    photo = FileField('Photo', validators=[
+        FileAllowed(['jpg', 'jpeg', 'png', 'gif'], 'Photos must be JPEG, PNG or GIF images.')])
@@ -1,6 +1,15 @@
-from flask import render_template, Blueprint, redirect, url_for, request, flash
-from project import db
-from project.models import Recipe
+import hashlib
+
+from flask import render_template, Blueprint, redirect, url_for, request, \
+    flash, session, make_response, Markup, current_app, abort, jsonify
+from flask_login import current_user
+from project import db, duplicate_index, photos, recipe_cache, title_index
+from project.models import Category, Recipe
+from project.pagination import keyset_paginate
+from project.photos import PhotoError
+from project.routing import read_only
+from project.search import search_recipes
+from project.signals import recipes_added
 from .forms import AddRecipeForm
 
 
@@ -16,23 +25,166 @@ def flash_errors(form):
             ), 'info')
 
 
+@recipes_added.connect
+def invalidate_recipe_list(sender, recipes):
+    recipe_cache.bump()
+
+
+def category_counts():
+    """Return the categories with their recipe counts, as dicts, cached
+    until a new recipe is committed."""
+    categories = recipe_cache.get('categories')
+    if categories is None:
+        categories = [{'id': category.id, 'name': category.name,
+                       'recipe_count': category.recipe_count}
+                      for category in Category.query.order_by(Category.id)]
+        recipe_cache.set('categories', categories)
+    return categories
+
+
+def render_recipe_list(after, before, category_id=None):
+    """Render one page of the recipe table, optionally for one category,
+    reusing the cached HTML until a new recipe is committed."""
+    per_page = current_app.config['RECIPES_PER_PAGE']
+    key = 'list:{}:{}:{}:{}'.format(category_id, per_page, after, before)
+    html = recipe_cache.get(key)
+    if html is None:
+        # the authors are loaded in the same query, so a page costs one
+        # statement however many recipes it shows
+        query = Recipe.query.options(
+            db.joinedload(Recipe.owner).load_only('id', 'name'))
+        if category_id is None:
+            endpoint, args = 'recipes.index', {}
+        else:
+            query = query.filter(Recipe.category_id == category_id)
+            endpoint, args = 'recipes.category', {'category_id': category_id}
+        page = keyset_paginate(query, Recipe.id, per_page=per_page,
+                               after=after, before=before)
+        html = render_template('_recipe_list.html', recipes=page,
+                               endpoint=endpoint, args=args, show_author=True)
+        recipe_cache.set(key, html)
+    return Markup(html)
+
+
+def cacheable(response, etag):
+    """Let browsers keep ``response`` but revalidate it on every visit."""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.headers['Vary'] = 'Cookie'
+    return response
+
+
+def recipe_list_response(category=None):
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+    category_id = category['id'] if category is not None else None
+
+    # The page embeds the navbar for the current user (with their email)
+    # and any flashed messages, so only responses without pending flashes
+    # get an ETag.
+    etag = None
+    if not session.get('_flashes'):
+        etag = hashlib.md5('{}:{}:{}:{}:{}:{}'.format(
+            recipe_cache.version(), category_id, after, before, current_user.get_id(),
+            getattr(current_user, 'email', None)
+        ).encode('utf-8')).hexdigest()
+        if etag in request.if_none_match:
+            return cacheable(make_response('', 304), etag)
+
+    response = make_response(render_template(
+        'recipes.html', category=category, categories=category_counts(),
+        recipe_list=render_recipe_list(after, before, category_id)))
+    if etag is not None:
+        cacheable(response, etag)
+    return response
+
+
 @recipes_blueprint.route('/')
+@read_only()
 def index():
-    all_recipes = Recipe.query.all()
-    return render_template('recipes.html', recipes=all_recipes)
+    return recipe_list_response()
+
+
+@recipes_blueprint.route('/category/<int:category_id>')
+@read_only()
+def category(category_id):
+    for category in category_counts():
+        if category['id'] == category_id:
+            return recipe_list_response(category)
+    abort(404)
+
+
+@recipes_blueprint.route('/recipe/<int:recipe_id>')
+@read_only()
+def recipe(recipe_id):
+    recipe = Recipe.query.options(db.undefer('recipe_description'),
+                                  db.joinedload(Recipe.owner).load_only('id', 'name'),
+                                  db.joinedload(Recipe.category)) \
+        .filter(Recipe.id == recipe_id).first_or_404()
+    return render_template('recipe.html', recipe=recipe)
+
+
+@recipes_blueprint.route('/search')
+@read_only()
+def search():
+    terms = request.args.get('q', '')
+    results = search_recipes(terms,
+                             page=request.args.get('page', 1, type=int),
+                             per_page=current_app.config['RECIPES_PER_PAGE'])
+    return render_template('search.html', results=results)
+
+
+@recipes_blueprint.route('/autocomplete')
+def autocomplete():
+    max_results = current_app.config['AUTOCOMPLETE_MAX_RESULTS']
+    limit = min(request.args.get('limit', max_results, type=int), max_results)
+    matches = title_index.complete(request.args.get('q', ''), limit)
+    return jsonify(recipes=[{'id': id, 'recipe_title': title} for id, title in matches])
+
+
+def save_photo(field):
+    """Store the photo uploaded in ``field``, if any, replacing its data
+    with the stored name; return False if it was rejected."""
+    if field.data is None:
+        return True
+    try:
+        field.data = photos.save(field.data)
+    except PhotoError as error:
+        field.errors.append(str(error))
+        return False
+    return True
+
+
+@recipes_blueprint.route('/photos/<name>')
+def photo(name):
+    return photos.send(name)
+
+
+@recipes_blueprint.route('/photos/<name>/thumbnail')
+def photo_thumbnail(name):
+    return photos.send(name, thumbnail=True)
 
 
 @recipes_blueprint.route('/add', methods=['GET', 'POST'])
 def add_recipe():
-    form = AddRecipeForm(request.form)
+    form = AddRecipeForm()
+    form.category.choices = [(0, 'None')] + [
+        (category['id'], category['name']) for category in category_counts()]
     if request.method == 'POST':
-        if form.validate_on_submit():
+        if form.validate_on_submit() and save_photo(form.photo):
             new_recipe = Recipe(form.recipe_title.data,
-                                form.recipe_description.data)
+                                form.recipe_description.data,
+                                form.category.data or None,
+                                current_user.id if current_user.is_authenticated else None)
+            new_recipe.photo = form.photo.data
+            duplicates = duplicate_index.similar(new_recipe.fingerprint())
             db.session.add(new_recipe)
             db.session.commit()
             flash('New recipe, {}, added!'.format(new_recipe.recipe_title),
                   'success')
+            if duplicates:
+                flash('It looks a lot like {}, which was already added.'.format(
+                    ', '.join(title for id, title in duplicates)), 'info')
             return redirect(url_for('recipes.index'))
         else:
             flash_errors(form)
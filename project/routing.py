@@ -0,0 +1,208 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import _app_ctx_stack, g, has_request_context, jsonify, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import orm
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.ddl import DDLElement
+from sqlalchemy.sql.dml import UpdateBase
+
+from project.metrics import trusted_request
+from project.pool import PoolStats, TimedQueuePool
+
+
+@contextmanager
+def read_only():
+    """Let the queries made inside go to a read replica.
+
+    Use it as ``with read_only():`` around a lookup, or as ``@read_only()``
+    on a view that never writes.  Queries still go to the primary once the
+    session has written anything, and for a while after the same client
+    wrote (see ``SQLALCHEMY_REPLICA_STICKY_SECONDS``).
+    """
+    previous = g.get('read_only', False)
+    g.read_only = True
+    try:
+        yield
+    finally:
+        g.read_only = previous
+
+
+class ReplicaSet(object):
+    """The read replica binds of one app, and how many sessions are
+    currently reading from each.
+
+    With ``least_loaded`` selection a session gets the replica with the
+    fewest sessions, ties going to the next one in turn; with
+    ``round_robin`` the replicas are simply taken in turn.
+    """
+
+    def __init__(self, binds, selection='round_robin'):
+        if selection not in ('round_robin', 'least_loaded'):
+            raise ValueError('unknown replica selection {!r}'.format(selection))
+        self.binds = list(binds)
+        self.selection = selection
+        self.in_use = dict.fromkeys(self.binds, 0)
+        self.sessions = dict.fromkeys(self.binds, 0)
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            count = len(self.binds)
+            order = [self.binds[(self._next + offset) % count] for offset in range(count)]
+            if self.selection == 'least_loaded':
+                bind = min(order, key=self.in_use.get)
+            else:
+                bind = order[0]
+            self._next = (self.binds.index(bind) + 1) % count
+            self.in_use[bind] += 1
+            self.sessions[bind] += 1
+            return bind
+
+    def release(self, bind):
+        with self._lock:
+            self.in_use[bind] -= 1
+
+
+class RoutingSession(SignallingSession):
+    """A session sending reads made under :func:`read_only` to a replica.
+
+    Flushes, INSERT, UPDATE and DELETE statements, DDL and plain
+    ``connection()`` calls use the primary; other statements, including
+    ``text()`` queries, are reads.  After the first write every statement
+    of the session goes to the primary, so a request reads its own
+    writes.  A session keeps the replica it picked until it is closed.
+    """
+
+    def __init__(self, db, **options):
+        super(RoutingSession, self).__init__(db, **options)
+        self.db = db
+        self.replicas = self.app.extensions.get('read_replicas')
+        self.replica = None
+        self.wrote = False
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.replicas is None:
+            return super(RoutingSession, self).get_bind(mapper, clause)
+        if self._flushing or isinstance(clause, (UpdateBase, DDLElement)):
+            self._record_write()
+        elif clause is not None and not self.wrote and self._reading():
+            if self.replica is None:
+                self.replica = self.replicas.acquire()
+            return self.db.get_engine(self.app, bind=self.replica)
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+    def _record_write(self):
+        self.wrote = True
+        if _app_ctx_stack.top is not None:
+            g.wrote_primary = True
+
+    def _reading(self):
+        if _app_ctx_stack.top is None or not g.get('read_only', False):
+            return False
+        return not (has_request_context() and
+                    session.get('_primary_until', 0) > time.time())
+
+    def close(self):
+        super(RoutingSession, self).close()
+        if self.replica is not None:
+            self.replicas.release(self.replica)
+            self.replica = None
+        self.wrote = False
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy with read replicas and observable pools.
+
+    ``SQLALCHEMY_READ_REPLICAS`` lists keys of ``SQLALCHEMY_BINDS`` that
+    are read-only copies of the primary database, selected per session as
+    ``SQLALCHEMY_REPLICA_SELECTION`` says.  With no replicas configured
+    every query uses the primary, as before.
+
+    The pool of every engine is watched by a :class:`~project.pool.PoolStats`
+    kept in ``app.extensions['db_pools']`` by bind (``None`` for the
+    primary), and ``/healthz`` reports them after checking each database
+    answers; untrusted requests only get the overall status.
+    ``SQLALCHEMY_POOL_PRE_PING`` tests connections as they are checked
+    out.
+    """
+
+    def init_app(self, app):
+        super(RoutingSQLAlchemy, self).init_app(app)
+        app.config.setdefault('SQLALCHEMY_POOL_PRE_PING', False)
+        app.extensions['db_pools'] = {}
+        app.add_url_rule('/healthz', 'healthz', self.healthz)
+        replicas = app.config.get('SQLALCHEMY_READ_REPLICAS') or []
+        binds = app.config.get('SQLALCHEMY_BINDS') or {}
+        for bind in replicas:
+            if bind not in binds:
+                raise ValueError('read replica {!r} is not in SQLALCHEMY_BINDS'.format(bind))
+        if replicas:
+            app.extensions['read_replicas'] = ReplicaSet(
+                replicas, app.config.get('SQLALCHEMY_REPLICA_SELECTION', 'round_robin'))
+            app.after_request(self._remember_write)
+        else:
+            app.extensions.pop('read_replicas', None)
+
+    def _remember_write(self, response):
+        # the replicas may not have the client's write yet when the
+        # browser follows the redirect, so it reads from the primary
+        # for a while
+        seconds = self.get_app().config.get('SQLALCHEMY_REPLICA_STICKY_SECONDS', 0)
+        if seconds and g.get('wrote_primary'):
+            session['_primary_until'] = time.time() + seconds
+        return response
+
+    def apply_driver_hacks(self, app, info, options):
+        super(RoutingSQLAlchemy, self).apply_driver_hacks(app, info, options)
+        poolclass = options.get('poolclass') or info.get_dialect().get_pool_class(info)
+        if not issubclass(poolclass, QueuePool):
+            # the SQLite pools take no size, overflow or timeout
+            for option in ('pool_size', 'max_overflow', 'pool_timeout'):
+                options.pop(option, None)
+        elif 'poolclass' not in options:
+            # time checkouts wherever the dialect uses a QueuePool anyway
+            options['poolclass'] = TimedQueuePool
+
+    def get_engine(self, app=None, bind=None):
+        engine = super(RoutingSQLAlchemy, self).get_engine(app, bind)
+        app = self.get_app(app)
+        pools = app.extensions.get('db_pools')
+        if pools is not None:
+            stats = pools.get(bind)
+            if stats is None or stats.engine is not engine:
+                with self._engine_lock:
+                    stats = pools.get(bind)
+                    if stats is None or stats.engine is not engine:
+                        pools[bind] = PoolStats(
+                            engine, app.config['SQLALCHEMY_POOL_PRE_PING'])
+        return engine
+
+    def healthz(self):
+        app = self.get_app()
+        binds = [None] + list(app.config.get('SQLALCHEMY_BINDS') or ())
+        status, pools = 200, {}
+        for bind in binds:
+            try:
+                with self.get_engine(app, bind).connect() as connection:
+                    connection.scalar('SELECT 1')
+            except Exception as error:
+                status = 503
+                app.logger.warning('Health check of %s failed: %s', bind or 'primary', error)
+                pools[bind or 'primary'] = {'ok': False}
+            else:
+                pools[bind or 'primary'] = dict(
+                    app.extensions['db_pools'][bind].snapshot(), ok=True)
+        if trusted_request():
+            response = jsonify(status='ok' if status == 200 else 'unavailable',
+                               databases=pools)
+        else:
+            response = jsonify(status='ok' if status == 200 else 'unavailable')
+        response.status_code = status
+        return response
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
@@ -0,0 +1,122 @@
+import re
+
+from sqlalchemy import DDL, event, text
+
+from project import db
+from project.models import Recipe
+
+
+# PostgreSQL keeps a tsvector column on the recipes table itself, filled by
+# the built-in tsvector_update_trigger and covered by a GIN index.
+POSTGRESQL_DDL = (
+    "ALTER TABLE recipes ADD COLUMN search_vector tsvector",
+    "CREATE INDEX ix_recipes_search_vector ON recipes USING gin(search_vector)",
+    "CREATE TRIGGER recipes_search_vector_update "
+    "BEFORE INSERT OR UPDATE ON recipes FOR EACH ROW "
+    "EXECUTE PROCEDURE tsvector_update_trigger("
+    "search_vector, 'pg_catalog.english', recipe_title, recipe_description)",
+)
+
+# SQLite uses an external-content FTS5 table that mirrors the recipes table
+# through triggers, so the index commits in the same transaction as the row.
+SQLITE_DDL = (
+    "CREATE VIRTUAL TABLE recipes_fts USING fts5("
+    "recipe_title, recipe_description, content='recipes', content_rowid='id')",
+    "CREATE TRIGGER recipes_fts_insert AFTER INSERT ON recipes BEGIN "
+    "INSERT INTO recipes_fts(rowid, recipe_title, recipe_description) "
+    "VALUES (new.id, new.recipe_title, new.recipe_description); END",
+    "CREATE TRIGGER recipes_fts_delete AFTER DELETE ON recipes BEGIN "
+    "INSERT INTO recipes_fts(recipes_fts, rowid, recipe_title, recipe_description) "
+    "VALUES ('delete', old.id, old.recipe_title, old.recipe_description); END",
+    "CREATE TRIGGER recipes_fts_update "
+    "AFTER UPDATE OF recipe_title, recipe_description ON recipes BEGIN "
+    "INSERT INTO recipes_fts(recipes_fts, rowid, recipe_title, recipe_description) "
+    "VALUES ('delete', old.id, old.recipe_title, old.recipe_description); "
+    "INSERT INTO recipes_fts(rowid, recipe_title, recipe_description) "
+    "VALUES (new.id, new.recipe_title, new.recipe_description); END",
+)
+
+SQLITE_DROP_DDL = (
+    "DROP TRIGGER IF EXISTS recipes_fts_insert",
+    "DROP TRIGGER IF EXISTS recipes_fts_delete",
+    "DROP TRIGGER IF EXISTS recipes_fts_update",
+    "DROP TABLE IF EXISTS recipes_fts",
+)
+
+for statement in POSTGRESQL_DDL:
+    event.listen(Recipe.__table__, 'after_create',
+                 DDL(statement).execute_if(dialect='postgresql'))
+for statement in SQLITE_DDL:
+    event.listen(Recipe.__table__, 'after_create',
+                 DDL(statement).execute_if(dialect='sqlite'))
+for statement in SQLITE_DROP_DDL:
+    event.listen(Recipe.__table__, 'before_drop',
+                 DDL(statement).execute_if(dialect='sqlite'))
+
+
+POSTGRESQL_SEARCH = text(
+    "SELECT recipes.id FROM recipes, plainto_tsquery('english', :terms) query "
+    "WHERE recipes.search_vector @@ query "
+    "ORDER BY ts_rank(recipes.search_vector, query) DESC, recipes.id "
+    "LIMIT :limit OFFSET :offset")
+
+# bm25() scores are lower for better matches; titles weigh more than text.
+SQLITE_SEARCH = text(
+    "SELECT rowid FROM recipes_fts WHERE recipes_fts MATCH :terms "
+    "ORDER BY bm25(recipes_fts, 10.0, 1.0), rowid "
+    "LIMIT :limit OFFSET :offset")
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class SearchResults(object):
+    """One page of ranked search results."""
+
+    def __init__(self, terms, items, page, has_next):
+        self.terms = terms
+        self.items = items
+        self.page = page
+        self.has_next = has_next
+
+    @property
+    def has_prev(self):
+        return self.page > 1
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def search_recipes(terms, page=1, per_page=25):
+    """Return the ``page``-th page of recipes matching ``terms``, best first.
+
+    Only the matching ids are ranked in the text index; the ``Recipe`` rows
+    are then loaded for the one page being shown.
+    """
+    words = WORD_RE.findall(terms or '')
+    page = max(page, 1)
+    if not words:
+        return SearchResults(terms, [], page, False)
+
+    if db.session.bind.dialect.name == 'postgresql':
+        statement, terms_param = POSTGRESQL_SEARCH, ' '.join(words)
+    else:
+        # Quote every word so user input is never parsed as FTS5 syntax.
+        statement = SQLITE_SEARCH
+        terms_param = ' '.join('"{}"'.format(word) for word in words)
+
+    ids = [row[0] for row in db.session.execute(
+        statement, {'terms': terms_param,
+                    'limit': per_page + 1,
+                    'offset': (page - 1) * per_page})]
+    has_next = len(ids) > per_page
+    ids = ids[:per_page]
+
+    recipes = {}
+    if ids:
+        recipes = {recipe.id: recipe
+                   for recipe in Recipe.query.filter(Recipe.id.in_(ids))}
+    items = [recipes[id_] for id_ in ids if id_ in recipes]
+    return SearchResults(terms, items, page, has_next)
@@ -0,0 +1,38 @@
+from flask import current_app
+from flask.signals import Namespace
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+
+from project import db
+from project.models import Recipe
+
+
+_signals = Namespace()
+
+# Sent once per committed transaction that inserted recipes, with
+# ``recipes`` set to a list of dicts of the new rows' column values.
+recipes_added = _signals.signal('recipes-added')
+
+
+def note_recipes_added(session, recipes):
+    """Record rows inserted without the ORM (bulk inserts) so that
+    ``recipes_added`` is sent for them when ``session`` commits."""
+    session.info.setdefault('recipes_added', []).extend(recipes)
+
+
+@event.listens_for(Recipe, 'after_insert')
+def _recipe_inserted(mapper, connection, target):
+    note_recipes_added(object_session(target), [
+        {attr.key: getattr(target, attr.key) for attr in mapper.column_attrs}])
+
+
+@event.listens_for(db.session, 'after_commit')
+def _send_recipes_added(session):
+    recipes = session.info.pop('recipes_added', None)
+    if recipes:
+        recipes_added.send(current_app._get_current_object(), recipes=recipes)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_recipes_added(session):
+    session.info.pop('recipes_added', None)
@@ -0,0 +1,85 @@
+import unittest
+
+from sqlalchemy import event
+from project import create_app, db
+
+
+class AppTestCase(unittest.TestCase):
+    """Base class for tests that need the app and a database.
+
+    Each test class gets its own app with an in-memory SQLite database,
+    and the schema is created once for the class.  Each test runs in a
+    transaction on a single connection that is rolled back in tearDown().
+    The session works inside a SAVEPOINT that is started again whenever the
+    code under test commits or rolls back, so those commits are visible for
+    the rest of the test but never reach the database.
+
+    Subclasses can set ``config`` to override settings, and
+    ``self.app`` is a test client.
+    """
+    config = {}
+
+    @classmethod
+    def setUpClass(cls):
+        config = {
+            'TESTING': True,
+            'WTF_CSRF_ENABLED': False,
+            'DEBUG': False,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+            # write login times in the request, inside the test's transaction
+            'LOGIN_FLUSH_INTERVAL': 0,
+        }
+        config.update(cls.config)
+        cls.application = create_app(config)
+        with cls.application.app_context():
+            # pysqlite's own transaction handling breaks SAVEPOINTs, so
+            # leave it to SQLAlchemy
+            event.listen(db.engine, 'connect', _disable_pysqlite_begin)
+            event.listen(db.engine, 'begin', _begin)
+            db.create_all()
+
+    # executed prior to each test
+    def setUp(self):
+        self.app_context = self.application.app_context()
+        self.app_context.push()
+        self.connection = db.engine.connect()
+        self.transaction = self.connection.begin()
+        db.session.configure(bind=self.connection, binds={})
+        event.listen(db.session, 'after_begin', _begin_savepoint)
+        event.listen(db.session, 'after_transaction_end', _restart_savepoint)
+        db.session.begin_nested()
+        db.session.connection()
+        self.app = self.application.test_client()
+
+    # executed after each test
+    def tearDown(self):
+        event.remove(db.session, 'after_transaction_end', _restart_savepoint)
+        event.remove(db.session, 'after_begin', _begin_savepoint)
+        db.session.remove()
+        self.transaction.rollback()
+        self.connection.close()
+        for option in ('bind', 'binds'):
+            db.session.session_factory.kw.pop(option)
+        self.app_context.pop()
+
+
+def _disable_pysqlite_begin(dbapi_connection, connection_record):
+    dbapi_connection.isolation_level = None
+
+
+def _begin(connection):
+    connection.execute('BEGIN')
+
+
+def _begin_savepoint(session, transaction, connection):
+    # a new session (after db.session.remove()) starts its own SAVEPOINT
+    if transaction.parent is None and session.transaction is transaction:
+        session.begin_nested()
+
+
+def _restart_savepoint(session, transaction):
+    if transaction.nested and not transaction.parent.nested:
+        session.expire_all()
+        session.begin_nested()
+        # emit the SAVEPOINT now rather than in the next request
+        session.connection()
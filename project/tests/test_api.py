@@ -0,0 +1,155 @@
+import gzip
+import json
+import unittest
+
+from project import db, recipe_cache
+from project.models import Recipe
+from project.tests.base import AppTestCase
+
+
+class ApiTests(AppTestCase):
+    """Checks the JSON API for listing, fetching and creating recipes."""
+    config = {'RECIPES_PER_PAGE': 2}
+
+    # executed prior to each test
+    def setUp(self):
+        super().setUp()
+        recipe_cache.clear()
+
+    # Helper functions
+    def add_recipes(self, count):
+        for number in range(1, count + 1):
+            db.session.add(Recipe('Recipe {}'.format(number),
+                                  'Description {}'.format(number)))
+        db.session.commit()
+
+    def get_json(self, path, **kwargs):
+        response = self.app.get(path, **kwargs)
+        return response, json.loads(response.data.decode('utf-8'))
+
+    def post_json(self, path, body, **kwargs):
+        response = self.app.post(path, data=json.dumps(body),
+                                 content_type='application/json', **kwargs)
+        return response, json.loads(response.data.decode('utf-8'))
+
+    def test_list_recipes_pages(self):
+        self.add_recipes(5)
+        response, body = self.get_json('/api/v1/recipes')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([recipe['recipe_title'] for recipe in body['recipes']],
+                         ['Recipe 1', 'Recipe 2'])
+        self.assertEqual(body['next_cursor'], 2)
+        self.assertIsNone(body['prev_cursor'])
+        # compact separators, no indentation
+        self.assertNotIn(b'\n', response.data.strip())
+        self.assertIn(b'"id":1,', response.data)
+
+        response, body = self.get_json('/api/v1/recipes?after=4&per_page=10')
+        self.assertEqual([recipe['id'] for recipe in body['recipes']], [5])
+        self.assertIsNone(body['next_cursor'])
+
+    def test_listings_return_summaries(self):
+        db.session.add(Recipe('Chili', 'Simmer the beans. ' * 50))
+        db.session.commit()
+        for path in ('/api/v1/recipes', '/api/v1/recipes?ids=1'):
+            response, body = self.get_json(path)
+            recipe, = body['recipes']
+            self.assertEqual(sorted(recipe), ['category_id', 'id', 'recipe_summary',
+                                              'recipe_title'])
+            self.assertLess(len(recipe['recipe_summary']), 300)
+        response, body = self.get_json('/api/v1/recipes/1')
+        self.assertEqual(body['recipe_description'], 'Simmer the beans. ' * 50)
+
+    def test_fetch_many_by_ids(self):
+        self.add_recipes(5)
+        response, body = self.get_json('/api/v1/recipes?ids=4,1,99')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([recipe['id'] for recipe in body['recipes']], [4, 1])
+        self.assertEqual(body['missing'], [99])
+
+        response, body = self.get_json('/api/v1/recipes?ids=1,x')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ids', body['error'])
+
+    def test_get_recipe(self):
+        self.add_recipes(1)
+        response, body = self.get_json('/api/v1/recipes/1')
+        self.assertEqual(body, {'id': 1, 'recipe_title': 'Recipe 1',
+                                'recipe_description': 'Description 1',
+                                'category_id': None})
+        response, body = self.get_json('/api/v1/recipes/2')
+        self.assertEqual(response.status_code, 404)
+        self.assertIn('No recipe', body['error'])
+
+    def test_create_recipes(self):
+        self.add_recipes(1)
+        etag = self.app.get('/').headers['ETag']
+        records = [{'recipe_title': 'Batch {}'.format(number),
+                    'recipe_description': 'Made in bulk.'} for number in range(300)]
+        response, body = self.post_json('/api/v1/recipes', {'recipes': records})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(body['ids'], list(range(2, 302)))
+        self.assertEqual(Recipe.query.count(), 301)
+        self.assertEqual(db.session.query(Recipe.recipe_title)
+                         .filter(Recipe.id == 301).scalar(), 'Batch 299')
+        # the new recipes are searchable and the cached listing is invalidated
+        self.assertIn(b'Batch 0', self.app.get('/search?q=batch').data)
+        response = self.app.get('/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_create_recipes_is_all_or_nothing(self):
+        response, body = self.post_json('/api/v1/recipes', {'recipes': [
+            {'recipe_title': 'Tacos', 'recipe_description': 'Ground beef.'},
+            {'recipe_title': '', 'recipe_description': 'Missing a title.'},
+            {'recipe_title': 7, 'recipe_description': 'Not a string.'}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(body['errors']), 2)
+        self.assertTrue(body['errors'][0].startswith('record 1:'))
+        self.assertTrue(body['errors'][1].startswith('record 2:'))
+        self.assertEqual(Recipe.query.count(), 0)
+
+    def test_create_recipes_rejects_bad_bodies(self):
+        response = self.app.post('/api/v1/recipes', data='{not json',
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        response, body = self.post_json('/api/v1/recipes', {'recipes': []})
+        self.assertEqual(response.status_code, 400)
+        self.application.config['API_MAX_BATCH_SIZE'] = 2
+        try:
+            response, body = self.post_json('/api/v1/recipes', {'recipes': [
+                {'recipe_title': 'A', 'recipe_description': 'B'}] * 3})
+        finally:
+            self.application.config['API_MAX_BATCH_SIZE'] = 500
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('At most 2', body['error'])
+
+    def test_gzip(self):
+        self.add_recipes(2)
+        response = self.app.get('/api/v1/recipes?per_page=100',
+                                headers={'Accept-Encoding': 'gzip'})
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+
+        db.session.add_all([Recipe('Recipe', 'A long description. ' * 10)
+                            for _ in range(10)])
+        db.session.commit()
+        response = self.app.get('/api/v1/recipes?per_page=100',
+                                headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        body = json.loads(gzip.decompress(response.data).decode('utf-8'))
+        self.assertEqual(len(body['recipes']), 12)
+        response = self.app.get('/api/v1/recipes?per_page=100')
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_create_recipes_from_gzip_body(self):
+        data = gzip.compress(json.dumps({'recipes': [
+            {'recipe_title': 'Tacos', 'recipe_description': 'Ground beef.'}]}).encode('utf-8'))
+        response = self.app.post('/api/v1/recipes', data=data,
+                                 content_type='application/json',
+                                 headers={'Content-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Recipe.query.one().recipe_title, 'Tacos')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from project import create_app
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class AppFactoryTests(unittest.TestCase):
+    """Checks create_app() and that importing the package stays cheap."""
+
+    def test_config_overrides(self):
+        app = create_app({'RECIPES_PER_PAGE': 7, 'TESTING': True})
+        other = create_app({'TESTING': True})
+        self.assertEqual(app.config['RECIPES_PER_PAGE'], 7)
+        self.assertTrue(app.testing)
+        self.assertEqual(other.config['RECIPES_PER_PAGE'], 25)
+        self.assertIn('recipes.index', [rule.endpoint for rule in other.url_map.iter_rules()])
+
+    def test_import_does_not_create_app(self):
+        # run in a fresh interpreter, as this process has already created apps
+        output = subprocess.check_output([sys.executable, '-c', '\n'.join([
+            'import sys, project',
+            'print(hasattr(project, "app"))',
+            'print(sorted(name for name in sys.modules',
+            '             if name.startswith(("project.users", "project.recipes",',
+            '                                 "project.commands", "flask_wtf"))))',
+        ])], cwd=PROJECT_DIR).decode('utf-8').split('\n')
+        self.assertEqual(output[0], 'False')
+        self.assertEqual(output[1], '[]')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import base64
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import Flask, render_template_string
+from project import assets
+from project.assets import Assets, AssetError
+
+CSS = b'body {\n  padding: 60px 0;\n  background: #ffffff;\n}\n' * 20
+
+
+class AssetBuildTests(unittest.TestCase):
+    """Builds and serves a temporary static folder."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.static = os.path.join(self.directory, 'static')
+        self.write('css/main.css', CSS)
+        self.write('img/logo.png', b'\x89PNG not really')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, filename, data):
+        path = os.path.join(self.static, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as output:
+            output.write(data)
+
+    def read(self, filename):
+        with open(os.path.join(self.static, filename), 'rb') as source:
+            return source.read()
+
+    def make_app(self, **config):
+        app = Flask(__name__, static_folder=self.static)
+        app.config.update(config)
+        Assets(app)
+        return app
+
+    def test_build_fingerprints_and_compresses(self):
+        manifest = assets.build(self.static)
+        css = manifest['css/main.css']
+        self.assertRegex(css['path'], r'^build/css/main\.[0-9a-f]{12}\.css$')
+        self.assertIn('gzip', css['encodings'])
+        self.assertEqual(self.read(css['path']), CSS)
+        self.assertEqual(gzip.decompress(self.read(css['path'] + '.gz')), CSS)
+        self.assertEqual(manifest['img/logo.png']['encodings'], [])
+        with open(os.path.join(self.static, 'build', 'manifest.json')) as source:
+            self.assertEqual(json.load(source), manifest)
+
+    def test_changed_file_gets_new_name(self):
+        first = assets.build(self.static)['css/main.css']['path']
+        self.write('css/main.css', CSS + b'.error { color: red; }\n')
+        second = assets.build(self.static)['css/main.css']['path']
+        self.assertNotEqual(first, second)
+        # the previous build is kept for pages that still link to it
+        self.assertTrue(os.path.exists(os.path.join(self.static, first)))
+        self.assertNotIn('build/', ' '.join(assets.build(self.static)))
+
+    def test_templates_link_built_files(self):
+        manifest = assets.build(self.static)
+        app = self.make_app()
+        with app.test_request_context():
+            html = render_template_string("{{ url_for('static', filename='css/main.css') }}")
+        self.assertEqual(html, '/static/' + manifest['css/main.css']['path'])
+
+    def test_built_file_served_compressed_and_immutable(self):
+        path = assets.build(self.static)['css/main.css']['path']
+        client = self.make_app().test_client()
+        response = client.get('/static/' + path, headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.mimetype, 'text/css')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        self.assertEqual(gzip.decompress(response.data), CSS)
+        response.close()
+
+        response = client.get('/static/' + path)
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertEqual(response.data, CSS)
+        response.close()
+
+    def test_unbuilt_files_served_as_usual(self):
+        client = self.make_app().test_client()
+        response = client.get('/static/css/main.css', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.data, CSS)
+        self.assertNotIn('immutable', response.headers.get('Cache-Control', ''))
+        response.close()
+
+    def test_vendored_file_linked_from_source_until_downloaded(self):
+        source = os.path.join(self.directory, 'bootstrap.css')
+        with open(source, 'wb') as output:
+            output.write(CSS)
+        url = 'file://' + source
+        integrity = 'sha384-' + base64.b64encode(hashlib.sha384(CSS).digest()).decode('ascii')
+        vendored = {'vendor/bootstrap.css': (url, integrity)}
+        app = self.make_app(ASSETS_VENDOR=vendored)
+        template = ("{{ url_for('static', filename='vendor/bootstrap.css') }}"
+                    "{{ cdn_attributes('vendor/bootstrap.css') }}")
+        with app.test_request_context():
+            self.assertEqual(render_template_string(template),
+                             '{} integrity="{}" crossorigin="anonymous"'.format(url, integrity))
+            self.assertEqual(assets.vendor(self.static, vendored), ['vendor/bootstrap.css'])
+            self.assertEqual(render_template_string(template), '/static/vendor/bootstrap.css')
+        self.assertEqual(self.read('vendor/bootstrap.css'), CSS)
+        self.assertEqual(assets.vendor(self.static, vendored), [])
+
+    def test_vendor_checks_integrity(self):
+        source = os.path.join(self.directory, 'bootstrap.css')
+        with open(source, 'wb') as output:
+            output.write(CSS)
+        good = 'sha384-' + base64.b64encode(hashlib.sha384(CSS).digest()).decode('ascii')
+        assets.vendor(self.static, {'vendor/good.css': ('file://' + source, good)})
+        with self.assertRaises(AssetError):
+            assets.vendor(self.static, {'vendor/bad.css': ('file://' + source, 'sha384-AAAA')})
+        self.assertFalse(os.path.exists(os.path.join(self.static, 'vendor', 'bad.css')))
+
+
+if __name__ == '__main__':
+    unittest.main()
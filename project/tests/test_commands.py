@@ -0,0 +1,257 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+from click.testing import CliRunner
+from flask.cli import ScriptInfo
+from project import db, duplicate_index, maintenance, passwords
+from project.commands import maintenance_cli, recipes_cli, users_cli
+from project.models import Category, Recipe, User
+from project.tests.base import AppTestCase
+
+
+class CommandTests(AppTestCase):
+    """Runs the import and export commands against the test database,
+    reading and writing files in a temporary directory."""
+    # executed prior to each test
+    def setUp(self):
+        super().setUp()
+        duplicate_index.clear()
+        self.directory = tempfile.mkdtemp()
+        self.runner = CliRunner()
+
+    # executed after each test
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.directory)
+
+    # Helper functions
+    def invoke(self, group, *args):
+        return self.runner.invoke(group, args,
+                                  obj=ScriptInfo(create_app=lambda info: self.application))
+
+    def write_file(self, name, lines):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as output:
+            output.write('\n'.join(lines) + '\n')
+        return path
+
+    def recipe_lines(self, count):
+        return [json.dumps({'recipe_title': 'Recipe {}'.format(number),
+                            'recipe_description': 'Description {}'.format(number)})
+                for number in range(1, count + 1)]
+
+    def test_import_recipes_jsonl(self):
+        path = self.write_file('recipes.jsonl', self.recipe_lines(5))
+        result = self.invoke(recipes_cli, 'import', path, '--batch-size', '2')
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Imported 5 records', result.output)
+        self.assertEqual(Recipe.query.count(), 5)
+        self.assertFalse(os.path.exists(path + '.checkpoint'))
+
+    def test_import_recipes_csv(self):
+        path = self.write_file('recipes.csv', [
+            'recipe_title,recipe_description',
+            'Hamburgers,"Classic dish, with pretzel buns."',
+            'Tacos,Ground beef in taco seasoning.'])
+        result = self.invoke(recipes_cli, 'import', path)
+        self.assertEqual(result.exit_code, 0, result.output)
+        recipe = Recipe.query.filter_by(recipe_title='Hamburgers').first()
+        self.assertEqual(recipe.recipe_description, 'Classic dish, with pretzel buns.')
+
+    def test_import_recipes_resumes_from_checkpoint(self):
+        lines = self.recipe_lines(5)
+        lines[3] = json.dumps({'recipe_title': '', 'recipe_description': 'Oops'})
+        path = self.write_file('recipes.jsonl', lines)
+        result = self.invoke(recipes_cli, 'import', path, '--batch-size', '2')
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('record 4', result.output)
+        self.assertEqual(Recipe.query.count(), 2)
+
+        self.write_file('recipes.jsonl', self.recipe_lines(5))
+        result = self.invoke(recipes_cli, 'import', path, '--batch-size', '2')
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Resuming after record 2', result.output)
+        titles = [recipe.recipe_title for recipe in Recipe.query.order_by(Recipe.id)]
+        self.assertEqual(titles, ['Recipe {}'.format(number) for number in range(1, 6)])
+
+    def test_import_recipes_rejects_malformed_lines(self):
+        for number, bad_line, message in [(3, '{"recipe_title": ', 'invalid JSON'),
+                                          (4, '[1]', 'expected a JSON object')]:
+            lines = self.recipe_lines(5)
+            lines[number - 1] = bad_line
+            path = self.write_file('recipes{}.jsonl'.format(number), lines)
+            result = self.invoke(recipes_cli, 'import', path, '--batch-size', '2')
+            self.assertEqual(result.exit_code, 1)
+            self.assertIsInstance(result.exception, SystemExit, result.exc_info)
+            self.assertIn('record {}: {}'.format(number, message), result.output)
+            self.assertIn('2 records imported', result.output)
+        self.assertEqual(Recipe.query.count(), 4)
+
+    def test_import_recipes_with_categories(self):
+        dinner = Category('Dinner')
+        db.session.add(dinner)
+        db.session.commit()
+        path = self.write_file('recipes.jsonl', [
+            json.dumps({'recipe_title': 'Tacos', 'recipe_description': 'Ground beef.',
+                        'category_id': 1}),
+            json.dumps({'recipe_title': 'Toast', 'recipe_description': 'Bread.'})])
+        result = self.invoke(recipes_cli, 'import', path)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(Recipe.query.filter_by(recipe_title='Tacos').one().category_id, 1)
+        self.assertEqual(db.session.query(Category.recipe_count).scalar(), 1)
+
+        path = self.write_file('more.jsonl', [json.dumps(
+            {'recipe_title': 'Soup', 'recipe_description': 'Hot.', 'category_id': 42})])
+        result = self.invoke(recipes_cli, 'import', path)
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn("unknown category_id 42", result.output)
+
+    def test_import_recipes_flags_duplicates(self):
+        db.session.add(Recipe('Hamburgers', 'Classic dish elevated with pretzel buns.'))
+        db.session.commit()
+        path = self.write_file('recipes.jsonl', [
+            json.dumps({'recipe_title': 'Hamburgers!',
+                        'recipe_description': 'Classic dish, elevated with pretzel buns.'}),
+            json.dumps({'recipe_title': 'Tacos', 'recipe_description': 'Ground beef.'}),
+            json.dumps({'recipe_title': 'tacos', 'recipe_description': 'ground beef'})])
+        result = self.invoke(recipes_cli, 'import', path, '--batch-size', '2')
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Record 1 looks like a duplicate of Hamburgers (#1)', result.output)
+        self.assertNotIn('Record 2 looks', result.output)
+        self.assertIn('Record 3 looks like a duplicate of Tacos', result.output)
+        self.assertEqual(Recipe.query.count(), 4)
+
+    def test_backfill_recipes(self):
+        db.session.add_all([Recipe('Tacos', 'Ground beef.'), Recipe('Chili', 'Slow cooked.')])
+        db.session.commit()
+        db.session.execute(Recipe.__table__.update().values(minhash=None, recipe_summary=None))
+        db.session.commit()
+        result = self.invoke(recipes_cli, 'backfill', '--batch-size', '1')
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Backfilled 2 records', result.output)
+        self.assertEqual(Recipe.query.filter(Recipe.minhash.is_(None)).count(), 0)
+        self.assertEqual(Recipe.query.get(2).recipe_summary, 'Slow cooked.')
+        self.assertEqual(duplicate_index.similar(Recipe('Tacos', 'Ground beef').fingerprint()),
+                         [(1, 'Tacos')])
+
+    def test_recount_recipes(self):
+        dinner = Category('Dinner')
+        db.session.add(dinner)
+        db.session.commit()
+        db.session.add_all([Recipe('Tacos', 'Ground beef.', dinner.id),
+                            Recipe('Chili', 'Slow cooked.', dinner.id)])
+        db.session.commit()
+        db.session.execute(Category.__table__.update().values(recipe_count=0))
+        db.session.commit()
+        result = self.invoke(recipes_cli, 'recount')
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Recounted recipes in 1 categories', result.output)
+        self.assertEqual(db.session.query(Category.recipe_count).scalar(), 2)
+
+    def test_export_recipes(self):
+        for number in range(1, 4):
+            db.session.add(Recipe('Recipe {}'.format(number), 'Description'))
+        db.session.commit()
+        path = os.path.join(self.directory, 'recipes.jsonl')
+        result = self.invoke(recipes_cli, 'export', path, '--batch-size', '2')
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Exported 3 records', result.output)
+        with open(path) as exported:
+            records = [json.loads(line) for line in exported]
+        self.assertEqual([record['recipe_title'] for record in records],
+                         ['Recipe 1', 'Recipe 2', 'Recipe 3'])
+
+    def test_import_and_export_users(self):
+        passwords.rounds = 4
+        try:
+            existing_hash = passwords.hash('PaSsWoRd').decode('utf-8')
+            path = self.write_file('users.jsonl', [
+                json.dumps({'email': 'patkennedy79@gmail.com', 'password': 'FlaskIsAwesome'}),
+                json.dumps({'email': 'blaa@blaa.com', 'password_hash': existing_hash,
+                            'email_confirmed': True})])
+            result = self.invoke(users_cli, 'import', path)
+        finally:
+            passwords.rounds = self.application.config['BCRYPT_LOG_ROUNDS']
+        self.assertEqual(result.exit_code, 0, result.output)
+        user = User.query.filter_by(email='patkennedy79@gmail.com').first()
+        self.assertTrue(user.is_correct_password('FlaskIsAwesome'))
+        user = User.query.filter_by(email='blaa@blaa.com').first()
+        self.assertTrue(user.is_correct_password('PaSsWoRd'))
+        self.assertTrue(user.email_confirmed)
+
+        path = os.path.join(self.directory, 'users.csv')
+        result = self.invoke(users_cli, 'export', path)
+        self.assertEqual(result.exit_code, 0, result.output)
+        with open(path) as exported:
+            self.assertIn(existing_hash, exported.read())
+
+    def test_normalize_emails(self):
+        self.add_users(('Pat@Example.com', {}), ('blaa@blaa.com', {}))
+        db.session.execute('DROP INDEX ix_users_email_normalized')
+        db.session.execute(User.__table__.update().values(email_normalized=None))
+        db.session.commit()
+        result = self.invoke(users_cli, 'normalize-emails', '--batch-size', '1')
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('Normalized 2 records', result.output)
+        self.assertIn('Created index ix_users_email_normalized', result.output)
+        self.assertEqual(User.with_email('pat@example.COM').one().email, 'Pat@Example.com')
+
+    def test_normalize_emails_reports_clashes(self):
+        db.session.execute('DROP INDEX ix_users_email_normalized')
+        self.add_users(('Pat@Example.com', {}), ('pat@example.com', {}))
+        result = self.invoke(users_cli, 'normalize-emails')
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn('differing only in case (pat@example.com)', result.output)
+
+    def add_users(self, *users):
+        old = datetime.now() - timedelta(days=60)
+        db.session.execute(User.__table__.insert(), [dict({
+            'email': email, 'email_normalized': email.lower(), '_password': b'x' * 60, 'authenticated': False,
+            'email_confirmed': False, 'registered_on': old, 'current_logged_in': old,
+        }, **values) for email, values in users])
+        db.session.commit()
+
+    def test_maintenance_purges_unconfirmed_users(self):
+        recent = datetime.now() - timedelta(days=1)
+        self.add_users(*(('stale{}@example.com'.format(number), {}) for number in range(5)))
+        self.add_users(('confirmed@example.com', {'email_confirmed': True}),
+                       ('new@example.com', {'registered_on': recent}),
+                       ('active@example.com', {'current_logged_in': recent}),
+                       ('cook@example.com', {}))
+        cook = User.query.filter_by(email='cook@example.com').one()
+        db.session.add(Recipe('Tacos', 'Tacos', user_id=cook.id))
+        db.session.commit()
+        result = self.invoke(maintenance_cli, 'run', 'unconfirmed-users',
+                             '--batch-size', '2', '--pause', '0')
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('unconfirmed-users: 5 rows in 3 batches', result.output)
+        self.assertEqual(sorted(user.email for user in User.query),
+                         ['active@example.com', 'confirmed@example.com',
+                          'cook@example.com', 'new@example.com'])
+
+    def test_maintenance_clears_session_flags(self):
+        self.add_users(('on@example.com', {'authenticated': True, 'email_confirmed': True}),
+                       ('off@example.com', {'email_confirmed': True}))
+        result = self.invoke(maintenance_cli, 'run')
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertIn('session-flags: 1 rows in 1 batches', result.output)
+        self.assertIn('unconfirmed-users: 0 rows in 0 batches', result.output)
+        self.assertEqual(User.query.filter_by(authenticated=True).count(), 0)
+
+    def test_run_in_batches_pauses_between_batches(self):
+        self.add_users(*(('user{}@example.com'.format(number), {'authenticated': True})
+                         for number in range(7)))
+        pauses = []
+        statement, condition = maintenance.JOBS['session-flags']()
+        rows, batches = maintenance.run_in_batches(statement, condition, 3, 0.25,
+                                                   sleep=pauses.append)
+        self.assertEqual((rows, batches), (7, 3))
+        self.assertEqual(pauses, [0.25, 0.25])
+
+
+if __name__ == '__main__':
+    unittest.main()
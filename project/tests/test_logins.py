@@ -0,0 +1,102 @@
+import unittest
+from datetime import datetime
+
+from sqlalchemy import event
+from project import db, user_cache
+from project.logins import LoginRecorder, latest_two, merge_logins
+from project.models import User
+from project.tests.base import AppTestCase
+
+
+def at(minute):
+    return datetime(2018, 1, 1, 12, minute)
+
+
+class MergeLoginsTests(unittest.TestCase):
+
+    def test_latest_two(self):
+        self.assertEqual(latest_two(at(1), None, at(3), at(2)), (at(3), at(2)))
+        self.assertEqual(latest_two(at(1)), (at(1), None))
+        self.assertEqual(latest_two(None), (None, None))
+
+    def test_newer_logins_replace_both(self):
+        self.assertEqual(merge_logins(at(1), at(0), at(2), at(3)), (at(3), at(2)))
+
+    def test_single_newer_login_moves_current_to_last(self):
+        self.assertEqual(merge_logins(at(1), at(0), None, at(3)), (at(3), at(1)))
+
+    def test_older_login_written_after_a_newer_one(self):
+        self.assertEqual(merge_logins(at(3), at(1), None, at(2)), (at(3), at(2)))
+        self.assertEqual(merge_logins(at(3), at(2), None, at(1)), (at(3), at(2)))
+
+    def test_first_login(self):
+        self.assertEqual(merge_logins(None, None, None, at(1)), (at(1), None))
+
+
+class LoginRecorderTests(AppTestCase):
+    """Buffers logins in a recorder flushed by hand rather than by its
+    thread."""
+
+    def setUp(self):
+        super().setUp()
+        user_cache.clear()
+        user = User('patkennedy79@gmail.com', 'FlaskIsAwesome')
+        user.current_logged_in = at(0)
+        db.session.add(user)
+        db.session.commit()
+        self.user_id = user.id
+        self.recorder = LoginRecorder(self.application)
+        self.recorder.interval = 3600
+        self.recorder._start = lambda: None
+
+    def stored(self):
+        return db.session.query(User.current_logged_in, User.last_logged_in) \
+            .filter_by(id=self.user_id).one()
+
+    def test_logins_are_written_on_flush(self):
+        self.recorder.record(self.user_id, at(1))
+        self.recorder.record(self.user_id, at(2))
+        self.assertEqual(self.stored(), (at(0), None))
+        self.recorder.flush()
+        self.assertEqual(self.stored(), (at(2), at(1)))
+
+    def test_update_keeps_newer_login_written_meanwhile(self):
+        self.recorder.record(self.user_id, at(1))
+        db.session.query(User).filter_by(id=self.user_id) \
+            .update({'current_logged_in': at(5), 'last_logged_in': at(0)})
+        db.session.commit()
+        self.recorder.flush()
+        self.assertEqual(self.stored(), (at(5), at(1)))
+
+    def test_buffered_logins_are_shown(self):
+        self.recorder.record(self.user_id, at(1))
+        user = self.recorder.apply(db.session.query(User).get(self.user_id))
+        self.assertEqual((user.current_logged_in, user.last_logged_in), (at(1), at(0)))
+        self.assertNotIn(user, db.session.dirty)
+
+    def test_flush_drops_cached_user(self):
+        user_cache.set(self.user_id, 'cached')
+        self.recorder.record(self.user_id, at(1))
+        self.recorder.flush()
+        self.assertIsNone(user_cache.get(self.user_id))
+
+    def test_one_update_for_many_users(self):
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        other = User('other@example.com', 'FlaskIsAwesome')
+        db.session.add(other)
+        db.session.commit()
+        self.recorder.record(self.user_id, at(1))
+        self.recorder.record(other.id, at(2))
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            self.recorder.flush()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        self.assertEqual(len([s for s in statements if s.startswith('UPDATE users')]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+import asyncore
+import smtpd
+import threading
+import unittest
+
+from flask import Flask
+from flask_mail import Mail, Message
+from project.mailer import MailDispatcher
+
+
+class LocalSMTPServer(smtpd.SMTPServer):
+    """SMTP server on a free local port that records what it receives.
+    The first ``failures`` messages are refused with a temporary error."""
+
+    def __init__(self, failures=0):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None,
+                                  decode_data=True)
+        self.port = self.socket.getsockname()[1]
+        self.failures = failures
+        self.connections = 0
+        self.messages = []
+        self._running = True
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.start()
+
+    def _serve(self):
+        while self._running:
+            asyncore.loop(timeout=0.05, count=1)
+
+    def stop(self):
+        self._running = False
+        self._thread.join()
+        asyncore.close_all()
+
+    def handle_accepted(self, conn, addr):
+        self.connections += 1
+        smtpd.SMTPServer.handle_accepted(self, conn, addr)
+
+    def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            return '451 Try again later'
+        self.messages.append((rcpttos, data))
+
+
+class MailDispatcherTests(unittest.TestCase):
+    """Each test starts a dispatcher that delivers to its own local SMTP
+    server, which tearDown() stops."""
+    # Helper function
+    def start(self, failures=0, **config):
+        self.server = LocalSMTPServer(failures)
+        app = Flask(__name__)
+        app.config.update(MAIL_SERVER='127.0.0.1',
+                          MAIL_PORT=self.server.port,
+                          MAIL_DEFAULT_SENDER='family.recipes.mh@gmail.com',
+                          MAIL_WORKERS=1,
+                          MAIL_RETRY_BACKOFF=0.01)
+        app.config.update(config)
+        self.app = app
+        self.dispatcher = MailDispatcher(app, Mail(app))
+
+    def tearDown(self):
+        self.server.stop()
+
+    def send(self, count):
+        with self.app.app_context():
+            for number in range(count):
+                msg = Message('Message {}'.format(number),
+                              recipients=['user{}@example.com'.format(number)])
+                msg.html = '<p>Hello</p>'
+                self.assertTrue(self.dispatcher.send(msg))
+
+    def test_messages_share_a_connection(self):
+        self.start()
+        self.send(5)
+        self.dispatcher.shutdown()
+        self.assertEqual(len(self.server.messages), 5)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_connection_reopened_after_batch(self):
+        self.start(MAIL_BATCH_SIZE=2)
+        self.send(5)
+        self.dispatcher.shutdown()
+        self.assertEqual(len(self.server.messages), 5)
+        self.assertEqual(self.server.connections, 3)
+
+    def test_failed_message_retried(self):
+        self.start(failures=1)
+        self.send(1)
+        self.dispatcher.shutdown()
+        self.assertEqual(self.server.messages[0][0], ['user0@example.com'])
+        self.assertEqual(self.server.connections, 2)
+
+    def test_message_dropped_after_retries(self):
+        self.start(failures=3, MAIL_MAX_RETRIES=2)
+        with self.assertLogs('project.mailer', 'ERROR'):
+            self.send(2)
+            self.dispatcher.shutdown()
+        self.assertEqual(len(self.server.messages), 1)
+        self.assertEqual(self.server.messages[0][0], ['user1@example.com'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+
+from flask import Flask
+from project import db, metrics
+from project.metrics import Histogram, RequestMetrics
+from project.models import Recipe
+from project.tests.base import AppTestCase
+
+
+class MetricsTests(AppTestCase):
+    """Checks the request metrics collected by the app and the Prometheus
+    text served at /metrics."""
+    # executed prior to each test
+    def setUp(self):
+        super().setUp()
+        metrics.histograms.clear()
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram((1, 5))
+        for value in (0, 1, 3, 7):
+            histogram.observe(value)
+        self.assertEqual(list(histogram.samples('x', 'a="b"')), [
+            'x_bucket{a="b",le="1"} 2',
+            'x_bucket{a="b",le="5"} 3',
+            'x_bucket{a="b",le="+Inf"} 4',
+            'x_sum{a="b"} 11.0',
+            'x_count{a="b"} 4'])
+
+    def test_metrics_per_endpoint(self):
+        db.session.add(Recipe('Hamburgers', 'Classic dish with pretzel buns.'))
+        db.session.commit()
+        self.app.get('/search?q=pretzel')
+        self.app.get('/search?q=buns')
+        self.app.get('/add')
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'http_request_duration_seconds_count{endpoint="recipes.search"} 2',
+                      response.data)
+        self.assertIn(b'http_request_duration_seconds_count{endpoint="recipes.add_recipe"} 1',
+                      response.data)
+        # the ranked id lookup plus loading the page of recipes
+        self.assertIn(b'http_request_sql_statements_sum{endpoint="recipes.search"} 4',
+                      response.data)
+        # the categories offered by the form
+        self.assertIn(b'http_request_sql_statements_sum{endpoint="recipes.add_recipe"} 1',
+                      response.data)
+        self.assertIn(b'cache_hits_total{cache="users"}', response.data)
+
+    def test_metrics_only_for_trusted_requests(self):
+        remote = {'REMOTE_ADDR': '203.0.113.7'}
+        self.assertEqual(self.app.get('/metrics', environ_base=remote).status_code, 403)
+        self.application.config['METRICS_TOKEN'] = 'letmein'
+        try:
+            for authorization, status in [('Bearer wrong', 403), ('Basic letmein', 403),
+                                          ('Bearer l\xe9tmein', 403), ('Bearer letmein', 200)]:
+                response = self.app.get('/metrics', environ_base=remote,
+                                        headers={'Authorization': authorization})
+                self.assertEqual(response.status_code, status, authorization)
+        finally:
+            self.application.config['METRICS_TOKEN'] = None
+
+    def test_metrics_disabled(self):
+        other = Flask(__name__)
+        other.config['METRICS_ENABLED'] = False
+        disabled = RequestMetrics(other)
+        self.assertFalse(disabled.enabled)
+        self.assertEqual(other.test_client().get('/metrics').status_code, 404)
+        self.assertEqual(other.before_request_funcs, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+from project.minhash import LSHIndex, NUM_HASHES, shingles, signature, similarity
+
+
+class MinHashTests(unittest.TestCase):
+    """Checks the signatures and the LSH index used to find duplicates."""
+
+    def test_shingles(self):
+        self.assertEqual(shingles('Ground beef, in taco sauce!'),
+                         {'ground beef in', 'beef in taco', 'in taco sauce'})
+        self.assertEqual(shingles('Tacos'), {'tacos'})
+        self.assertEqual(shingles('...'), set())
+
+    def test_signature_is_stable(self):
+        value = signature('Hamburgers', 'Classic dish with pretzel buns.')
+        self.assertEqual(len(value), NUM_HASHES * 4)
+        self.assertEqual(value, signature('HAMBURGERS', 'classic dish with pretzel buns'))
+        self.assertEqual(similarity(value, value), 1.0)
+
+    def test_similarity_estimates_jaccard(self):
+        words = ['word{}'.format(number) for number in range(40)]
+        first = signature(' '.join(words))
+        second = signature(' '.join(words[:36] + ['other'] * 4))
+        third = signature(' '.join('else{}'.format(number) for number in range(40)))
+        self.assertGreater(similarity(first, second), 0.6)
+        self.assertLess(similarity(first, third), 0.1)
+
+    def test_index_finds_similar_signatures(self):
+        index = LSHIndex()
+        index.add(signature('Tacos', 'Ground beef simmering in taco seasoning and sauce.'), 1)
+        index.add(signature('Hamburgers', 'Classic dish with pretzel buns.'), 2)
+        matches = index.similar(
+            signature('Tacos', 'Ground beef simmering in taco seasoning and salsa.'), 0.5)
+        self.assertEqual([item for score, item in matches], [1])
+        self.assertEqual(index.similar(signature('Soup', 'Hot.'), 0.5), [])
+        self.assertEqual(len(index), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import io
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from PIL import Image
+from project import photos, recipe_cache
+from project.models import Recipe
+from project.tests.base import AppTestCase
+
+
+def image_bytes(format='PNG', size=(800, 600), color='red'):
+    output = io.BytesIO()
+    Image.new('RGB', size, color).save(output, format)
+    return output.getvalue()
+
+
+class PhotoTests(AppTestCase):
+    """Uploads photos to a temporary directory, making thumbnails inline."""
+    config = {'PHOTOS_DIRECTORY': tempfile.mkdtemp(), 'PHOTOS_WORKERS': 0}
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.config['PHOTOS_DIRECTORY'])
+
+    def setUp(self):
+        super().setUp()
+        recipe_cache.clear()
+
+    def add(self, title, photo, filename='photo.png'):
+        return self.app.post('/add', data=dict(
+            recipe_title=title, recipe_description='Tasty {}'.format(title),
+            photo=(io.BytesIO(photo), filename)), follow_redirects=True)
+
+    def test_upload_stores_photo_and_thumbnail(self):
+        data = image_bytes()
+        response = self.add('Tacos', data)
+        self.assertIn(b'New recipe, Tacos, added!', response.data)
+        name = Recipe.query.filter_by(recipe_title='Tacos').one().photo
+        self.assertRegex(name, r'^[0-9a-f]{64}\.png$')
+        with open(photos.path(name), 'rb') as stored:
+            self.assertEqual(stored.read(), data)
+        with Image.open(photos.thumbnail_path(name)) as thumbnail:
+            self.assertEqual(thumbnail.size, (320, 240))
+        self.assertIn('/photos/{}/thumbnail'.format(name).encode('utf-8'), response.data)
+
+    def test_same_photo_stored_once(self):
+        data = image_bytes(color='blue')
+        self.add('Tacos', data)
+        self.add('Burritos', data)
+        first, second = [recipe.photo for recipe in Recipe.query.order_by(Recipe.id)]
+        self.assertEqual(first, second)
+        directory = os.path.dirname(photos.path(first))
+        self.assertEqual([name for name in os.listdir(directory) if name.startswith(first[:8])],
+                         [first])
+
+    def test_upload_rejects_other_files(self):
+        response = self.add('Tacos', b'#!/bin/sh\necho hello\n', 'photo.png')
+        self.assertIn(b'Photos must be JPEG, PNG or GIF images.', response.data)
+        self.assertIn(b'ERROR! Recipe was not added.', response.data)
+        self.assertEqual(Recipe.query.count(), 0)
+        self.assertFalse([name for name in os.listdir(photos.directory)
+                          if name.endswith('.tmp')])
+
+    def test_upload_rejects_large_photos(self):
+        max_size = photos.max_size
+        photos.max_size = 1024
+        try:
+            response = self.add('Tacos', image_bytes(), 'photo.png')
+        finally:
+            photos.max_size = max_size
+        self.assertIn(b'Photos must be at most', response.data)
+        self.assertIn(b'ERROR! Recipe was not added.', response.data)
+        self.assertEqual(Recipe.query.count(), 0)
+
+    def test_photo_conditional_and_range_requests(self):
+        data = image_bytes('JPEG', color='green')
+        self.add('Tacos', data, 'photo.jpg')
+        url = '/photos/{}'.format(Recipe.query.one().photo)
+        response = self.app.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'image/jpeg')
+        self.assertEqual(response.data, data)
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertEqual(response.headers['X-Content-Type-Options'], 'nosniff')
+        self.assertEqual(response.headers['Accept-Ranges'], 'bytes')
+        etag = response.headers['ETag']
+
+        response = self.app.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        response = self.app.get(url, headers={'Range': 'bytes=0-99'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.data, data[:100])
+        self.assertEqual(response.headers['Content-Range'], 'bytes 0-99/{}'.format(len(data)))
+
+    def test_unknown_photo(self):
+        self.assertEqual(self.app.get('/photos/{}.png'.format('0' * 64)).status_code, 404)
+        self.assertEqual(self.app.get('/photos/..%2Fflask.cfg').status_code, 404)
+
+    def test_thumbnails_made_in_worker_processes(self):
+        photos.workers = 1
+        try:
+            self.add('Tacos', image_bytes(color='yellow'))
+            name = Recipe.query.one().photo
+            deadline = time.time() + 30
+            while not os.path.exists(photos.thumbnail_path(name)) and time.time() < deadline:
+                time.sleep(0.05)
+        finally:
+            photos.workers = 0
+        response = self.app.get('/photos/{}/thumbnail'.format(name))
+        self.assertEqual(response.mimetype, 'image/jpeg')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+
+    def test_upload_kept_when_thumbnail_cannot_be_queued(self):
+        def submit(func, *args):
+            raise OSError('Cannot start the pool')
+        photos.workers = 1
+        photos._pool.submit = submit
+        try:
+            response = self.add('Tacos', image_bytes(color='purple'))
+        finally:
+            del photos._pool.submit
+            photos.workers = 0
+        self.assertIn(b'New recipe, Tacos, added!', response.data)
+        name = Recipe.query.one().photo
+        self.assertFalse(os.path.exists(photos.thumbnail_path(name)))
+        response = self.app.get('/photos/{}/thumbnail'.format(name))
+        self.assertEqual(response.mimetype, 'image/png')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from sqlalchemy import create_engine
+from project import create_app, db
+from project.pool import PoolStats, TimedQueuePool
+
+
+class PoolStatsTests(unittest.TestCase):
+    """Checks the connections counted from the events of a pool of
+    connections to a SQLite file."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.engine = create_engine(
+            'sqlite:///' + os.path.join(self.directory, 'pool.db'),
+            poolclass=TimedQueuePool, pool_size=1, max_overflow=0, pool_timeout=5,
+            connect_args={'check_same_thread': False})
+        self.stats = PoolStats(self.engine, pre_ping=True)
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.directory)
+
+    def test_checkouts_and_checkins(self):
+        connection = self.engine.connect()
+        self.assertEqual(connection.scalar('SELECT 1'), 1)
+        snapshot = self.stats.snapshot()
+        self.assertEqual((snapshot['open'], snapshot['checked_out'], snapshot['idle']), (1, 1, 0))
+        connection.close()
+        self.engine.connect().close()
+        snapshot = self.stats.snapshot()
+        self.assertEqual((snapshot['open'], snapshot['checked_out'], snapshot['idle']), (1, 0, 1))
+        self.assertEqual((snapshot['opened'], snapshot['waits']), (1, 2))
+
+    def test_checkout_waits_for_a_connection(self):
+        connection = self.engine.connect()
+        timer = threading.Timer(0.2, connection.close)
+        timer.start()
+        self.engine.connect().close()
+        timer.join()
+        self.assertGreaterEqual(self.stats.wait_time, 0.15)
+        self.assertEqual(self.stats.checked_out, 0)
+
+    def test_pre_ping_replaces_broken_connection(self):
+        connection = self.engine.connect()
+        dbapi_connection = connection.connection.connection
+        connection.close()
+        dbapi_connection.close()
+        self.assertEqual(self.engine.scalar('SELECT 1'), 1)
+        snapshot = self.stats.snapshot()
+        self.assertEqual((snapshot['opened'], snapshot['closed'], snapshot['invalidated']),
+                         (2, 1, 1))
+        self.assertEqual((snapshot['open'], snapshot['checked_out']), (1, 0))
+
+    def test_stats_survive_dispose(self):
+        self.engine.dispose()
+        self.engine.connect().close()
+        self.assertIs(self.engine.pool.stats, self.stats)
+        self.assertEqual(self.stats.waits, 1)
+
+
+class HealthTests(unittest.TestCase):
+    """Checks /healthz and the pool metrics of an app using a SQLite file."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config = {
+            'TESTING': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(self.directory, 'app.db'),
+        }
+
+    def tearDown(self):
+        for engine in self.application.extensions['sqlalchemy'].connectors.values():
+            engine.get_engine().dispose()
+        shutil.rmtree(self.directory)
+
+    def test_healthz(self):
+        self.application = create_app(self.config)
+        response = self.application.test_client().get('/healthz')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(data['status'], 'ok')
+        self.assertTrue(data['databases']['primary']['ok'])
+        self.assertEqual(data['databases']['primary']['checked_out'], 0)
+        response = self.application.test_client().get('/metrics')
+        self.assertIn(b'db_pool_connections_opened_total{bind="primary"} 1', response.data)
+        self.assertIn(b'db_pool_connections_checked_out{bind="primary"} 0', response.data)
+
+    def test_healthz_details_only_for_trusted_requests(self):
+        self.application = create_app(self.config)
+        response = self.application.test_client().get(
+            '/healthz', environ_base={'REMOTE_ADDR': '203.0.113.7'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data.decode('utf-8')), {'status': 'ok'})
+
+    def test_healthz_unavailable(self):
+        self.config['SQLALCHEMY_BINDS'] = {
+            'missing': 'sqlite:///' + os.path.join(self.directory, 'missing', 'app.db')}
+        self.application = create_app(self.config)
+        response = self.application.test_client().get('/healthz')
+        self.assertEqual(response.status_code, 503)
+        data = json.loads(response.data.decode('utf-8'))
+        self.assertEqual(data['status'], 'unavailable')
+        self.assertTrue(data['databases']['primary']['ok'])
+        self.assertFalse(data['databases']['missing']['ok'])
+
+    def test_pool_settings(self):
+        self.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://user@localhost/recipes'
+        self.application = create_app(self.config)
+        with self.application.app_context():
+            pool = db.engine.pool
+        self.assertIsInstance(pool, TimedQueuePool)
+        self.assertEqual((pool.size(), pool._max_overflow, pool._recycle), (10, 10, 1800))
+
+
+if __name__ == '__main__':
+    unittest.main()
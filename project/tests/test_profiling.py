@@ -0,0 +1,87 @@
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from flask import Flask
+from project.profiling import RequestProfiler
+
+
+def slow_view():
+    time.sleep(0.05)
+    return 'done'
+
+
+class ProfilerTests(unittest.TestCase):
+    """Profiles requests to a small app writing to a temporary instance
+    folder."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.app = Flask(__name__, instance_path=self.directory)
+        self.app.config.update(PROFILER_ENABLED=True, PROFILER_SAMPLE_RATE=0.0,
+                               PROFILER_SECRET='letmein', PROFILER_DUMP_INTERVAL=3600,
+                               PROFILER_STACK_INTERVAL=0.001)
+        self.app.add_url_rule('/slow', 'slow', slow_view)
+        self.profiler = RequestProfiler(self.app)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_unsampled_requests_are_not_profiled(self):
+        self.client.get('/slow')
+        self.client.get('/slow', headers={'X-Profile': 'wrong'})
+        self.assertEqual(self.client.get('/slow', headers={'X-Profile': 'l\xe9tmein'}).data,
+                         b'done')
+        self.assertEqual(self.profiler.profiles, {})
+
+    def test_trusted_header_profiles_request(self):
+        self.assertEqual(self.client.get('/slow', headers={'X-Profile': 'letmein'}).data,
+                         b'done')
+        self.assertEqual(self.profiler.sampled['slow'], 1)
+        self.profiler.dump()
+        path = os.path.join(self.directory, 'profiles', 'slow.{}'.format(os.getpid()))
+        functions = [function for _, _, function in pstats.Stats(path + '.pstats').stats]
+        self.assertIn('slow_view', functions)
+        with open(path + '.collapsed') as collapsed:
+            lines = collapsed.read().splitlines()
+        self.assertTrue(any('slow_view' in line.rsplit(' ', 1)[0] for line in lines))
+        self.assertEqual(self.profiler.sampler.watched, {})
+
+    def test_requests_not_held_up_while_files_written(self):
+        headers = {'X-Profile': 'letmein'}
+        self.client.get('/slow', headers=headers)
+        # hold the dump up as if writing were slow
+        self.profiler._dump_lock.acquire()
+        dump = threading.Thread(target=self.profiler.dump)
+        dump.start()
+        try:
+            self.client.get('/slow', headers=headers)
+            self.assertEqual(self.profiler.sampled['slow'], 2)
+        finally:
+            self.profiler._dump_lock.release()
+            dump.join()
+        path = os.path.join(self.directory, 'profiles', 'slow.{}'.format(os.getpid()))
+        self.assertTrue(os.path.exists(path + '.pstats'))
+
+    def test_sample_rate(self):
+        self.profiler.sample_rate = 1.0
+        self.client.get('/slow')
+        self.client.get('/slow')
+        self.assertEqual(self.profiler.sampled['slow'], 2)
+
+    def test_profiler_disabled(self):
+        other = Flask(__name__)
+        other.config['PROFILER_ENABLED'] = False
+        disabled = RequestProfiler(other)
+        self.assertFalse(disabled.enabled)
+        self.assertEqual(other.before_request_funcs, {})
+        self.assertEqual(other.teardown_request_funcs, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import time
+import unittest
+from itsdangerous import URLSafeTimedSerializer
+from sqlalchemy import event
+
+from project import db, limiter
+from project.ratelimit import MemoryBucketStore
+from project.tests.base import AppTestCase
+
+
+class MemoryBucketStoreTests(unittest.TestCase):
+    """Checks the in-process token buckets."""
+
+    def test_burst_then_refill(self):
+        store = MemoryBucketStore(shards=4)
+        self.assertEqual([store.consume('a', 2, 0.1)[0] for _ in range(3)],
+                         [True, True, False])
+        allowed, retry_after = store.consume('a', 2, 0.1)
+        self.assertFalse(allowed)
+        self.assertGreater(retry_after, 0)
+        self.assertLessEqual(retry_after, 0.05)
+        self.assertTrue(store.consume('b', 2, 0.1)[0])
+        time.sleep(0.06)
+        self.assertTrue(store.consume('a', 2, 0.1)[0])
+
+    def test_keeps_at_most_max_keys(self):
+        store = MemoryBucketStore(shards=2, max_keys=10)
+        for number in range(100):
+            store.consume('key {}'.format(number), 1, 60)
+        self.assertLessEqual(store.stats()['keys'], 10)
+        store.clear()
+        self.assertEqual(store.stats()['keys'], 0)
+
+
+class RateLimitTests(AppTestCase):
+    """Checks that logins and password resets are limited per IP and per
+    email before the database is queried."""
+    config = {'RATELIMIT_PER_IP': (4, 60), 'RATELIMIT_PER_EMAIL': (2, 60),
+              'METRICS_ENABLED': True}
+
+    # executed prior to each test
+    def setUp(self):
+        super().setUp()
+        limiter.reset()
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.count)
+
+    # executed after each test
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.count)
+        super().tearDown()
+
+    # Helper functions
+    def count(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('SELECT'):
+            self.statements.append(statement)
+
+    def login(self, email, address='10.0.0.1'):
+        return self.app.post('/login', data=dict(email=email, password='FlaskIsAwesome'),
+                             environ_base={'REMOTE_ADDR': address})
+
+    def test_login_limited_per_email(self):
+        self.assertEqual(self.login('patkennedy79@gmail.com').status_code, 200)
+        self.assertEqual(self.login('PatKennedy79@gmail.com', '10.0.0.2').status_code, 200)
+        del self.statements[:]
+        response = self.login('patkennedy79@gmail.com', '10.0.0.3')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response.headers)
+        self.assertEqual(self.statements, [])
+        self.assertEqual(self.login('blaa@blaa.com', '10.0.0.3').status_code, 200)
+
+    def test_login_limited_per_ip(self):
+        for number in range(4):
+            response = self.login('user{}@example.com'.format(number))
+            self.assertEqual(response.status_code, 200)
+        del self.statements[:]
+        self.assertEqual(self.login('other@example.com').status_code, 429)
+        self.assertEqual(self.statements, [])
+        self.assertEqual(self.login('other@example.com', '10.0.0.2').status_code, 200)
+        # showing the form is not an attempt
+        self.assertEqual(self.app.get('/login', environ_base={'REMOTE_ADDR': '10.0.0.1'})
+                         .status_code, 200)
+
+    def test_password_resets_limited(self):
+        for _ in range(2):
+            response = self.app.post('/reset', data=dict(email='blaa@blaa.com'))
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.app.post('/reset', data=dict(email='blaa@blaa.com'))
+                         .status_code, 429)
+
+        serializer = URLSafeTimedSerializer(self.application.config['SECRET_KEY'])
+        path = '/reset/' + serializer.dumps('blaa@blaa.com', salt='password-reset-salt')
+        for _ in range(2):
+            self.assertEqual(self.app.post(path, data=dict(password='x')).status_code, 302)
+        del self.statements[:]
+        self.assertEqual(self.app.post(path, data=dict(password='x')).status_code, 429)
+        self.assertEqual(self.statements, [])
+
+    def test_metrics(self):
+        for _ in range(3):
+            self.login('patkennedy79@gmail.com')
+        response = self.app.get('/metrics')
+        self.assertIn(b'rate_limit_attempts_total{action="login",result="allowed"} 2',
+                      response.data)
+        self.assertIn(b'rate_limit_attempts_total{action="login",result="rejected_email"} 1',
+                      response.data)
+        self.assertIn(b'rate_limit_buckets{} 2', response.data)
+
+    def test_disabled(self):
+        limiter.enabled = False
+        try:
+            for _ in range(3):
+                self.assertEqual(self.login('patkennedy79@gmail.com').status_code, 200)
+        finally:
+            limiter.enabled = True
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,32 +1,29 @@
-import os
+import json
 import unittest
-from project import app, db
+from datetime import datetime
 
-TEST_DB = 'test.db'
+from sqlalchemy import event
+from project import db, duplicate_index, recipe_cache, title_index
+from project.bulk import insert_rows
+from project.models import Category, Recipe, User, summarize
+from project.tests.base import AppTestCase
 
 
-class ProjectTests(unittest.TestCase):
+class ProjectTests(AppTestCase):
     """This class will include functions to setUp() and tearDown() each unit test.
     The setUp() function should specify the key configuration items
     needed for the unit test case.
     The tearDown() function will not
     do anything to start off"""
+    config = {'RECIPES_PER_PAGE': 2}
+
     # executed prior to each test
     def setUp(self):
-        app.config['TESTING'] = True
-        app.config['WTF_CSRF_ENABLED'] = False
-        app.config['DEBUG'] = False
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
-            os.path.join(app.config['BASEDIR'], TEST_DB)
-        self.app = app.test_client()
-        db.create_all()
-
-        self.assertEquals(app.debug, False)
-
-    # executed after each test
-    def tearDown(self):
-        db.session.remove()
-        db.drop_all()
+        super().setUp()
+        recipe_cache.clear()
+        title_index.clear()
+        duplicate_index.clear()
+        self.assertEquals(self.application.debug, False)
 
     def test_main_page(self):
         response = self.app.get('/', follow_redirects=True)
@@ -46,6 +43,29 @@ class ProjectTests(unittest.TestCase):
             follow_redirects=True)
         self.assertIn(b'New recipe, Hamburgers, added!', response.data)
 
+    def test_add_duplicate_recipe(self):
+        db.session.add(Recipe('Slow-Cooker Tacos', 'Delicious ground beef that has been '
+                              'simmering in taco seasoning and sauce. Perfect with '
+                              'hard-shelled tortillas!'))
+        db.session.commit()
+        response = self.app.post(
+            '/add',
+            data=dict(recipe_title='Slow Cooker Tacos',
+                      recipe_description='Delicious ground beef that has been simmering '
+                                         'in taco seasoning and sauce. Perfect with '
+                                         'soft tortillas!'),
+            follow_redirects=True)
+        self.assertIn(b'New recipe, Slow Cooker Tacos, added!', response.data)
+        self.assertIn(b'It looks a lot like Slow-Cooker Tacos', response.data)
+        response = self.app.post(
+            '/add',
+            data=dict(recipe_title='Hamburgers',
+                      recipe_description='Classic dish elevated with pretzel buns.'),
+            follow_redirects=True)
+        self.assertNotIn(b'It looks a lot like', response.data)
+        self.assertEqual(Recipe.query.count(), 3)
+        self.assertEqual(len(Recipe.query.get(3).minhash), 256)
+
     def test_add_invalid_recipe(self):
         response = self.app.post(
             '/add',
@@ -55,6 +75,294 @@ class ProjectTests(unittest.TestCase):
         self.assertIn(b'ERROR! Recipe was not added.', response.data)
         self.assertIn(b'This field is required.', response.data)
 
+    # Helper function
+    def add_recipes(self, count):
+        for number in range(1, count + 1):
+            db.session.add(Recipe('Recipe {}'.format(number),
+                                  'Description {}'.format(number)))
+        db.session.commit()
+
+    def test_recipes_first_page(self):
+        self.add_recipes(5)
+        response = self.app.get('/')
+        self.assertIn(b'Recipe 1', response.data)
+        self.assertIn(b'Recipe 2', response.data)
+        self.assertNotIn(b'Recipe 3', response.data)
+        self.assertIn(b'/?after=2', response.data)
+        self.assertNotIn(b'before=', response.data)
+
+    def test_recipes_next_and_previous_page(self):
+        self.add_recipes(5)
+        response = self.app.get('/?after=2')
+        self.assertIn(b'Recipe 3', response.data)
+        self.assertIn(b'Recipe 4', response.data)
+        self.assertNotIn(b'Recipe 2', response.data)
+        self.assertIn(b'/?after=4', response.data)
+        self.assertIn(b'/?before=3', response.data)
+        response = self.app.get('/?before=3')
+        self.assertIn(b'Recipe 1', response.data)
+        self.assertIn(b'Recipe 2', response.data)
+        self.assertNotIn(b'Recipe 3', response.data)
+        self.assertNotIn(b'before=', response.data)
+
+    def test_recipes_last_page(self):
+        self.add_recipes(5)
+        response = self.app.get('/?after=4')
+        self.assertIn(b'Recipe 5', response.data)
+        self.assertNotIn(b'after=', response.data)
+        self.assertIn(b'/?before=5', response.data)
+
+    def test_search_recipes(self):
+        db.session.add(Recipe('Hamburgers', 'Classic dish with pretzel buns.'))
+        db.session.add(Recipe('Pretzel Bites', 'Soft and salty.'))
+        db.session.add(Recipe('Tacos', 'Ground beef in taco seasoning.'))
+        db.session.commit()
+        response = self.app.get('/search?q=pretzel')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Hamburgers', response.data)
+        self.assertIn(b'Pretzel Bites', response.data)
+        self.assertNotIn(b'Tacos', response.data)
+        # title matches rank above description matches
+        self.assertLess(response.data.index(b'Pretzel Bites'),
+                        response.data.index(b'Hamburgers'))
+
+    def test_search_includes_added_recipe(self):
+        self.app.post(
+            '/add',
+            data=dict(recipe_title='Hamburgers',
+                      recipe_description='Delicious hamburger with pretzel rolls'),
+            follow_redirects=True)
+        response = self.app.get('/search?q=rolls')
+        self.assertIn(b'Delicious hamburger with pretzel rolls', response.data)
+
+    def test_search_no_results(self):
+        self.add_recipes(3)
+        response = self.app.get('/search?q=lasagna+AND+(')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'No recipes found', response.data)
+
+    def test_search_pages(self):
+        self.add_recipes(5)
+        response = self.app.get('/search?q=recipe')
+        self.assertIn(b'page=2', response.data)
+        response = self.app.get('/search?q=recipe&page=3')
+        self.assertIn(b'Recipe 5', response.data)
+        self.assertNotIn(b'page=4', response.data)
+
+    def autocomplete(self, query):
+        response = self.app.get('/autocomplete?' + query)
+        self.assertEqual(response.status_code, 200)
+        return [recipe['recipe_title']
+                for recipe in json.loads(response.data.decode('utf-8'))['recipes']]
+
+    def test_autocomplete(self):
+        db.session.add_all([Recipe('Hamburger Soup', 'Hearty.'),
+                            Recipe('Classic  Hamburgers', 'Pretzel buns.'),
+                            Recipe('Tacos', 'Ground beef.')])
+        db.session.commit()
+        self.assertEqual(self.autocomplete('q=HAM'), ['Hamburger Soup', 'Classic  Hamburgers'])
+        self.assertEqual(self.autocomplete('q=classic+ham'), ['Classic  Hamburgers'])
+        self.assertEqual(self.autocomplete('q=ham&limit=1'), ['Hamburger Soup'])
+        self.assertEqual(self.autocomplete('q=so'), ['Hamburger Soup'])
+        self.assertEqual(self.autocomplete('q=+'), [])
+        self.assertEqual(self.autocomplete('q=x'), [])
+
+    def test_autocomplete_is_served_from_memory(self):
+        self.add_recipes(2)
+        self.assertEqual(self.autocomplete('q=rec'), ['Recipe 1', 'Recipe 2'])
+        self.app.post('/add', data=dict(recipe_title='Recipe 0', recipe_description='First.'))
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            self.assertEqual(self.autocomplete('q=rec'), ['Recipe 0', 'Recipe 1', 'Recipe 2'])
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertEqual(statements, [])
+        response = self.app.get('/metrics')
+        self.assertIn(b'autocomplete_index_entries{} 6', response.data)
+
+    def test_recipes_page_etag(self):
+        self.add_recipes(1)
+        response = self.app.get('/')
+        etag = response.headers['ETag']
+        response = self.app.get('/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+        response = self.app.get('/?after=1', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_recipes_page_etag_changes_after_add(self):
+        self.add_recipes(1)
+        etag = self.app.get('/').headers['ETag']
+        self.app.post(
+            '/add',
+            data=dict(recipe_title='Hamburgers',
+                      recipe_description='Delicious hamburger with pretzel rolls'),
+            follow_redirects=True)
+        response = self.app.get('/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Hamburgers', response.data)
+
+    def test_recipes_page_etag_changes_after_email_change(self):
+        self.app.post('/register', data=dict(email='patkennedy79@gmail.com',
+                                             password='FlaskIsAwesome',
+                                             confirm='FlaskIsAwesome'),
+                      follow_redirects=True)
+        etag = self.app.get('/').headers['ETag']
+        self.app.post('/email_change', data=dict(email='pat@example.com'),
+                      follow_redirects=True)
+        response = self.app.get('/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'pat@example.com', response.data)
+
+    def test_recipes_list_is_cached(self):
+        self.add_recipes(1)
+        self.app.get('/')
+        db.session.execute(Recipe.__table__.delete())
+        db.session.commit()
+        response = self.app.get('/')
+        self.assertIn(b'Recipe 1', response.data)
+        db.session.add(Recipe('Tacos', 'Ground beef in taco seasoning.'))
+        db.session.commit()
+        response = self.app.get('/')
+        self.assertIn(b'Tacos', response.data)
+        self.assertNotIn(b'Recipe 1', response.data)
+
+    def add_categories(self, *names):
+        categories = [Category(name) for name in names]
+        db.session.add_all(categories)
+        db.session.commit()
+        return categories
+
+    def test_category_page_lists_only_its_recipes(self):
+        dinner, dessert = self.add_categories('Dinner', 'Dessert')
+        db.session.add_all([Recipe('Tacos', 'Ground beef.', dinner.id),
+                            Recipe('Brownies', 'Chocolate.', dessert.id),
+                            Recipe('Lasagna', 'Layered pasta.', dinner.id),
+                            Recipe('Chili', 'Slow cooked.', dinner.id),
+                            Recipe('Toast', 'Uncategorized.')])
+        db.session.commit()
+        response = self.app.get('/category/{}'.format(dinner.id))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Dinner Recipes', response.data)
+        self.assertIn(b'Tacos', response.data)
+        self.assertIn(b'Lasagna', response.data)
+        self.assertNotIn(b'Brownies', response.data)
+        self.assertNotIn(b'Chili', response.data)
+        self.assertIn('/category/{}?after=3'.format(dinner.id).encode('utf-8'),
+                      response.data)
+        response = self.app.get('/category/{}?after=3'.format(dinner.id))
+        self.assertIn(b'Chili', response.data)
+        self.assertNotIn(b'Toast', response.data)
+        self.assertIn('/category/{}?before=4'.format(dinner.id).encode('utf-8'),
+                      response.data)
+        self.assertEqual(self.app.get('/category/99').status_code, 404)
+
+    def test_category_counts_are_maintained(self):
+        dinner, dessert = self.add_categories('Dinner', 'Dessert')
+        db.session.add(Recipe('Tacos', 'Ground beef.', dinner.id))
+        db.session.commit()
+        self.app.post('/add', data=dict(recipe_title='Brownies',
+                                        recipe_description='Chocolate.',
+                                        category=dessert.id))
+        insert_rows(Recipe.__table__, [
+            {'recipe_title': 'Chili', 'recipe_description': 'Slow cooked.',
+             'category_id': dinner.id},
+            {'recipe_title': 'Toast', 'recipe_description': 'Uncategorized.',
+             'category_id': None}])
+        db.session.commit()
+        self.app.post('/api/v1/recipes', content_type='application/json',
+                      data='{"recipes": [{"recipe_title": "Cake", '
+                           '"recipe_description": "Sweet.", "category_id": %d}]}'
+                           % dessert.id)
+        db.session.expire_all()
+        self.assertEqual((dinner.recipe_count, dessert.recipe_count), (2, 2))
+        response = self.app.get('/')
+        self.assertIn(b'Dinner <span class="badge">2</span>', response.data)
+        self.assertIn(b'Dessert <span class="badge">2</span>', response.data)
+
+    def test_category_listing_uses_index(self):
+        query = Recipe.query.filter(Recipe.category_id == 1, Recipe.id > 10) \
+                            .order_by(Recipe.id).limit(25)
+        statement = query.statement.compile(db.engine, compile_kwargs={'literal_binds': True})
+        plan = db.session.execute('EXPLAIN QUERY PLAN {}'.format(statement)).fetchall()
+        self.assertIn('ix_recipes_category_id_id', ' '.join(row[-1] for row in plan))
+        self.assertNotIn('TEMP B-TREE', ' '.join(row[-1] for row in plan))
+
+    def add_users(self, count):
+        insert_rows(User.__table__, [
+            {'email': 'cook{}@example.com'.format(number), '_password': b'x' * 60,
+             'authenticated': False, 'registered_on': datetime.now()}
+            for number in range(1, count + 1)])
+        db.session.commit()
+
+    def selects(self, path):
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('SELECT'):
+                statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            response = self.app.get(path)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        self.assertEqual(response.status_code, 200)
+        return statements
+
+    def count_selects(self, path):
+        return len(self.selects(path))
+
+    def test_recipes_list_shows_authors(self):
+        self.add_users(2)
+        User.query.get(1).name = 'Chef Pat'
+        db.session.add_all([Recipe('Tacos', 'Ground beef.', user_id=1),
+                            Recipe('Toast', 'Bread.', user_id=2)])
+        db.session.commit()
+        response = self.app.get('/')
+        self.assertIn(b'<td>Chef Pat</td>', response.data)
+        self.assertIn(b'<td>Anonymous</td>', response.data)
+        self.assertNotIn(b'cook1', response.data)
+        self.assertNotIn(b'cook2', response.data)
+
+    def test_recipes_list_shows_summaries(self):
+        description = 'Simmer the beans. ' * 50
+        db.session.add(Recipe('Chili', description))
+        db.session.commit()
+        statements = self.selects('/')
+        self.assertFalse(any('recipe_description' in statement for statement in statements))
+        response = self.app.get('/')
+        self.assertIn(b'Simmer the beans. Simmer', response.data)
+        self.assertNotIn(description.strip().encode('utf-8'), response.data)
+        self.assertIn(b'href="/recipe/1"', response.data)
+
+        response = self.app.get('/recipe/1')
+        self.assertIn(description.strip().encode('utf-8'), response.data)
+        self.assertEqual(self.app.get('/recipe/2').status_code, 404)
+
+    def test_summarize(self):
+        self.assertEqual(summarize('  Ground\nbeef.  '), 'Ground beef.')
+        self.assertEqual(summarize('Ground beef, in taco sauce.', 20), 'Ground beef, in taco\u2026')
+        self.assertEqual(summarize('Ground beef, in taco sauce.', 12), 'Ground beef\u2026')
+        self.assertEqual(summarize('Supercalifragilistic', 10), 'Supercalif\u2026')
+
+    def test_recipes_list_statements_do_not_grow_with_page_size(self):
+        self.add_users(20)
+        db.session.add_all([Recipe('Recipe {}'.format(number), 'Description',
+                                   user_id=number) for number in range(1, 21)])
+        db.session.commit()
+        # one query for the category counts and one for the page with its authors
+        self.assertEqual(self.count_selects('/'), 2)
+        self.application.config['RECIPES_PER_PAGE'] = 20
+        try:
+            recipe_cache.clear()
+            self.assertEqual(self.count_selects('/'), 2)
+        finally:
+            self.application.config['RECIPES_PER_PAGE'] = 2
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,139 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from project import create_app, db, load_user, user_cache
+from project.models import Recipe
+from project.routing import ReplicaSet, read_only
+
+
+class ReplicaSetTests(unittest.TestCase):
+    """Checks how a session's replica is chosen."""
+
+    def test_round_robin(self):
+        replicas = ReplicaSet(['a', 'b'])
+        self.assertEqual([replicas.acquire() for _ in range(3)], ['a', 'b', 'a'])
+
+    def test_least_loaded(self):
+        replicas = ReplicaSet(['a', 'b', 'c'], 'least_loaded')
+        self.assertEqual([replicas.acquire() for _ in range(3)], ['a', 'b', 'c'])
+        replicas.release('b')
+        self.assertEqual(replicas.acquire(), 'b')
+        replicas.release('a')
+        replicas.release('c')
+        self.assertEqual(replicas.acquire(), 'c')
+        self.assertEqual(replicas.in_use, {'a': 0, 'b': 1, 'c': 1})
+
+    def test_unknown_selection(self):
+        with self.assertRaises(ValueError):
+            ReplicaSet(['a'], 'fastest')
+
+
+class RoutingTests(unittest.TestCase):
+    """Runs the app against a primary and two replica SQLite files, each
+    holding a different recipe so the responses show which was read."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        paths = [os.path.join(self.directory, name + '.db')
+                 for name in ('primary', 'replica1', 'replica2')]
+        self.application = create_app({
+            'TESTING': True,
+            'WTF_CSRF_ENABLED': False,
+            'DEBUG': False,
+            'MAIL_SUPPRESS_SEND': True,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + paths[0],
+            'SQLALCHEMY_BINDS': {'replica1': 'sqlite:///' + paths[1],
+                                 'replica2': 'sqlite:///' + paths[2]},
+            'SQLALCHEMY_READ_REPLICAS': ['replica1', 'replica2'],
+            'SQLALCHEMY_REPLICA_STICKY_SECONDS': 60,
+        })
+        with self.application.app_context():
+            db.create_all()
+            db.session.remove()
+        for path in paths[1:]:
+            shutil.copy(paths[0], path)
+        for path in paths:
+            name = os.path.basename(path)[:-3]
+            connection = sqlite3.connect(path)
+            connection.execute(
+                "INSERT INTO recipes (recipe_title, recipe_description) VALUES (?, '.')",
+                ('From ' + name,))
+            connection.commit()
+            connection.close()
+        self.paths = paths
+        self.app = self.application.test_client()
+
+    def tearDown(self):
+        for engine in self.application.extensions['sqlalchemy'].connectors.values():
+            engine.get_engine().dispose()
+        shutil.rmtree(self.directory)
+
+    def titles(self):
+        response = self.app.get('/api/v1/recipes')
+        self.assertEqual(response.status_code, 200)
+        return [line for line in ('From primary', 'From replica1', 'From replica2')
+                if line.encode('utf-8') in response.data]
+
+    def test_read_only_views_use_replicas_in_turn(self):
+        self.assertEqual(self.titles(), ['From replica1'])
+        self.assertEqual(self.titles(), ['From replica2'])
+        self.assertEqual(self.titles(), ['From replica1'])
+        replicas = self.application.extensions['read_replicas']
+        self.assertEqual(replicas.in_use, {'replica1': 0, 'replica2': 0})
+        response = self.app.get('/metrics')
+        self.assertIn(b'db_replica_sessions_total{bind="replica1"} 2', response.data)
+
+    def test_search_reads_replica_without_sticking(self):
+        response = self.app.get('/search?q=from')
+        self.assertIn(b'From replica1', response.data)
+        self.assertNotIn('Set-Cookie', response.headers)
+        self.assertEqual(self.titles(), ['From replica2'])
+
+    def test_other_queries_use_primary(self):
+        with self.application.app_context():
+            self.assertEqual(Recipe.query.one().recipe_title, 'From primary')
+            db.session.remove()
+
+    def test_reads_after_write_use_primary(self):
+        with self.application.test_request_context(), read_only():
+            self.assertEqual(Recipe.query.one().recipe_title, 'From replica1')
+            db.session.add(Recipe('Tacos', 'Ground beef.'))
+            db.session.flush()
+            self.assertEqual(Recipe.query.count(), 2)
+            db.session.rollback()
+            self.assertEqual(Recipe.query.count(), 1)
+            self.assertEqual(Recipe.query.one().recipe_title, 'From primary')
+            db.session.remove()
+            self.assertEqual(Recipe.query.one().recipe_title, 'From replica2')
+            db.session.remove()
+
+    def test_client_reads_own_writes_after_redirect(self):
+        response = self.app.post('/add', data=dict(recipe_title='Tacos',
+                                                   recipe_description='Ground beef.'),
+                                 follow_redirects=True)
+        self.assertIn(b'Tacos', response.data)
+        self.assertIn(b'From primary', response.data)
+        self.assertEqual(self.titles(), ['From primary'])
+        # another client still reads from the replicas
+        self.assertEqual(self.application.test_client().get('/api/v1/recipes').data
+                         .count(b'From replica'), 1)
+
+    def test_load_user_reads_replica(self):
+        for path in self.paths[1:]:
+            connection = sqlite3.connect(path)
+            connection.execute(
+                "INSERT INTO users (id, email, _password, authenticated) "
+                "VALUES (7, 'replicated@example.com', ?, 0)", (b'x' * 60,))
+            connection.commit()
+            connection.close()
+        user_cache.clear()
+        with self.application.test_request_context():
+            self.assertEqual(load_user('7').email, 'replicated@example.com')
+            db.session.remove()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,14 @@
+import json
 import os
 import unittest
-from project import app, db, mail
+from itsdangerous import URLSafeTimedSerializer
+from sqlalchemy import create_engine, event, text
+from project import create_app, db, limiter, user_cache, passwords
+from project.models import Recipe, User
+from project.tests.base import AppTestCase
 
-TEST_DB = 'user.db'
 
-
-class UserTests(unittest.TestCase):
+class UserTests(AppTestCase):
     """This class will include functions to setUp() and tearDown() each unit test.
     The setUp() function should specify the key configuration items
     needed for the unit test case.
@@ -13,21 +16,10 @@ class UserTests(unittest.TestCase):
     do anything to start off"""
     # executed prior to each test
     def setUp(self):
-        app.config['TESTING'] = True
-        app.config['WTF_CSRF_ENABLED'] = False
-        app.config['DEBUG'] = False
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + \
-            os.path.join(app.config['BASEDIR'], TEST_DB)
-        self.app = app.test_client()
-        db.drop_all()
-        db.create_all()
-
-        mail.init_app(app)
-        self.assertEquals(app.debug, False)
-
-    # executed after each test
-    def tearDown(self):
-        pass
+        super().setUp()
+        user_cache.clear()
+        limiter.reset()
+        self.assertEquals(self.application.debug, False)
 
     # Helper function
     def register(self, email, password, confirm):
@@ -44,6 +36,10 @@ class UserTests(unittest.TestCase):
             follow_redirects=True
             )
 
+    def confirmation_link(self, email):
+        serializer = URLSafeTimedSerializer(self.application.config['SECRET_KEY'])
+        return '/confirm/{}'.format(serializer.dumps(email, salt='email-confirmation-salt'))
+
     # check that the registration page comes up correctly,
     # as indicated by getting a ‘200’ code back when we request the page:
     def test_user_registration_form_displays(self):
@@ -89,11 +85,61 @@ class UserTests(unittest.TestCase):
         response = self.login('patkennedy79@gmail.com', 'FlaskIsAwesome')
         self.assertIn(b'patkennedy79@gmail.com', response.data)
 
+    def test_login_ignores_email_case(self):
+        self.register('PatKennedy79@gmail.com', 'FlaskIsAwesome', 'FlaskIsAwesome')
+        self.app.get('/logout', follow_redirects=True)
+        response = self.login('patkennedy79@GMAIL.com', 'FlaskIsAwesome')
+        self.assertIn(b'Log Out', response.data)
+        self.assertIn(b'PatKennedy79@gmail.com', response.data)
+
+    def test_registration_rejects_email_differing_in_case(self):
+        self.register('patkennedy79@gmail.com', 'FlaskIsAwesome', 'FlaskIsAwesome')
+        self.app.get('/logout', follow_redirects=True)
+        response = self.register('PatKennedy79@Gmail.com', 'FlaskIsAwesome', 'FlaskIsAwesome')
+        self.assertIn(b'already exists', response.data)
+        self.assertEqual(User.query.count(), 1)
+
+    def test_email_lookup_uses_index(self):
+        statement = User.with_email('Pat@Example.com').statement.compile()
+        plan = db.session.execute(text('EXPLAIN QUERY PLAN ' + str(statement)),
+                                  statement.params).fetchall()
+        self.assertIn('USING INDEX ix_users_email_normalized',
+                      ' '.join(str(row[-1]) for row in plan))
+
     def test_login_without_registering(self):
         self.app.get('/login', follow_redirects=True)
         response = self.login('patkennedy79@gmail.com', 'FlaskIsAwesome')
         self.assertIn(b'ERROR! Incorrect login credentials.', response.data)
 
+    def test_login_rehashes_password_with_new_cost(self):
+        passwords.rounds = 4
+        try:
+            db.session.add(User('patkennedy79@gmail.com', 'FlaskIsAwesome'))
+            db.session.commit()
+        finally:
+            passwords.rounds = self.application.config['BCRYPT_LOG_ROUNDS']
+        user = User.query.filter_by(email='patkennedy79@gmail.com').first()
+        self.assertTrue(user.password_needs_rehash)
+        response = self.login('patkennedy79@gmail.com', 'FlaskIsAwesome')
+        self.assertIn(b'Log Out', response.data)
+        db.session.remove()
+        user = User.query.filter_by(email='patkennedy79@gmail.com').first()
+        self.assertFalse(user.password_needs_rehash)
+        self.assertTrue(user.is_correct_password('FlaskIsAwesome'))
+
+    def test_login_rejected_when_password_hasher_busy(self):
+        self.register('patkennedy79@gmail.com', 'FlaskIsAwesome', 'FlaskIsAwesome')
+        self.app.get('/logout', follow_redirects=True)
+        slots = passwords.workers + self.application.config['BCRYPT_QUEUE_SIZE']
+        for _ in range(slots):
+            passwords._slots.acquire()
+        try:
+            response = self.login('patkennedy79@gmail.com', 'FlaskIsAwesome')
+        finally:
+            for _ in range(slots):
+                passwords._slots.release()
+        self.assertEqual(response.status_code, 503)
+
     def test_valid_logout(self):
         self.app.get('/register', follow_redirects=True)
         self.register('patkennedy79@gmail.com', 'FlaskIsAwesome', 'FlaskIsAwesome')
@@ -102,10 +148,47 @@ class UserTests(unittest.TestCase):
         response = self.app.get('/logout', follow_redirects=True)
         self.assertIn(b'Goodbye!', response.data)
 
+    def test_login_records_login_times(self):
+        self.register('patkennedy79@gmail.com', 'FlaskIsAwesome', 'FlaskIsAwesome')
+        self.app.get('/logout', follow_redirects=True)
+        registered = User.query.filter_by(email='patkennedy79@gmail.com').one().current_logged_in
+        self.login('patkennedy79@gmail.com', 'FlaskIsAwesome')
+        user = User.query.filter_by(email='patkennedy79@gmail.com').one()
+        self.assertEqual(user.last_logged_in, registered)
+        self.assertGreaterEqual(user.current_logged_in, registered)
+
+    def test_logout_does_not_write_user(self):
+        self.register('patkennedy79@gmail.com', 'FlaskIsAwesome', 'FlaskIsAwesome')
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            response = self.app.get('/logout', follow_redirects=True)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertIn(b'Goodbye!', response.data)
+        self.assertFalse([s for s in statements if s.startswith('UPDATE users')])
+
     def test_invalid_logout_within_being_logged_in(self):
         response = self.app.get('/logout', follow_redirects=True)
         self.assertIn(b'Log In', response.data)
 
+    def test_confirm_email(self):
+        self.register('patkennedy79@gmail.com', 'FlaskIsAwesome', 'FlaskIsAwesome')
+        response = self.app.get(self.confirmation_link('PatKennedy79@gmail.com'),
+                                follow_redirects=True)
+        self.assertIn(b'Thank you for confirming your email address!', response.data)
+        self.assertTrue(User.query.filter_by(email='patkennedy79@gmail.com').one()
+                        .email_confirmed)
+
+    def test_confirm_email_of_removed_user(self):
+        response = self.app.get(self.confirmation_link('gone@example.com'),
+                                follow_redirects=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'The confirmation link is invalid or has expired.', response.data)
+
     def test_user_profile_page(self):
         self.app.get('/register', follow_redirects=True)
         self.register('patkennedy79@gmail.com', 'FlaskIsAwesome', 'FlaskIsAwesome')
@@ -128,6 +211,60 @@ class UserTests(unittest.TestCase):
         self.assertIn(b'Statistics', response.data)
         self.assertIn(b'Last Logged In: ', response.data)
 
+    def test_user_profile_lists_my_recipes(self):
+        self.register('patkennedy79@gmail.com', 'FlaskIsAwesome', 'FlaskIsAwesome')
+        response = self.app.get('/user_profile')
+        self.assertIn(b"You haven't added any recipes yet.", response.data)
+        self.app.post('/add', data=dict(recipe_title='Hamburgers',
+                                        recipe_description='With pretzel rolls'))
+        db.session.add(Recipe('Tacos', 'Someone else\'s recipe.'))
+        db.session.commit()
+        self.assertEqual(Recipe.query.filter_by(recipe_title='Hamburgers').one().owner.email,
+                         'patkennedy79@gmail.com')
+        response = self.app.get('/user_profile')
+        self.assertIn(b'My Recipes', response.data)
+        self.assertIn(b'Hamburgers', response.data)
+        self.assertNotIn(b'Tacos', response.data)
+
+    def test_user_profile_sets_display_name(self):
+        self.register('patkennedy79@gmail.com', 'FlaskIsAwesome', 'FlaskIsAwesome')
+        self.app.post('/add', data=dict(recipe_title='Hamburgers',
+                                        recipe_description='With pretzel rolls'))
+        response = self.app.get('/')
+        self.assertIn(b'<td>Anonymous</td>', response.data)
+        self.assertNotIn(b'patkennedy79', response.data.split(b'<table', 1)[1])
+
+        response = self.app.post('/display_name_change', data=dict(name=' Chef Pat '),
+                                 follow_redirects=True)
+        self.assertIn(b'Display name updated!', response.data)
+        self.assertIn(b'value="Chef Pat"', response.data)
+        self.assertEqual(User.query.filter_by(email='patkennedy79@gmail.com').one().name,
+                         'Chef Pat')
+        self.assertIn(b'<td>Chef Pat</td>', self.app.get('/').data)
+
+        self.app.post('/display_name_change', data=dict(name=''))
+        self.assertIn(b'<td>Anonymous</td>', self.app.get('/').data)
+
+    def test_user_profile_uses_cached_user(self):
+        self.app.get('/register', follow_redirects=True)
+        self.register('patkennedy79@gmail.com', 'FlaskIsAwesome', 'FlaskIsAwesome')
+        self.app.get('/user_profile')
+        hits = user_cache.hits
+        response = self.app.get('/user_profile')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'patkennedy79@gmail.com', response.data)
+        self.assertEqual(user_cache.hits, hits + 1)
+
+    def test_user_cache_invalidated_on_email_change(self):
+        self.app.get('/register', follow_redirects=True)
+        self.register('patkennedy79@gmail.com', 'FlaskIsAwesome', 'FlaskIsAwesome')
+        self.app.get('/user_profile')
+        self.assertEqual(len(user_cache), 1)
+        self.app.post('/email_change', data=dict(email='patkennedy79@blaa.com'))
+        self.assertEqual(len(user_cache), 0)
+        response = self.app.get('/user_profile')
+        self.assertIn(b'patkennedy79@blaa.com', response.data)
+
     def test_user_profile_without_logging_in(self):
         response = self.app.get('/user_profile')
         self.assertEqual(response.status_code, 302)
@@ -197,5 +334,30 @@ class UserTests(unittest.TestCase):
         self.assertIn(b'Need an account?', response.data)
 
 
+@unittest.skipUnless(os.environ.get('TEST_POSTGRESQL_URL'),
+                     'set TEST_POSTGRESQL_URL to a scratch PostgreSQL database')
+class PostgreSQLEmailIndexTests(unittest.TestCase):
+    """Checks the plan of the email lookup on PostgreSQL, creating the
+    users table in a transaction that is rolled back."""
+
+    def test_email_lookup_uses_index(self):
+        engine = create_engine(os.environ['TEST_POSTGRESQL_URL'])
+        with engine.connect() as connection:
+            transaction = connection.begin()
+            try:
+                User.__table__.create(connection)
+                # the table is empty, which would make a scan cheapest
+                connection.execute('SET LOCAL enable_seqscan = off')
+                with create_app({'TESTING': True}).app_context():
+                    statement = User.with_email('Pat@Example.com').statement.compile()
+                plan = connection.execute(
+                    text('EXPLAIN (FORMAT JSON) ' + str(statement)), statement.params).scalar()
+            finally:
+                transaction.rollback()
+        if not isinstance(plan, str):
+            plan = json.dumps(plan)
+        self.assertIn('"Index Name": "ix_users_email_normalized"', plan)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,100 @@
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import Flask
+from project.passwords import PasswordHasher
+from project.workers import WorkerPool
+
+
+def stall_once(path):
+    # the first call reports its pid and waits to be killed; a retry returns
+    if os.path.exists(path):
+        return 'retried'
+    with open(path + '.tmp', 'w') as output:
+        output.write(str(os.getpid()))
+    os.replace(path + '.tmp', path)
+    time.sleep(60)
+
+
+def kill_when_stalled(path):
+    deadline = time.time() + 30
+    while not os.path.exists(path) and time.time() < deadline:
+        time.sleep(0.01)
+    with open(path) as source:
+        os.kill(int(source.read()), signal.SIGKILL)
+
+
+def kill_busy_worker(pool, path):
+    """Kill the worker of ``pool`` while it runs a job, as the kernel
+    would when out of memory, and return the job's future."""
+    future = pool.submit(stall_once, path)
+    kill_when_stalled(path)
+    return future
+
+
+class WorkerPoolTests(unittest.TestCase):
+    """Kills busy workers of a pool and checks it keeps working."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'pid')
+        self.pool = WorkerPool(1)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_run_retried_when_worker_killed(self):
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(self.pool.run(stall_once, self.path)))
+        thread.start()
+        kill_when_stalled(self.path)
+        thread.join(30)
+        self.assertEqual(results, ['retried'])
+
+    def test_new_pool_after_worker_killed(self):
+        future = kill_busy_worker(self.pool, self.path)
+        with self.assertRaises(BrokenProcessPool):
+            future.result(timeout=30)
+        self.assertEqual(self.pool.run(abs, -1), 1)
+        self.assertEqual(self.pool.map(abs, [-1, -2]), [1, 2])
+
+
+class PasswordHasherPoolTests(unittest.TestCase):
+    """Kills a busy bcrypt worker of a hasher and checks it keeps working."""
+
+    def setUp(self):
+        app = Flask(__name__)
+        app.config.update(BCRYPT_LOG_ROUNDS=4, BCRYPT_WORKERS=1, BCRYPT_QUEUE_SIZE=1)
+        self.hasher = PasswordHasher(app)
+        self.directory = tempfile.mkdtemp()
+        future = kill_busy_worker(self.hasher._pool, os.path.join(self.directory, 'pid'))
+        with self.assertRaises(BrokenProcessPool):
+            future.result(timeout=30)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_hash_after_worker_killed(self):
+        hashed = self.hasher.hash('FlaskIsAwesome')
+        self.assertTrue(self.hasher.check(hashed, 'FlaskIsAwesome'))
+
+    def test_hash_many_after_worker_killed(self):
+        hashes = self.hasher.hash_many(['one', 'two'])
+        self.assertTrue(self.hasher.check(hashes[1], 'two'))
+
+    def test_slots_released_after_worker_killed(self):
+        for _ in range(3):
+            self.hasher.hash('FlaskIsAwesome')
+        self.assertTrue(self.hasher._slots.acquire(blocking=False))
+        self.assertTrue(self.hasher._slots.acquire(blocking=False))
+
+
+if __name__ == '__main__':
+    unittest.main()
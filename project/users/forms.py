@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm as Form
 from wtforms import StringField, PasswordField
-from wtforms.validators import DataRequired, Length, EqualTo, Email
+from wtforms.validators import DataRequired, Length, EqualTo, Email, Optional
 
 
 class RegisterForm(Form):
@@ -32,3 +32,8 @@ class EmailForm(Form):
 class PasswordForm(Form):
     """docstring for PasswordForm"""
     password = PasswordField('Password', validators=[DataRequired()])
+
+
+class DisplayNameForm(Form):
+    """docstring for DisplayNameForm"""
+    name = StringField('Display Name', validators=[Optional(), Length(max=40)])
@@ -2,18 +2,20 @@
 #### imports ####
 #################
 
-from flask import render_template, Blueprint, request, redirect, url_for, flash
+from flask import render_template, Blueprint, request, redirect, url_for, flash, \
+    current_app
 from sqlalchemy.exc import IntegrityError
 from flask_login import login_user, current_user, login_required, logout_user
 from flask_mail import Message
-from threading import Thread
 from itsdangerous import URLSafeTimedSerializer
 from datetime import datetime
 
 
-from .forms import RegisterForm, LoginForm, EmailForm, PasswordForm
-from project import db, mail, app
-from project.models import User
+from .forms import RegisterForm, LoginForm, EmailForm, PasswordForm, DisplayNameForm
+from project import db, limiter, login_times, mail_dispatcher, recipe_cache, user_cache
+from project.models import Recipe, User
+from project.pagination import keyset_paginate
+from project.routing import read_only
 
 
 ################
@@ -36,20 +38,14 @@ def flash_errors(form):
             ), 'info')
 
 
-def send_async_email(msg):
-    with app.app_context():
-        mail.send(msg)
-
-
 def send_email(subject, recipients, html_body):
     msg = Message(subject, recipients=recipients)
     msg.html = html_body
-    thr = Thread(target=send_async_email, args=[msg])
-    thr.start()
+    mail_dispatcher.send(msg)
 
 
 def send_confirmation_email(user_email):
-    confirm_serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'])
+    confirm_serializer = URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
 
     confirm_url = url_for(
         'users.confirm_email',
@@ -64,7 +60,7 @@ def send_confirmation_email(user_email):
 
 
 def send_password_reset_email(user_email):
-    password_reset_serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'])
+    password_reset_serializer = URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
 
     password_reset_url = url_for(
         'users.reset_with_token',
@@ -89,7 +85,6 @@ def register():
         if form.validate_on_submit():
             try:
                 new_user = User(form.email.data, form.password.data)
-                new_user.authenticated = True
                 db.session.add(new_user)
                 db.session.commit()
                 login_user(new_user)
@@ -110,14 +105,15 @@ def register():
 def login():
     form = LoginForm(request.form)
     if request.method == 'POST':
+        limiter.check('login', request.form.get('email'))
         if form.validate_on_submit():
-            user = User.query.filter_by(email=form.email.data).first()
+            user = User.with_email(form.email.data).first()
             if user is not None and user.is_correct_password(form.password.data):
-                user.authenticated = True
-                user.last_logged_in = user.current_logged_in
-                user.current_logged_in = datetime.now()
-                db.session.add(user)
-                db.session.commit()
+                if user.password_needs_rehash:
+                    user.password = form.password.data
+                    db.session.commit()
+                    user_cache.delete(user.id)
+                login_times.record(user.id, datetime.now())
                 login_user(user)
                 flash('Thanks for logging in, {}'.format(current_user.email))
                 return redirect(url_for('recipes.index'))
@@ -129,10 +125,6 @@ def login():
 @users_blueprint.route('/logout')
 @login_required
 def logout():
-    user = current_user
-    user.authenticated = False
-    db.session.add(user)
-    db.session.commit()
     logout_user()
     flash('Goodbye!', 'info')
     return redirect(url_for('users.login'))
@@ -141,7 +133,7 @@ def logout():
 @users_blueprint.route('/confirm/<token>')
 def confirm_email(token):
     try:
-        confirm_serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'])
+        confirm_serializer = URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
         email = confirm_serializer.loads(token,
                                          salt='email-confirmation-salt',
                                          max_age=3600)
@@ -149,8 +141,12 @@ def confirm_email(token):
         flash('The confirmation link is invalid or has expired.', 'error')
         return redirect(url_for('users.login'))
 
-    user = User.query.filter_by(email=email).first()
+    user = User.with_email(email).first()
 
+    if user is None:
+        # the account was removed after the link was sent
+        flash('The confirmation link is invalid or has expired.', 'error')
+        return redirect(url_for('users.login'))
     if user.email_confirmed:
         flash('Account already confirmed. Please login.', 'info')
     else:
@@ -158,6 +154,7 @@ def confirm_email(token):
         user.email_confirmed_on = datetime.now()
         db.session.add(user)
         db.session.commit()
+        user_cache.delete(user.id)
         flash('Thank you for confirming your email address!', 'success')
 
     return redirect(url_for('recipes.index'))
@@ -166,9 +163,11 @@ def confirm_email(token):
 @users_blueprint.route('/reset', methods=['GET', 'POST'])
 def reset():
     form = EmailForm()
+    if request.method == 'POST':
+        limiter.check('reset', request.form.get('email'))
     if form.validate_on_submit():
         try:
-            user = User.query.filter_by(email=form.email.data).first_or_404()
+            user = User.with_email(form.email.data).first_or_404()
         except:
             flash('Invalid email address!', 'error')
             return render_template('password_reset_email.html', form=form)
@@ -189,7 +188,7 @@ def reset():
 @users_blueprint.route('/reset/<token>', methods=['GET', 'POST'])
 def reset_with_token(token):
     try:
-        password_reset_serializer = URLSafeTimedSerializer(app.config['SECRET_KEY'])
+        password_reset_serializer = URLSafeTimedSerializer(current_app.config['SECRET_KEY'])
         email = password_reset_serializer.loads(token,
                                                 salt='password-reset-salt',
                                                 max_age=3600)
@@ -197,11 +196,13 @@ def reset_with_token(token):
         flash('The password reset links is invalid or has expired.', 'error')
         return redirect(url_for('users.login'))
 
+    if request.method == 'POST':
+        limiter.check('reset_with_token', email)
     form = PasswordForm()
 
     if form.validate_on_submit():
         try:
-            user = User.query.filter_by(email=email).first_or_404()
+            user = User.with_email(email).first_or_404()
         except:
             flash('Invalid email address!', 'error')
             return redirect(url_for('users.login'))
@@ -209,6 +210,7 @@ def reset_with_token(token):
         user.password = form.password.data
         db.session.add(user)
         db.session.commit()
+        user_cache.delete(user.id)
         flash('Your password has been updated!', 'success')
         return redirect(url_for('users.login'))
 
@@ -217,8 +219,33 @@ def reset_with_token(token):
 
 @users_blueprint.route('/user_profile')
 @login_required
+@read_only()
 def user_profile():
-    return render_template('user_profile.html')
+    recipes = keyset_paginate(Recipe.query.filter(Recipe.user_id == current_user.id),
+                              Recipe.id, per_page=current_app.config['RECIPES_PER_PAGE'],
+                              after=request.args.get('after', type=int),
+                              before=request.args.get('before', type=int))
+    form = DisplayNameForm(name=current_user.name)
+    return render_template('user_profile.html', recipes=recipes, form=form,
+                           endpoint='users.user_profile', args={})
+
+
+@users_blueprint.route('/display_name_change', methods=['POST'])
+@login_required
+def user_display_name_change():
+    form = DisplayNameForm()
+    if form.validate_on_submit():
+        user = current_user
+        user.name = form.name.data.strip() or None
+        db.session.add(user)
+        db.session.commit()
+        user_cache.delete(user.id)
+        # the cached recipe listings show the old author name
+        recipe_cache.bump()
+        flash('Display name updated!', 'success')
+    else:
+        flash_errors(form)
+    return redirect(url_for('users.user_profile'))
 
 
 @users_blueprint.route('/email_change', methods=["GET", "POST"])
@@ -228,7 +255,7 @@ def user_email_change():
     if request.method == 'POST':
         if form.validate_on_submit():
             try:
-                user_check = User.query.filter_by(email=form.email.data).first()
+                user_check = User.with_email(form.email.data).first()
                 if user_check is None:
                     user = current_user
                     user.email = form.email.data
@@ -237,6 +264,7 @@ def user_email_change():
                     user.email_confirmation_sent_on = datetime.now()
                     db.session.add(user)
                     db.session.commit()
+                    user_cache.delete(user.id)
                     send_confirmation_email(user.email)
                     flash('Email changed!  Please confirm your new email address (link sent to new email).', 'success')
                     return redirect(url_for('users.user_profile'))
@@ -257,6 +285,7 @@ def user_password_change():
             user.password = form.password.data
             db.session.add(user)
             db.session.commit()
+            user_cache.delete(user.id)
             flash('Password has been updated!', 'success')
             return redirect(url_for('users.user_profile'))
     return render_template('password_change.html', form=form)
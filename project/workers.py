@@ -0,0 +1,55 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+class WorkerPool(object):
+    """A pool of ``workers`` processes for CPU-bound work.
+
+    The processes are started on first use in each process, so a
+    pre-forking server never inherits them.  If a worker dies (killed
+    for memory, or crashed), the pool is broken for good, so it is thrown
+    away and the work is tried once more on a new one.
+    """
+
+    def __init__(self, workers=0):
+        self.workers = workers
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def run(self, func, *args):
+        """Return ``func(*args)`` computed in a worker."""
+        return self._retry(lambda executor: executor.submit(func, *args).result())
+
+    def map(self, func, *iterables):
+        """Return ``list(map(func, *iterables))`` computed on all workers."""
+        iterables = [list(iterable) for iterable in iterables]
+        return self._retry(lambda executor: list(executor.map(func, *iterables)))
+
+    def submit(self, func, *args):
+        """Start ``func(*args)`` in a worker and return its future."""
+        return self._retry(lambda executor: executor.submit(func, *args))
+
+    def _retry(self, call):
+        executor = self._get_executor()
+        try:
+            return call(executor)
+        except BrokenProcessPool:
+            self._discard(executor)
+            return call(self._get_executor())
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                self._pid = os.getpid()
+            return self._executor
+
+    def _discard(self, executor):
+        with self._lock:
+            # another thread may have replaced it already
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
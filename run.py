@@ -1,4 +1,7 @@
-from project import app
+from project import create_app
+
+
+app = create_app()
 
 
 if __name__ == '__main__':